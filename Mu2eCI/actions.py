@@ -0,0 +1,252 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from Mu2eCI import config
+from Mu2eCI import test_suites
+from Mu2eCI import tracing
+from Mu2eCI.logger import get_logger
+from Mu2eCI.messages import TESTS_NOT_TRIGGERED
+from Mu2eCI.common import (
+    post_on_pr,
+    create_status,
+    create_reaction,
+    edit_label_color,
+    trigger_tests,
+)
+
+log = get_logger(__name__)
+
+# The side effects process_pr decides on, as data
+React = namedtuple("React", ["comment_id", "content"])
+TriggerTest = namedtuple("TriggerTest", ["test", "base_sha", "extra_env"])
+SetStatus = namedtuple("SetStatus", ["context", "state", "description", "target_url"])
+SetLabels = namedtuple("SetLabels", ["labels"])
+SetLabelColor = namedtuple("SetLabelColor", ["name", "color"])
+# 'announces' are the tests a comment is there to say have been triggered,
+# and without which it is not posted
+Comment = namedtuple("Comment", ["body", "announces"])
+
+# the status of the build test's base branch commit (see process_pr)
+LAST_BUILD_CONTEXT = "mu2e/buildtest/last"
+
+
+class Plan:
+    """
+    The actions to take on a PR, collected by process_pr and carried out by
+    apply_plan. 'pr' is the PRSnapshot the decisions were based on, which is
+    used to drop actions that would not change anything.
+    """
+
+    def __init__(self, repo, issue, pr, bot_comments):
+        self.repo = repo
+        self.issue = issue
+        self.pr = pr
+        self.bot_comments = bot_comments
+        self.actions = []
+
+    def react(self, comment_id, content):
+        self.actions.append(React(comment_id, content))
+
+    def trigger(self, test, base_sha, extra_env):
+        self.actions.append(TriggerTest(test, base_sha, extra_env))
+
+    def set_status(self, context, state, description, target_url):
+        self.actions.append(SetStatus(context, state, description, target_url))
+
+    def set_labels(self, labels):
+        self.actions.append(SetLabels(sorted(labels)))
+
+    def set_label_color(self, name, color):
+        self.actions.append(SetLabelColor(name, color))
+
+    def comment(self, body, announces=()):
+        self.actions.append(Comment(body, tuple(announces)))
+
+    def __str__(self):
+        return format_actions(self.actions)
+
+
+def format_actions(actions):
+    if not actions:
+        return "(nothing to do)"
+    return "\n".join(
+        "- %s %s" % (type(action).__name__, dict(action._asdict()))
+        for action in actions
+    )
+
+
+def reduce_plan(plan):
+    # Drop actions that would not change anything on GitHub.
+    current_status = {}
+    for stat in sorted(plan.pr.statuses, key=lambda s: s.updated_at):
+        current_status[stat.context] = (stat.state, stat.description, stat.target_url)
+    current_labels = {x.name for x in plan.pr.labels if "unrecognised" not in x.name}
+    current_colors = {x.name: x.color for x in plan.pr.labels}
+
+    # statuses of (re)triggered tests are always set, as their update time
+    # is when the stall timer starts
+    triggered = {
+        test_suites.get_test_alias(a.test)
+        for a in plan.actions
+        if isinstance(a, TriggerTest)
+    }
+
+    # only the last status set for each context matters
+    last_status = {}
+    for i, action in enumerate(plan.actions):
+        if isinstance(action, SetStatus):
+            last_status[action.context] = i
+
+    actions = []
+    for i, action in enumerate(plan.actions):
+        if isinstance(action, SetStatus):
+            if last_status[action.context] != i:
+                continue
+            if action.context not in triggered and current_status.get(
+                action.context
+            ) == (action.state, action.description, action.target_url):
+                continue
+        elif isinstance(action, SetLabels):
+            if set(action.labels) == current_labels:
+                continue
+        elif isinstance(action, SetLabelColor):
+            if current_colors.get(action.name) == action.color:
+                continue
+        actions.append(action)
+    return actions
+
+
+def _apply(plan, action):
+    repo, sha = plan.repo, plan.pr.commit.sha
+    if isinstance(action, React):
+        create_reaction(repo, action.comment_id, action.content)
+    elif isinstance(action, SetStatus):
+        create_status(
+            repo,
+            sha,
+            state=action.state,
+            target_url=action.target_url,
+            description=action.description,
+            context=action.context,
+        )
+    elif isinstance(action, SetLabels):
+        plan.issue.edit(labels=list(action.labels))
+    elif isinstance(action, SetLabelColor):
+        edit_label_color(repo, action.name, action.color)
+    elif isinstance(action, Comment):
+        post_on_pr(plan.issue, action.body, plan.bot_comments)
+
+
+def _trigger(plan, triggers):
+    # Returns the tests that could not be triggered.
+    try:
+        triggered = trigger_tests(
+            plan.repo.full_name,
+            plan.pr.number,
+            plan.pr.commit.sha,
+            [(a.test, a.base_sha, a.extra_env) for a in triggers],
+        )
+    except Exception:
+        log.exception("Failed to trigger %s", ", ".join(a.test for a in triggers))
+        triggered = [False] * len(triggers)
+    return {a.test for a, ok in zip(triggers, triggered) if not ok}
+
+
+def _without_failed_triggers(plan, actions, failed):
+    # Say what happened to the tests that could not be triggered, in place
+    # of what was planned for them.
+    contexts = {test_suites.get_test_alias(test) for test in failed}
+    result = []
+    for action in actions:
+        if isinstance(action, TriggerTest) and action.test in failed:
+            continue
+        if isinstance(action, SetStatus):
+            if action.context == LAST_BUILD_CONTEXT and "build" in failed:
+                continue
+            if action.context in contexts:
+                action = action._replace(
+                    state="error",
+                    description="The test could not be triggered in Jenkins. "
+                    "It can be re-triggered.",
+                )
+        elif isinstance(action, SetLabels):
+            pending = {"%s pending" % test for test in failed}
+            action = SetLabels(
+                sorted(
+                    (
+                        "%s error" % label[: -len(" pending")]
+                        if label in pending
+                        else label
+                    )
+                    for label in action.labels
+                )
+            )
+        elif isinstance(action, Comment) and action.announces:
+            if set(action.announces) <= failed:
+                continue
+        result.append(action)
+    result.append(
+        Comment(
+            TESTS_NOT_TRIGGERED.format(
+                commit_link=plan.pr.commit.sha,
+                test_list=", ".join(
+                    t for t in test_suites.SUPPORTED_TESTS if t in failed
+                ),
+            ),
+            (),
+        )
+    )
+    return result
+
+
+def apply_plan(plan, dryRun=False):
+    # Returns the actions carried out, in order: those that failed are left
+    # out. A dry run returns the actions it would have carried out.
+    actions = reduce_plan(plan)
+    log.info(
+        "Plan for %s#%s (%d of %d actions needed):\n%s",
+        plan.repo.full_name,
+        plan.pr.number,
+        len(actions),
+        len(plan.actions),
+        format_actions(actions),
+    )
+    if dryRun:
+        return actions
+
+    def apply(action):
+        try:
+            _apply(plan, action)
+            return True
+        except Exception:
+            log.exception("Failed to apply %s", action)
+            return False
+
+    with tracing.span("writes"):
+        # Tests are triggered first (all at once, as the trigger backend may
+        # batch them), as their statuses and comments depend on whether they
+        # could be. Those that could not are dropped from the actions.
+        triggers = [a for a in actions if isinstance(a, TriggerTest)]
+        if triggers:
+            failed = _trigger(plan, triggers)
+            if failed:
+                actions = _without_failed_triggers(plan, actions, failed)
+        applied = {id(a) for a in actions if isinstance(a, TriggerTest)}
+
+        # Reactions, statuses (one per context) and label colours are
+        # independent of each other, so they can be made in parallel.
+        # Labels and comments follow, with comments kept in order.
+        independent = [
+            a for a in actions if isinstance(a, (React, SetStatus, SetLabelColor))
+        ]
+        ordered = [a for a in actions if isinstance(a, (SetLabels, Comment))]
+        with ThreadPoolExecutor(max_workers=config.main["actions"]["workers"]) as pool:
+            for action, ok in zip(
+                independent, pool.map(tracing.wrap(apply), independent)
+            ):
+                if ok:
+                    applied.add(id(action))
+        for action in ordered:
+            if apply(action):
+                applied.add(id(action))
+    return [a for a in actions if id(a) in applied]
@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import tracemalloc
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from Mu2eCI import config
+from Mu2eCI import fake_github
+from Mu2eCI.build_queue import Sample
+from Mu2eCI.common import check_test_cmd_mu2e
+from Mu2eCI.comment_gh_pr import comment_gh_pr
+from Mu2eCI.process_pr import process_pr
+
+# Sizes of the synthetic PRs and repository the scenarios run against
+Scale = namedtuple("Scale", ["comments", "statuses", "files", "watchers", "open_prs"])
+
+# best and median wall time in seconds, API calls made by one run, and the
+# peak memory allocated (in bytes) during one run
+Result = namedtuple(
+    "Result", ["scenario", "best", "median", "calls", "peak_memory", "endpoints"]
+)
+
+REPOSITORY = "Mu2e/Offline"
+TEAM = "write"
+USERS = ["alice", "bob", "carol", "dave"]
+
+
+def setup_environment(workdir, watchers):
+    # Keep everything the bot writes (caches, trigger properties files) in
+    # workdir, and replace the config that shapes the scenarios.
+    os.environ["MU2ECI_CACHE_DIR"] = os.path.join(workdir, "cache")
+    os.chdir(workdir)
+
+    main = dict(config.main)
+    # a recent build queue sample is always at hand (see fresh_cache), so
+    # Jenkins is never asked
+    main["build_queue"] = dict(main["build_queue"], ttl=10**9, max_age=10**9)
+    main["jenkins"] = dict(main["jenkins"], trigger="properties")
+    main["tracing"] = dict(main.get("tracing", {}), summary=False, textfile_dir=None)
+    config.override("main", main)
+    config.override("auth_teams", {"all": [TEAM]})
+    config.override(
+        "watchers",
+        {
+            # plain folder names, and a regular expression for every fifth user
+            "watcher%d" % i: ["Pkg%03d" % (i % 20)]
+            + (["Pkg0[0-4].*"] if i % 5 == 0 else [])
+            for i in range(watchers)
+        },
+    )
+
+
+def fresh_cache(workdir):
+    # each run starts without comment cursors or cached membership, and the
+    # cache of the last run (if in workdir) is removed
+    previous = os.environ.get("MU2ECI_CACHE_DIR")
+    os.environ["MU2ECI_CACHE_DIR"] = tempfile.mkdtemp(dir=workdir)
+    if previous and os.path.dirname(previous) == workdir:
+        shutil.rmtree(previous, ignore_errors=True)
+    with open(config.cache_path("build_queue.json"), "w") as f:
+        json.dump(Sample(3, 8, 1800.0, time.time())._asdict(), f)
+
+
+def make_world(scale, graphql=True):
+    gh = fake_github.Github(config.main["bot"]["username"], graphql=graphql)
+    gh.create_org("Mu2e").add_team(TEAM, USERS)
+    repo = gh.create_repo(REPOSITORY)
+    pr = fake_github.generate_pr(
+        repo,
+        files=scale.files,
+        comments=scale.comments,
+        statuses=scale.statuses,
+        commenters=USERS + ["someone-else"],
+    )
+    return gh, repo, pr
+
+
+# Each scenario takes the scale and whether to use GraphQL, sets up a fake
+# GitHub (untimed), and returns it with the function to time.
+
+
+def new_pr(scale, graphql):
+    gh, repo, pr = make_world(scale, graphql)
+    return gh, lambda: process_pr(gh, repo, repo.get_issue(pr.number))
+
+
+def no_new_events(scale, graphql):
+    gh, repo, pr = make_world(scale, graphql)
+    process_pr(gh, repo, repo.get_issue(pr.number))
+    return gh, lambda: process_pr(gh, repo, repo.get_issue(pr.number))
+
+
+def test_requested(scale, graphql):
+    gh, repo, pr = make_world(scale, graphql)
+    process_pr(gh, repo, repo.get_issue(pr.number))
+    pr.add_comment("bob", "@%s run code checks" % gh.login)
+    return gh, lambda: process_pr(gh, repo, repo.get_issue(pr.number))
+
+
+def merged(scale, graphql):
+    # the PR was merged a moment ago, so every other open PR is re-checked
+    gh, repo, pr = make_world(scale, graphql)
+    for i in range(scale.open_prs):
+        fake_github.generate_pr(
+            repo, files=5, comments=3, statuses=3, author=USERS[i % len(USERS)]
+        )
+    pr.merge(datetime.utcnow() - timedelta(seconds=10))
+    return gh, lambda: process_pr(gh, repo, repo.get_issue(pr.number))
+
+
+def test_report(scale, graphql):
+    gh, repo, pr = make_world(scale, graphql)
+    process_pr(gh, repo, repo.get_issue(pr.number))
+    report = "\n".join(
+        [
+            pr.head.sha,
+            "mu2e/buildtest",
+            "success",
+            "The build test passed",
+            "https://buildmaster.fnal.gov/job/mu2e-build/1/",
+            ":sunny: The build test passed.",
+        ]
+    )
+    return gh, lambda: comment_gh_pr(gh, REPOSITORY, pr.number, report)
+
+
+def parse_comments(scale, graphql):
+    gh, repo, pr = make_world(scale, graphql)
+    bodies = [c.body for c in pr.comments] + ["@%s run build test" % gh.login]
+    return gh, lambda: [check_test_cmd_mu2e(body, REPOSITORY) for body in bodies]
+
+
+SCENARIOS = [
+    ("process_pr: new PR", new_pr),
+    ("process_pr: no new events", no_new_events),
+    ("process_pr: test requested", test_requested),
+    ("process_pr: merged, re-check open PRs", merged),
+    ("comment_gh_pr: test report", test_report),
+    ("check_test_cmd_mu2e: every comment", parse_comments),
+]
+
+
+def measure(name, scenario, scale, workdir, repeat=5, graphql=True):
+    times = []
+    for _ in range(repeat):
+        fresh_cache(workdir)
+        gh, run = scenario(scale, graphql)
+        before = gh.calls.copy()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+        endpoints = gh.calls - before
+
+    # once more for memory, which tracemalloc slows down too much to time
+    fresh_cache(workdir)
+    gh, run = scenario(scale, graphql)
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    times.sort()
+    return Result(
+        name,
+        times[0],
+        times[len(times) // 2],
+        sum(endpoints.values()),
+        peak,
+        dict(endpoints),
+    )
+
+
+def run(scale, repeat=5, graphql=True, only=None):
+    # only: names of the scenarios to run (all of them by default)
+    workdir = tempfile.mkdtemp(prefix="mu2eci-benchmark-")
+    cwd = os.getcwd()
+    try:
+        setup_environment(workdir, scale.watchers)
+        return [
+            measure(name, scenario, scale, workdir, repeat, graphql)
+            for name, scenario in SCENARIOS
+            if not only or name in only
+        ]
+    finally:
+        # setup_environment moved into workdir
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def format_results(results, endpoints=False):
+    lines = [
+        "%-40s %10s %10s %10s %12s"
+        % ("scenario", "best", "median", "API calls", "peak memory")
+    ]
+    for r in results:
+        lines.append(
+            "%-40s %8.1fms %8.1fms %10d %10.1fMB"
+            % (r.scenario, r.best * 1e3, r.median * 1e3, r.calls, r.peak_memory / 1e6)
+        )
+        if endpoints:
+            for endpoint, calls in sorted(r.endpoints.items()):
+                lines.append("    %-62s %6d" % (endpoint, calls))
+    return "\n".join(lines)
+
+
+def compare(results, baseline, tolerance):
+    # Regressions against a saved run: any extra API call, or a median time
+    # or peak memory more than 'tolerance' (a fraction) worse.
+    problems = []
+    before = {r["scenario"]: r for r in baseline}
+    for r in results:
+        old = before.get(r.scenario)
+        if old is None:
+            continue
+        if r.calls > old["calls"]:
+            problems.append(
+                "%s: %d API calls (was %d)" % (r.scenario, r.calls, old["calls"])
+            )
+        if r.median > old["median"] * (1 + tolerance):
+            problems.append(
+                "%s: median %.1f ms (was %.1f ms)"
+                % (r.scenario, r.median * 1e3, old["median"] * 1e3)
+            )
+        if r.peak_memory > old["peak_memory"] * (1 + tolerance):
+            problems.append(
+                "%s: peak memory %.1f MB (was %.1f MB)"
+                % (r.scenario, r.peak_memory / 1e6, old["peak_memory"] / 1e6)
+            )
+    return problems
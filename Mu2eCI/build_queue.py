@@ -0,0 +1,185 @@
+import os
+import json
+import math
+import time
+import threading
+from collections import namedtuple
+from urllib.parse import quote
+
+from Mu2eCI import config
+from Mu2eCI import cassette
+from Mu2eCI import tracing
+from Mu2eCI.logger import get_logger
+
+log = get_logger(__name__)
+
+# What the Jenkins build queue looked like at taken_at (unix time).
+# build_time is the mean duration of recent test builds in seconds, or None.
+Sample = namedtuple("Sample", ["queued", "executors", "build_time", "taken_at"])
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+class QueueSampler:
+    """
+    Keeps a recent sample of the Jenkins build queue, for the message sent
+    when tests are triggered. Samples are shared between runs through a file
+    and taken again at most every ttl seconds, in a background thread, so
+    that a slow Jenkins never holds up a reply: sample() returns whatever is
+    known right away.
+
+    With a path of None, nothing is shared and, with wait, sample() waits
+    for a sample being taken (as when recording or replaying the traffic of
+    a run, see Mu2eCI.cassette, so that the reply does not depend on timing).
+    """
+
+    def __init__(self, server, jobs, path, ttl, max_age, timeout, wait=False):
+        import requests
+
+        self.server = server.rstrip("/")
+        self.jobs = jobs
+        self.path = path
+        self.ttl = ttl
+        self.max_age = max_age
+        self.timeout = timeout
+        self.wait = wait
+        self.session = cassette.mount(requests.Session())
+        self._sample = self._load()
+        self._lock = threading.Lock()
+        self._refreshing = None
+
+    def _load(self):
+        if self.path is None:
+            return None
+        try:
+            with open(self.path, "r") as f:
+                return Sample(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def _save(self, sample):
+        if self.path is None:
+            return
+        tmp_name = "%s.%d" % (self.path, os.getpid())
+        try:
+            with open(tmp_name, "w") as f:
+                json.dump(sample._asdict(), f)
+            os.replace(tmp_name, self.path)
+        except OSError:
+            log.exception("Could not save the build queue sample")
+
+    def _get(self, path):
+        started = time.monotonic()
+        status = None
+        try:
+            r = self.session.get(self.server + path, timeout=self.timeout)
+            status = r.status_code
+        finally:
+            tracing.record_call(
+                "GET",
+                self.server + path,
+                status,
+                time.monotonic() - started,
+                service="jenkins",
+            )
+        r.raise_for_status()
+        return r.json()
+
+    def _take_sample(self):
+        queued = len(self._get("/queue/api/json?tree=items[id]")["items"])
+        executors = self._get("/computer/api/json?tree=totalExecutors")[
+            "totalExecutors"
+        ]
+
+        durations = []
+        for job in self.jobs:
+            try:
+                builds = self._get(
+                    "/job/%s/api/json?tree=builds[duration,building]{0,10}" % quote(job)
+                )["builds"]
+            except Exception:
+                log.debug("No recent builds of %s", job)
+                continue
+            durations += [
+                b["duration"] / 1000.0
+                for b in builds
+                if not b["building"] and b["duration"]
+            ]
+        build_time = sum(durations) / len(durations) if durations else None
+        return Sample(queued, executors, build_time, time.time())
+
+    def refresh(self):
+        try:
+            sample = self._take_sample()
+        except Exception:
+            log.exception("Issues accessing Jenkins Build Queue API")
+            return
+        self._sample = sample
+        self._save(sample)
+
+    def prefetch(self):
+        # Start taking a new sample in the background, if the last one is too
+        # old and none is being taken already.
+        with self._lock:
+            sample = self._sample
+            if sample is not None and time.time() - sample.taken_at < self.ttl:
+                return
+            if self._refreshing is not None and self._refreshing.is_alive():
+                return
+            self._refreshing = threading.Thread(
+                target=tracing.wrap(self.refresh), daemon=True
+            )
+            self._refreshing.start()
+
+    def sample(self):
+        # The latest sample, or None if there is no recent one. Never blocks
+        # (unless told to wait).
+        self.prefetch()
+        refreshing = self._refreshing
+        if self.wait and refreshing is not None:
+            refreshing.join(self.timeout * (2 + len(self.jobs)))
+        sample = self._sample
+        if sample is None or time.time() - sample.taken_at > self.max_age:
+            return None
+        return sample
+
+
+def estimate_wait(sample):
+    # Rough time in seconds until a test queued now starts: every executor
+    # has to get through its share of the queue first.
+    if sample.build_time is None:
+        return None
+    return math.ceil(sample.queued / max(sample.executors, 1)) * sample.build_time
+
+
+def describe(sample):
+    # completes "Build queue ..." in TESTS_TRIGGERED_CONFIRMATION
+    if sample is None:
+        return "- API unavailable"
+    if sample.queued == 0:
+        return "is empty"
+    text = "has %d jobs" % sample.queued
+    wait = estimate_wait(sample)
+    if wait:
+        text += ", estimated wait ~%d min" % math.ceil(wait / 60)
+    return text
+
+
+def get_sampler():
+    # one sampler per process
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            settings = config.main["build_queue"]
+            recording = cassette.get_cassette() is not None
+            _sampler = QueueSampler(
+                config.main["jenkins_server"],
+                list(config.main["jenkins"]["jobs"].values()),
+                None if recording else config.cache_path("build_queue.json"),
+                ttl=settings["ttl"],
+                max_age=settings["max_age"],
+                timeout=settings["timeout"],
+                wait=recording,
+            )
+        return _sampler
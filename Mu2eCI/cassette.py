@@ -0,0 +1,280 @@
+import os
+import gzip
+import json
+import time
+import atexit
+import base64
+import hashlib
+import threading
+from collections import defaultdict, deque
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from Mu2eCI.logger import get_logger
+
+log = get_logger(__name__)
+
+# The HTTP traffic of a run (to GitHub through Mu2eCI.transport, and to
+# Jenkins) can be recorded to a cassette file, and served from it again
+# later without a network, e.g. to profile a slow run over and over:
+#
+#   MU2ECI_RECORD=run.jsonl.gz ./process-pull-request Mu2e/Offline 123
+#   MU2ECI_REPLAY=run.jsonl.gz ./process-pull-request Mu2e/Offline 123
+#
+# A cassette has one JSON object per line (gzipped if the name ends in .gz):
+#
+#   {"method": ..., "url": ..., "body": <sha1 of the request body>,
+#    "status": ..., "reason": ..., "headers": {...}, "text": ... | "base64": ...,
+#    "elapsed": <seconds>}
+#
+# Credentials never reach the file: request headers are not kept, secret
+# response headers and query parameters are replaced, and the values of
+# SECRET_ENV_VARS are scrubbed from response bodies.
+
+REDACTED = "REDACTED"
+SECRET_HEADERS = {"set-cookie", "authorization", "x-jenkins-session"}
+SECRET_PARAMS = {"access_token", "token", "client_secret", "client_id"}
+SECRET_ENV_VARS = ["GITHUBTOKEN", "JENKINS_TOKEN", "WEBHOOK_SECRET"]
+
+_cassette = None
+_cassette_lock = threading.Lock()
+
+
+def redact_url(url):
+    parts = urlsplit(url)
+    params = parse_qsl(parts.query, keep_blank_values=True)
+    if not any(k.lower() in SECRET_PARAMS for k, _ in params):
+        return url
+    query = [(k, REDACTED if k.lower() in SECRET_PARAMS else v) for k, v in params]
+    return urlunsplit(parts._replace(query=urlencode(query, safe="[]{},/")))
+
+
+def body_hash(body):
+    if body is None:
+        body = b""
+    elif isinstance(body, str):
+        body = body.encode("utf-8")
+    return hashlib.sha1(body).hexdigest()
+
+
+class Cassette:
+    """
+    Recorded HTTP exchanges, in a file. In record mode each exchange is
+    appended as it happens. In replay mode a request is answered with the
+    next unused exchange recorded for the same method, URL and body (or,
+    failing that, the same method and URL), so runs are repeatable even when
+    requests are made from several threads.
+    """
+
+    def __init__(self, path, mode, latency=False):
+        self.path = path
+        self.mode = mode
+        # replay: sleep for as long as each request originally took
+        self.latency = latency
+        self.replayed = 0
+        self.missing = 0
+        # replay: (remaining, limit, reset time) from the X-RateLimit-* headers
+        # of the last exchange replayed, or the first recorded (see rate_limit)
+        self._rate_limit = None
+        self._lock = threading.Lock()
+        self._secrets = [os.environ[v] for v in SECRET_ENV_VARS if os.environ.get(v)]
+
+        if mode == "record":
+            self._file = self._open("wt")
+        elif mode == "replay":
+            self._exact = defaultdict(deque)
+            self._loose = defaultdict(deque)
+            with self._open("rt") as f:
+                for line in f:
+                    exchange = json.loads(line)
+                    exchange["used"] = False
+                    if self._rate_limit is None:
+                        self._rate_limit = self._rate_limit_of(exchange)
+                    self._exact[self._key(exchange, exact=True)].append(exchange)
+                    self._loose[self._key(exchange, exact=False)].append(exchange)
+        else:
+            raise ValueError("Unknown cassette mode %r" % mode)
+        atexit.register(self.close)
+
+    def _open(self, mode):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode, encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    @staticmethod
+    def _key(exchange, exact):
+        if exact:
+            return (exchange["method"], exchange["url"], exchange["body"])
+        return (exchange["method"], exchange["url"])
+
+    def _scrub(self, text):
+        for secret in self._secrets:
+            text = text.replace(secret, REDACTED)
+        return text
+
+    def record(self, request, response, elapsed):
+        exchange = {
+            "method": request.method,
+            "url": redact_url(request.url),
+            "body": body_hash(request.body),
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": {
+                k.lower(): REDACTED if k.lower() in SECRET_HEADERS else v
+                for k, v in response.headers.items()
+            },
+            "elapsed": round(elapsed, 4),
+        }
+        try:
+            exchange["text"] = self._scrub(response.content.decode("utf-8"))
+        except UnicodeDecodeError:
+            exchange["base64"] = base64.b64encode(response.content).decode("ascii")
+        line = json.dumps(exchange, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def play(self, request):
+        # the recorded exchange for request, or None
+        wanted = {
+            "method": request.method,
+            "url": redact_url(request.url),
+            "body": body_hash(request.body),
+        }
+        with self._lock:
+            for queues, exact in ((self._exact, True), (self._loose, False)):
+                queue = queues.get(self._key(wanted, exact))
+                while queue:
+                    exchange = queue.popleft()
+                    if not exchange["used"]:
+                        exchange["used"] = True
+                        self.replayed += 1
+                        self._rate_limit = (
+                            self._rate_limit_of(exchange) or self._rate_limit
+                        )
+                        return exchange
+            self.missing += 1
+            return None
+
+    @staticmethod
+    def _rate_limit_of(exchange):
+        headers = exchange["headers"]
+        if headers.get("x-ratelimit-resource", "core") != "core":
+            return None
+        try:
+            return (
+                int(headers["x-ratelimit-remaining"]),
+                int(headers["x-ratelimit-limit"]),
+                int(headers["x-ratelimit-reset"]),
+            )
+        except (KeyError, ValueError):
+            return None
+
+    def rate_limit(self):
+        # The GitHub API rate limit as of the requests replayed so far, as
+        # (remaining, limit, reset time), or None. A recorded run may have
+        # known it without asking the API (see common.api_rate_limits), so
+        # a replay takes it from the recorded responses instead - unless the
+        # recorded run did ask.
+        with self._lock:
+            for (method, url), queue in self._loose.items():
+                if method == "GET" and urlsplit(url).path.endswith("/rate_limit"):
+                    if any(not exchange["used"] for exchange in queue):
+                        return None
+            return self._rate_limit
+
+    def close(self):
+        with self._lock:
+            if self.mode == "record":
+                if not self._file.closed:
+                    self._file.close()
+                return
+            unused = sum(
+                1 for queue in self._loose.values() for e in queue if not e["used"]
+            )
+            log.info(
+                "Cassette %s: %d requests replayed, %d not recorded, %d recorded "
+                "requests not made",
+                self.path,
+                self.replayed,
+                self.missing,
+                unused,
+            )
+
+
+class CassetteAdapter:
+    """
+    A transport adapter for requests sessions that records the exchanges of
+    the adapter it wraps, or replays them without it.
+    """
+
+    def __init__(self, cassette, adapter):
+        self.cassette = cassette
+        self.adapter = adapter
+
+    def send(self, request, **kwargs):
+        if self.cassette.mode == "record":
+            started = time.monotonic()
+            response = self.adapter.send(request, **kwargs)
+            self.cassette.record(request, response, time.monotonic() - started)
+            return response
+
+        import requests
+
+        exchange = self.cassette.play(request)
+        if exchange is None:
+            raise requests.exceptions.ConnectionError(
+                "No recorded response for %s %s in %s"
+                % (request.method, redact_url(request.url), self.cassette.path),
+                request=request,
+            )
+        if self.cassette.latency:
+            time.sleep(exchange["elapsed"])
+
+        response = requests.models.Response()
+        response.status_code = exchange["status"]
+        response.reason = exchange["reason"]
+        response.headers = requests.structures.CaseInsensitiveDict(exchange["headers"])
+        if "base64" in exchange:
+            response._content = base64.b64decode(exchange["base64"])
+        else:
+            response._content = exchange["text"].encode("utf-8")
+        response._content_consumed = True
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+def get_cassette():
+    # The cassette of this process, from MU2ECI_RECORD or MU2ECI_REPLAY
+    # (MU2ECI_REPLAY_LATENCY=1 to replay at the recorded speed), or None.
+    global _cassette
+    with _cassette_lock:
+        if _cassette is None:
+            if os.environ.get("MU2ECI_REPLAY"):
+                _cassette = Cassette(
+                    os.environ["MU2ECI_REPLAY"],
+                    "replay",
+                    latency=bool(os.environ.get("MU2ECI_REPLAY_LATENCY")),
+                )
+            elif os.environ.get("MU2ECI_RECORD"):
+                _cassette = Cassette(os.environ["MU2ECI_RECORD"], "record")
+        return _cassette
+
+
+def replaying():
+    cassette = get_cassette()
+    return cassette is not None and cassette.mode == "replay"
+
+
+def mount(session):
+    # Record or replay the traffic of a requests session, if asked to.
+    cassette = get_cassette()
+    if cassette is None:
+        return session
+    for prefix, adapter in list(session.adapters.items()):
+        if not isinstance(adapter, CassetteAdapter):
+            session.mount(prefix, CassetteAdapter(cassette, adapter))
+    return session
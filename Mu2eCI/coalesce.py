@@ -0,0 +1,104 @@
+import os
+import time
+import uuid
+import threading
+
+from Mu2eCI import config
+from Mu2eCI.logger import get_logger
+
+log = get_logger(__name__)
+
+
+class Coalescer:
+    """
+    Collapses bursts of events for the same key (repository, PR number) into
+    one. A key becomes due once no new event has arrived for quiet_window
+    seconds, or max_delay seconds after its first event, whichever is
+    sooner. A key is never handed out twice at once: events arriving while
+    it is being processed schedule one more run after it is done(), so the
+    last event is always processed.
+    """
+
+    def __init__(self, quiet_window, max_delay):
+        self.quiet_window = quiet_window
+        self.max_delay = max_delay
+        self.coalesced = 0
+        self._cond = threading.Condition()
+        self._pending = {}  # key -> (time of first event, deadline)
+        self._running = set()
+        self._rerun = set()
+
+    def _schedule(self, key):
+        now = time.monotonic()
+        if key in self._pending:
+            self.coalesced += 1
+            first_seen, _ = self._pending[key]
+        else:
+            first_seen = now
+        self._pending[key] = (
+            first_seen,
+            min(now + self.quiet_window, first_seen + self.max_delay),
+        )
+        self._cond.notify_all()
+
+    def submit(self, key):
+        with self._cond:
+            if key in self._running:
+                if key in self._rerun:
+                    self.coalesced += 1
+                self._rerun.add(key)
+                return
+            self._schedule(key)
+
+    def get(self):
+        # Blocks until a key is due, and returns it.
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                timeout = None
+                if self._pending:
+                    key = min(self._pending, key=lambda k: self._pending[k][1])
+                    deadline = self._pending[key][1]
+                    if deadline <= now:
+                        del self._pending[key]
+                        self._running.add(key)
+                        return key
+                    timeout = deadline - now
+                self._cond.wait(timeout)
+
+    def done(self, key):
+        with self._cond:
+            self._running.discard(key)
+            if key in self._rerun:
+                self._rerun.discard(key)
+                self._schedule(key)
+
+
+def debounce(repository, pr_number, quiet_window):
+    # For one-process-per-event callers (process-pull-request): wait for
+    # quiet_window seconds, and return False if another event for the same
+    # PR arrived in the meantime - that one will do the processing instead.
+    token = uuid.uuid4().hex
+    token_file = config.cache_path(
+        "debounce", "%s-%s" % (repository.replace("/", "-"), pr_number)
+    )
+    tmp_name = "%s.%s" % (token_file, token)
+    with open(tmp_name, "w") as f:
+        f.write(token)
+    os.replace(tmp_name, token_file)
+
+    time.sleep(quiet_window)
+
+    try:
+        with open(token_file, "r") as f:
+            latest = f.read()
+    except OSError:
+        latest = token
+    if latest != token:
+        log.info(
+            "Skipping: a newer event for %s#%s will be processed instead",
+            repository,
+            pr_number,
+        )
+        return False
+    return True
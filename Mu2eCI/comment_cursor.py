@@ -0,0 +1,25 @@
+import hashlib
+
+from Mu2eCI import state_store
+
+# How far process_pr has got through the comments of each PR, so that only
+# comments made since the last run need to be fetched and scanned. Kept in
+# the state store (see state_store.py):
+#
+#   cursor:                 GraphQL endCursor of the comments connection
+#   last_comment_id:        id of the last comment processed
+#   last_comment_time:      its creation time (for the REST 'since' parameter)
+#   last_bot_comment_time:  when the bot last commented, or None
+#   bot_comments:           hashes of the bot's comments (for post_on_pr)
+
+
+def body_hash(body):
+    return hashlib.sha1(body.encode("utf-8")).hexdigest()
+
+
+def load(repo_name, pr_number):
+    return state_store.load_cursor(repo_name, pr_number)
+
+
+def save(repo_name, pr_number, cursor):
+    state_store.save_cursor(repo_name, pr_number, cursor)
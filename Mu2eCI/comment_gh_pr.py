@@ -1,5 +1,7 @@
 from Mu2eCI.process_pr import process_pr
-from Mu2eCI.logger import log
+from Mu2eCI.logger import get_logger
+
+log = get_logger(__name__)
 
 
 def comment_gh_pr(gh, repo, pr, msg):
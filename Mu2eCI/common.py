@@ -1,74 +1,57 @@
-import os
-import json
+import threading
 from datetime import datetime
-from time import sleep, gmtime
+from time import gmtime
 from calendar import timegm
-from urllib.request import urlopen
+from urllib.parse import quote
 
 from Mu2eCI import config
+from Mu2eCI import cassette
+from Mu2eCI import build_queue
+from Mu2eCI import jenkins
+from Mu2eCI import transport
+from Mu2eCI import tracing
+from Mu2eCI import membership_cache
 from Mu2eCI import test_suites
-from Mu2eCI.logger import log
+from Mu2eCI.logger import get_logger
+from Mu2eCI.comment_cursor import body_hash
 
+log = get_logger(__name__)
 
-def get_build_queue_size():
-    jenkins_url = "https://buildmaster.fnal.gov/buildmaster/queue/api/json?pretty=true"
-
-    bqsize = "- API unavailable"
+# comments post_on_pr has refused to post again (see Mu2eCI.load_test)
+spam_guard_hits = 0
+_spam_guard_lock = threading.Lock()
 
-    try:
-        contents = json.load(urlopen(jenkins_url))
-        nitems = len(contents["items"])
-        bqsize = "is empty"
-        if nitems > 0:
-            bqsize = "has %d jobs" % nitems
 
-    except Exception:
-        log.exception("Issues accessing Jenkins Build Queue API")
-    return bqsize
+def get_build_queue_size():
+    # never waits on Jenkins: see Mu2eCI.build_queue
+    with tracing.span("build_queue"):
+        return build_queue.describe(build_queue.get_sampler().sample())
 
 
-# written by CMS-BOT authors
-def check_rate_limits(rate_limit, rate_limit_max, rate_limiting_resettime, msg=True):
-    doSleep = 0
-    rate_reset_sec = rate_limiting_resettime - timegm(gmtime()) + 5
+def api_rate_limits(gh, msg=True):
+    # Requests are paced by the rate limiter in Mu2eCI.transport, using the
+    # X-RateLimit-* headers of earlier responses from any run. Only ask the
+    # API for the current limit when no recent run has seen them. A replayed
+    # run (which is not paced) uses the headers in its cassette, so that it
+    # makes the same requests as the run that was recorded.
+    budget = None
+    if transport.rate_limiter is not None:
+        budget = transport.rate_limiter.get_budget()
+    elif cassette.replaying():
+        budget = cassette.get_cassette().rate_limit()
+    if budget is None:
+        gh.get_rate_limit()
+        budget = gh.rate_limiting + (gh.rate_limiting_resettime,)
+
+    rate_limit, rate_limit_max, rate_limiting_resettime = budget
     if msg:
         log.info(
             "API Rate Limit: %s/%s, Reset in %s sec i.e. at %s",
             rate_limit,
             rate_limit_max,
-            rate_reset_sec,
+            rate_limiting_resettime - timegm(gmtime()),
             datetime.fromtimestamp(rate_limiting_resettime),
         )
-    if rate_limit < 100:
-        doSleep = rate_reset_sec
-    elif rate_limit < 250:
-        doSleep = 30
-    elif rate_limit < 500:
-        doSleep = 10
-    elif rate_limit < 750:
-        doSleep = 5
-    elif rate_limit < 1000:
-        doSleep = 2
-    elif rate_limit < 1500:
-        doSleep = 1
-    if rate_reset_sec < doSleep:
-        doSleep = rate_reset_sec
-    if doSleep > 0:
-        if msg:
-            log.warning(
-                "Slowing down for %s sec due to api rate limits %s approching zero"
-                % (doSleep, rate_limit)
-            )
-        sleep(doSleep)
-    return
-
-
-# written by CMS-BOT authors
-def api_rate_limits(gh, msg=True):
-    gh.get_rate_limit()
-    check_rate_limits(
-        gh.rate_limiting[0], gh.rate_limiting[1], gh.rate_limiting_resettime, msg
-    )
 
 
 def check_test_cmd_mu2e(full_comment, repository):
@@ -82,11 +65,7 @@ def check_test_cmd_mu2e(full_comment, repository):
     # desc: code checks -> mu2e/codechecks (context name) -> [jenkins project name]
     # desc: integration build tests -> mu2e/buildtest -> [jenkins project name]
     # desC: physics validation -> mu2e/validation -> [jenkins project name]
-    log.debug("Matching regular expressions to this comment.")
-    try:
-        log.debug(repr(full_comment))
-    except Exception:
-        log.exception("could not print comment...")
+    log.debug("Matching regular expressions to this comment: %r", full_comment)
 
     for regex, handler in test_suites.TESTS:
         # returns the first match in the comment
@@ -98,14 +77,14 @@ def check_test_cmd_mu2e(full_comment, repository):
                 break
 
         if match is None:
-            log.debug("NOT MATCHED - %s", str(regex.pattern))
+            log.debug("NOT MATCHED - %s", regex.pattern)
             continue
         handle = handler(match)
 
         if handle is None:
-            log.debug("MATCHED - BUT NoneType HANDLE RETURNED - %s", str(regex.pattern))
+            log.debug("MATCHED - BUT NoneType HANDLE RETURNED - %s", regex.pattern)
             continue
-        log.debug("MATCHED - %s", str(regex.pattern))
+        log.debug("MATCHED - %s", regex.pattern)
         return handle, True
 
     if test_suites.regex_mentioned.search(full_comment) is not None:
@@ -116,6 +95,19 @@ def check_test_cmd_mu2e(full_comment, repository):
     return None, False
 
 
+def get_test_parameters(
+    test, repository, pr_number, pr_commit_sha, master_commit_sha, extra_env
+):
+    # the parameters of the Jenkins job for a test
+    parameters = {**extra_env}
+    parameters["TEST_NAME"] = test
+    parameters["REPOSITORY"] = repository
+    parameters["PULL_REQUEST"] = pr_number
+    parameters["COMMIT_SHA"] = pr_commit_sha
+    parameters["MASTER_COMMIT_SHA"] = master_commit_sha
+    return parameters
+
+
 def create_properties_file_for_test(
     test,
     repository,
@@ -125,8 +117,6 @@ def create_properties_file_for_test(
     extra_env,
     dryRun=False,
 ):
-    parameters = {**extra_env}
-
     repo_partsX = repository.replace("/", "-")  # mu2e/Offline ---> mu2e-Offline
     out_file_name = "trigger-mu2e-%s-%s-%s.properties" % (
         test.replace(" ", "-"),
@@ -134,11 +124,9 @@ def create_properties_file_for_test(
         pr_number,
     )
 
-    parameters["TEST_NAME"] = test
-    parameters["REPOSITORY"] = repository
-    parameters["PULL_REQUEST"] = pr_number
-    parameters["COMMIT_SHA"] = pr_commit_sha
-    parameters["MASTER_COMMIT_SHA"] = master_commit_sha
+    parameters = get_test_parameters(
+        test, repository, pr_number, pr_commit_sha, master_commit_sha, extra_env
+    )
 
     if dryRun:
         log.info("Not creating cleanup properties file (dry-run): %s", out_file_name)
@@ -150,25 +138,46 @@ def create_properties_file_for_test(
             out_file.write("%s=%s\n" % (k, parameters[k]))
 
 
-def get_modified(modified_files):
-    modified_top_level_folders = []
-    for f in modified_files:
-        filename, file_extension = os.path.splitext(f.filename)
-        log.debug("Changed file (%s): %s%s", file_extension, filename, file_extension)
-
-        splits = filename.split("/")
-        if len(splits) > 1:
-            modified_top_level_folders.append(splits[0])
-        else:
-            modified_top_level_folders.append("/")
+def trigger_tests(repository, pr_number, pr_commit_sha, tests):
+    # Trigger each (test, master_commit_sha, extra_env) in tests, with the
+    # backend set in main.yaml (jenkins.trigger). Returns whether each test
+    # was triggered, in the same order.
+    if config.main["jenkins"]["trigger"] == "remote":
+        jobs = config.main["jenkins"]["jobs"]
+        builds = []
+        for test, master_commit_sha, extra_env in tests:
+            if test not in jobs:
+                log.error("No Jenkins job is configured for the %s test", test)
+                continue
+            builds.append(
+                (
+                    jobs[test],
+                    get_test_parameters(
+                        test,
+                        repository,
+                        pr_number,
+                        pr_commit_sha,
+                        master_commit_sha,
+                        extra_env,
+                    ),
+                )
+            )
+        queue_ids = iter(jenkins.get_client().trigger_many(builds))
+        # a build that was not queued has no queue item id
+        return [test in jobs and next(queue_ids) is not None for test, _, _ in tests]
 
-    return set(modified_top_level_folders)
+    for test, master_commit_sha, extra_env in tests:
+        create_properties_file_for_test(
+            test, repository, pr_number, pr_commit_sha, master_commit_sha, extra_env
+        )
+    return [True] * len(tests)
 
 
 def get_authorised_users(mu2eorg, repo, branch="all"):
     yaml_contents = config.auth_teams
     authed_users = []
-    authed_teams = yaml_contents["all"]
+    # copy, so that branch-specific teams aren't added to the config itself
+    authed_teams = list(yaml_contents["all"])
     if branch in yaml_contents:
         authed_teams += yaml_contents[branch]
 
@@ -176,15 +185,53 @@ def get_authorised_users(mu2eorg, repo, branch="all"):
     log.info("Authorised Teams: %s", ", ".join(authed_teams))
 
     for team_slug in authed_teams:
-        teamobj = mu2eorg.get_team_by_slug(team_slug)
-        authed_users += [mem.login for mem in teamobj.get_members()]
+        authed_users += membership_cache.get_team_members(mu2eorg, team_slug)
 
     # users authorised to communicate with this bot
     return set(authed_users), authed_teams
 
 
+# The following write directly to the API using the repository's requester,
+# so that we don't need to fetch the commit, comment, or label object first.
+
+
+def create_status(repo, sha, state, target_url, description, context):
+    repo._requester.requestJsonAndCheck(
+        "POST",
+        f"{repo.url}/statuses/{sha}",
+        input={
+            "state": state,
+            "target_url": target_url,
+            "description": description,
+            "context": context,
+        },
+    )
+
+
+def create_reaction(repo, comment_id, reaction_type):
+    repo._requester.requestJsonAndCheck(
+        "POST",
+        f"{repo.url}/issues/comments/{comment_id}/reactions",
+        input={"content": reaction_type},
+        headers={"Accept": "application/vnd.github.squirrel-girl-preview"},
+    )
+
+
+def edit_label_color(repo, name, color):
+    repo._requester.requestJsonAndCheck(
+        "PATCH",
+        f"{repo.url}/labels/{quote(name)}",
+        input={"name": name, "color": color},
+    )
+
+
 def post_on_pr(issue, comment, previous_bot_comments):
-    if comment in previous_bot_comments:
+    # previous_bot_comments holds hashes (comment_cursor.body_hash) of what
+    # the bot has posted on this PR
+    global spam_guard_hits
+    if body_hash(comment) in previous_bot_comments:
+        with _spam_guard_lock:
+            spam_guard_hits += 1
         log.warning(
             "SPAM PROTECTION - We are posting something we already "
             "posted before! Something is wrong!"
@@ -1,16 +1,223 @@
 import os
-import yaml
+import sys
+import pickle
+import hashlib
+import threading
+from collections.abc import Mapping
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), "../config")
+
+# Parsed config files, and objects compiled from them, are kept here between
+# runs. This cannot be set in main.yaml, as it is needed to read main.yaml.
+DEFAULT_CACHE_DIR = "~/.cache/Mu2eCI"
+
+# The tests the bot can trigger. Kept here rather than in test_suites, which
+# needs the config to be loaded, so that config files can be checked against it.
+SUPPORTED_TESTS = ["build", "code checks", "validation"]
+
+_lock = threading.RLock()
+_loaded = {}
+
+
+def _validate(name, contents):
+    # catch mistakes in the config files before they are used
+    def check(ok, problem):
+        if not ok:
+            raise ValueError("Invalid config/%s.yaml: %s" % (name, problem))
+
+    if name == "main":
+        check(isinstance(contents, dict), "expected a mapping")
+        repos = contents.get("supported_repos")
+        check(
+            isinstance(repos, list)
+            and all(isinstance(r, str) and r.count("/") == 1 for r in repos),
+            "supported_repos must be a list of owner/name",
+        )
+        labels = contents.get("labels", {})
+        for key in ("states", "colors"):
+            check(
+                isinstance(labels.get(key), dict),
+                "labels.%s must be a mapping" % key,
+            )
+        jobs = contents.get("jenkins", {}).get("jobs")
+        check(isinstance(jobs, dict), "jenkins.jobs must be a mapping")
+        check(
+            set(jobs) == set(SUPPORTED_TESTS),
+            "jenkins.jobs must name a job for each of %s" % ", ".join(SUPPORTED_TESTS),
+        )
+        check(
+            all(isinstance(job, str) and job for job in jobs.values()),
+            "jenkins.jobs must map tests to job names",
+        )
+    elif name == "test_rules":
+        check(isinstance(contents, dict), "expected a mapping")
+        check(isinstance(contents.get("default", []), list), "default must be a list")
+        rules = contents.get("rules") or []
+        check(isinstance(rules, list), "rules must be a list")
+        for i, rule in enumerate(rules):
+            check(isinstance(rule, dict), "rule %d must be a mapping" % i)
+            for key in ("tests", "paths", "packages"):
+                check(
+                    isinstance(rule.get(key) or [], list),
+                    "%s of rule %d must be a list" % (key, i),
+                )
+            check(
+                rule.get("paths") or rule.get("packages"),
+                "rule %d has no paths or packages" % i,
+            )
+    elif name in ("watchers", "auth_teams") and contents is not None:
+        check(isinstance(contents, dict), "expected a mapping")
+        for key, values in contents.items():
+            check(
+                values is None or isinstance(values, list),
+                "%s must be a list" % key,
+            )
+
+
+def _parse(source):
+    # yaml is only imported when a config file has changed since it was cached
+    import yaml
+
+    try:
+        # the libyaml loader is several times faster, where PyYAML was built with it
+        Loader = yaml.CFullLoader
+    except AttributeError:
+        Loader = yaml.FullLoader
+    return yaml.load(source, Loader=Loader)
+
+
+def _compiled_cache_file(name):
+    cache_dir = os.environ.get("MU2ECI_CACHE_DIR", DEFAULT_CACHE_DIR)
+    return os.path.join(os.path.expanduser(cache_dir), "config", name + ".pickle")
+
+
+def _read_cache(name, key):
+    try:
+        with open(_compiled_cache_file(name), "rb") as f:
+            cached = pickle.load(f)
+    except Exception:
+        return None
+    if cached.get("key") != key:
+        return None
+    return cached
+
+
+def _write_cache(name, cached):
+    # best effort: without a cache, the config is just parsed every time
+    file_name = _compiled_cache_file(name)
+    tmp_name = "%s.%d" % (file_name, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        with open(tmp_name, "wb") as f:
+            pickle.dump(cached, f)
+        os.replace(tmp_name, file_name)
+    except (OSError, pickle.PicklingError):
+        pass
+
+
+def _load(name):
+    # {"key": hash of the source, "contents": parsed YAML,
+    #  "compiled": {compiler: (compiler key, object)}}
+    with _lock:
+        if name in _loaded:
+            return _loaded[name]
+        with open(os.path.join(CONFIG_DIR, f"{name}.yaml"), "rb") as f:
+            source = f.read()
+        key = hashlib.sha1(source).hexdigest()
+
+        cached = _read_cache(name, key)
+        if cached is None:
+            contents = _parse(source)
+            _validate(name, contents)
+            cached = {"key": key, "contents": contents, "compiled": {}}
+            _write_cache(name, cached)
+        _loaded[name] = cached
+        return cached
+
+
+def override(name, contents):
+    # Use contents in place of config/<name>.yaml for the rest of this
+    # process, e.g. generated watchers for a benchmark (see Mu2eCI.fake_github).
+    _validate(name, contents)
+    with _lock:
+        _loaded[name] = {
+            "key": None,
+            "contents": contents,
+            "compiled": {},
+            # for version()
+            "override": hashlib.sha1(repr(contents).encode()).hexdigest(),
+        }
 
 
 def get_config(name):
-    file_path = os.path.join(os.path.dirname(__file__), "../config", f"{name}.yaml")
+    return _load(name)["contents"]
+
+
+def version(*names):
+    # a fingerprint of the given config files, for results derived from them
+    # that are kept between runs
+    keys = []
+    for name in names:
+        cached = _load(name)
+        keys.append(cached["key"] or cached["override"])
+    return hashlib.sha1(" ".join(keys).encode()).hexdigest()
+
+
+def compiled(name, compile):
+    # compile(contents of config 'name'), cached along with the parsed config
+    # until either the config or the module defining compile changes
+    with _lock:
+        cached = _load(name)
+        compiler = "%s.%s" % (compile.__module__, compile.__qualname__)
+        source = getattr(sys.modules[compile.__module__], "__file__", None)
+        compiler_key = os.path.getmtime(source) if source else None
+
+        if compiler in cached["compiled"]:
+            key, obj = cached["compiled"][compiler]
+            if key == compiler_key:
+                return obj
+        obj = compile(cached["contents"])
+        cached["compiled"][compiler] = (compiler_key, obj)
+        if cached["key"] is not None:  # not overridden
+            _write_cache(name, cached)
+        return obj
+
+
+class LazyConfig(Mapping):
+    """
+    A config file as a read-only mapping, parsed on first access (or
+    loaded from the compiled config cache), so that scripts only pay for
+    the config they use.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def _contents(self):
+        return get_config(self.name) or {}
+
+    def __getitem__(self, key):
+        return self._contents()[key]
+
+    def __iter__(self):
+        return iter(self._contents())
+
+    def __len__(self):
+        return len(self._contents())
+
+    def __repr__(self):
+        return "LazyConfig(%r)" % self.name
 
-    with open(file_path, "r") as f:
-        contents = yaml.load(f, Loader=yaml.FullLoader)
 
-    return contents
+def cache_path(*parts):
+    # persistent state shared between runs of the bot lives under one directory,
+    # which can be overridden from the environment (e.g. on a Jenkins agent)
+    cache_dir = os.environ.get("MU2ECI_CACHE_DIR", main["cache"]["dir"])
+    path = os.path.join(os.path.expanduser(cache_dir), *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
 
 
-main = get_config("main")
-watchers = get_config("watchers")
-auth_teams = get_config("auth_teams")
+main = LazyConfig("main")
+watchers = LazyConfig("watchers")
+auth_teams = LazyConfig("auth_teams")
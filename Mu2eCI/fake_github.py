@@ -0,0 +1,567 @@
+import math
+import hashlib
+import itertools
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from urllib.parse import unquote
+
+from Mu2eCI import tracing
+from Mu2eCI.pr_snapshot import PAGE_SIZE
+from Mu2eCI.test_suites import TEST_ALIASES
+
+# An in-memory stand-in for the PyGithub objects that process_pr,
+# comment_gh_pr and stall_sweep use, for benchmarks and load tests.
+#
+# Only what the bot reads and writes is modelled. Every method that would
+# make an HTTP request counts it in Github.calls (by endpoint, as named by
+# Mu2eCI.tracing) and records it in the current trace. Setting up the fake
+# (create_repo, create_pull, push, add_comment, ...) is not counted.
+
+# PyGithub lists REST collections 30 items to a page by default
+REST_PAGE_SIZE = 30
+
+# GraphQL reactionGroups content for REST reaction types
+REACTION_CONTENT = {
+    "+1": "THUMBS_UP",
+    "-1": "THUMBS_DOWN",
+    "laugh": "LAUGH",
+    "confused": "CONFUSED",
+    "heart": "HEART",
+    "hooray": "HOORAY",
+    "rocket": "ROCKET",
+    "eyes": "EYES",
+}
+
+
+def format_datetime(value):
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ") if value is not None else None
+
+
+class PaginatedList(list):
+    # the items of a listing, all fetched
+    @property
+    def totalCount(self):
+        return len(self)
+
+    @property
+    def reversed(self):
+        return PaginatedList(reversed(self))
+
+
+class NamedUser:
+    def __init__(self, login):
+        self.login = login
+
+
+class Label:
+    def __init__(self, name, color):
+        self.name = name
+        self.color = color
+
+
+class GitActor:
+    def __init__(self, name, date):
+        self.name = name
+        self.date = date
+
+
+class GitCommit:
+    def __init__(self, sha, message, committer):
+        self.sha = sha
+        self.message = message
+        self.committer = committer
+
+
+class CommitStatus:
+    def __init__(self, context, state, description, target_url, updated_at):
+        self.context = context
+        self.state = state
+        self.description = description
+        self.target_url = target_url
+        self.updated_at = updated_at
+
+
+class IssueComment:
+    def __init__(self, id, login, body, created_at):
+        self.id = id
+        self.user = NamedUser(login)
+        self.body = body
+        self.created_at = created_at
+        self.reactions = set()  # (login, REST reaction type)
+
+
+class File:
+    def __init__(self, filename):
+        self.filename = filename
+
+
+class Branch:
+    def __init__(self, name, commit):
+        self.name = name
+        self.commit = commit
+
+
+class PullRequestPart:
+    def __init__(self, ref):
+        self.ref = ref
+
+
+class Commit:
+    """A commit, with its statuses (oldest first)."""
+
+    def __init__(self, repo, sha, message, author, date):
+        self._repo = repo
+        self.sha = sha
+        self.commit = GitCommit(sha, message, GitActor(author, date))
+        self.statuses = []
+
+    def add_status(self, context, state, description="", target_url=None, when=None):
+        self.statuses.append(
+            CommitStatus(
+                context, state, description, target_url, when or datetime.utcnow()
+            )
+        )
+
+    def get_statuses(self):
+        # newest first, like the API
+        return self._repo._gh._list(
+            "/repos/%s/commits/%s/statuses" % (self._repo.full_name, self.sha),
+            self.statuses[::-1],
+        )
+
+    def create_status(self, state, target_url=None, description="", context=None):
+        gh = self._repo._gh
+        gh.count("POST", "/repos/%s/statuses/%s" % (self._repo.full_name, self.sha))
+        with gh._lock:
+            self.add_status(context, state, description, target_url)
+
+
+class PullRequest:
+    """A PR, which also holds the state of its issue (comments and labels)."""
+
+    def __init__(self, repo, number, author, files, base_ref, created_at):
+        self._repo = repo
+        self.number = number
+        self.user = NamedUser(author)
+        self.state = "open"
+        self.merged = False
+        self.merged_at = None
+        self.updated_at = created_at
+        self.base = PullRequestPart(base_ref)
+        self.files = [File(f) for f in files]
+        self.commits = []
+        self.comments = []
+        self.labels = []
+
+    @property
+    def changed_files(self):
+        return len(self.files)
+
+    @property
+    def head(self):
+        return self.commits[-1] if self.commits else None
+
+    # setting up
+
+    def push(self, message="Change things", when=None, author=None):
+        when = when or datetime.utcnow()
+        commit = self._repo._commit(message, author or self.user.login, when)
+        self.commits.append(commit)
+        self.updated_at = when
+        return commit
+
+    def add_comment(self, login, body, when=None):
+        when = when or datetime.utcnow()
+        comment = IssueComment(next(self._repo._gh._ids), login, body, when)
+        self.comments.append(comment)
+        self._repo._comments[comment.id] = comment
+        self.updated_at = max(self.updated_at, when)
+        return comment
+
+    def merge(self, when=None):
+        self.state = "closed"
+        self.merged = True
+        self.merged_at = when or datetime.utcnow()
+        self.updated_at = self.merged_at
+        self._repo.branches[self.base.ref] = self._repo._commit(
+            "Merge pull request #%d" % self.number, "web-flow", self.merged_at
+        )
+
+    # the PyGithub API
+
+    def get_commits(self):
+        return self._repo._gh._list(
+            "/repos/%s/pulls/%d/commits" % (self._repo.full_name, self.number),
+            self.commits,
+        )
+
+    def get_files(self):
+        return self._repo._gh._list(
+            "/repos/%s/pulls/%d/files" % (self._repo.full_name, self.number),
+            self.files,
+        )
+
+    def as_issue(self):
+        self._repo._gh.count(
+            "GET", "/repos/%s/issues/%d" % (self._repo.full_name, self.number)
+        )
+        return Issue(self)
+
+
+class Issue:
+    def __init__(self, pr):
+        self._pr = pr
+        self.number = pr.number
+        self.user = pr.user
+        self.pull_request = True
+
+    @property
+    def labels(self):
+        colors = self._pr._repo.labels
+        return [Label(name, colors[name]) for name in self._pr.labels]
+
+    def _path(self, *parts):
+        return "/".join(
+            ["/repos/%s/issues/%d" % (self._pr._repo.full_name, self.number)]
+            + list(parts)
+        )
+
+    def edit(self, labels=None):
+        repo = self._pr._repo
+        repo._gh.count("PATCH", self._path())
+        with repo._gh._lock:
+            if labels is not None:
+                for name in labels:
+                    # new labels have GitHub's default colour
+                    repo.labels.setdefault(name, "ededed")
+                self._pr.labels = list(labels)
+
+    def create_comment(self, body):
+        gh = self._pr._repo._gh
+        gh.count("POST", self._path("comments"))
+        with gh._lock:
+            return self._pr.add_comment(gh.login, body)
+
+    def get_comments(self, since=None):
+        comments = self._pr.comments
+        if since is not None:
+            comments = [c for c in comments if c.created_at >= since]
+        return self._pr._repo._gh._list(self._path("comments"), comments)
+
+
+class Team:
+    def __init__(self, org, slug, members):
+        self._org = org
+        self.slug = slug
+        self.members = list(members)
+
+    def get_members(self):
+        return self._org._gh._list(
+            "/orgs/%s/teams/%s/members" % (self._org.login, self.slug),
+            [NamedUser(login) for login in self.members],
+        )
+
+
+class Organization:
+    def __init__(self, gh, login):
+        self._gh = gh
+        self.login = login
+        self.members = set()
+        self.teams = {}
+
+    def add_team(self, slug, members):
+        self.teams[slug] = Team(self, slug, members)
+        self.members.update(members)
+
+    def has_in_members(self, user):
+        self._gh.count("GET", "/orgs/%s/members/%s" % (self.login, user.login))
+        return user.login in self.members
+
+    def get_team_by_slug(self, slug):
+        self._gh.count("GET", "/orgs/%s/teams/%s" % (self.login, slug))
+        return self.teams[slug]
+
+
+class Repository:
+    def __init__(self, gh, full_name, default_branch="main"):
+        self._gh = gh
+        self.full_name = full_name
+        self.name = full_name.split("/")[1]
+        self.url = "/repos/" + full_name
+        self._requester = Requester(gh)
+        self.labels = {}  # name -> colour
+        self.pulls = {}
+        self.commits = {}
+        self._comments = {}
+        self.branches = {
+            default_branch: self._commit("Initial commit", "mu2e", datetime.utcnow())
+        }
+
+    def _commit(self, message, author, when):
+        sha = hashlib.sha1(b"%d" % next(self._gh._ids)).hexdigest()
+        commit = self.commits[sha] = Commit(self, sha, message, author, when)
+        return commit
+
+    # setting up
+
+    def create_pull(self, author, files, base="main", when=None):
+        # an open PR with one commit, pushed at 'when'
+        number = len(self.pulls) + 1
+        pr = self.pulls[number] = PullRequest(
+            self, number, author, files, base, when or datetime.utcnow()
+        )
+        pr.push(when=when)
+        return pr
+
+    # the PyGithub API
+
+    def get_pull(self, number):
+        self._gh.count("GET", "%s/pulls/%d" % (self.url, number))
+        return self.pulls[number]
+
+    def get_issue(self, number):
+        self._gh.count("GET", "%s/issues/%d" % (self.url, number))
+        return Issue(self.pulls[number])
+
+    def get_pulls(self, state="open", base=None):
+        pulls = [
+            pr
+            for _, pr in sorted(self.pulls.items())
+            if (state == "all" or pr.state == state)
+            and (base is None or pr.base.ref == base)
+        ]
+        return self._gh._list(self.url + "/pulls", pulls)
+
+    def get_branch(self, branch):
+        self._gh.count("GET", "%s/branches/%s" % (self.url, branch))
+        return Branch(branch, self.branches[branch])
+
+    def get_commit(self, sha):
+        self._gh.count("GET", "%s/commits/%s" % (self.url, sha))
+        return self.commits[sha]
+
+
+class Requester:
+    """
+    Answers the requests Mu2eCI makes with the requester directly: the
+    GraphQL PR snapshot, and the writes in Mu2eCI.common.
+    """
+
+    def __init__(self, gh):
+        self._gh = gh
+
+    def requestJsonAndCheck(self, verb, url, parameters=None, headers=None, input=None):
+        gh = self._gh
+        gh.count(verb, url)
+        if url == "/graphql":
+            return {}, gh._graphql(input["query"], input["variables"])
+
+        parts = url.split("/")
+        repo = gh.repos["/".join(parts[2:4])]
+        with gh._lock:
+            if verb == "POST" and parts[4] == "statuses":
+                repo.commits[parts[5]].add_status(
+                    input["context"],
+                    input["state"],
+                    input.get("description", ""),
+                    input.get("target_url"),
+                )
+            elif verb == "POST" and parts[-1] == "reactions":
+                comment = repo._comments[int(parts[-2])]
+                comment.reactions.add((gh.login, input["content"]))
+            elif verb == "PATCH" and parts[4] == "labels":
+                repo.labels[unquote(parts[5])] = input["color"]
+            else:
+                raise NotImplementedError("%s %s" % (verb, url))
+        return {}, {}
+
+
+class Github:
+    """
+    The fake GitHub, logged in as 'login'. With graphql=False, GraphQL
+    queries fail, so that the REST fallbacks are used.
+    """
+
+    def __init__(self, login="FNALbuild", graphql=True):
+        self.login = login
+        self.graphql = graphql
+        self.repos = {}
+        self.orgs = {}
+        self.calls = Counter()
+        self.rate_limiting = (5000, 5000)
+        self.rate_limiting_resettime = 0
+        self._ids = itertools.count(1000)
+        self._lock = threading.RLock()
+
+    def count(self, verb, path):
+        with self._lock:
+            self.calls[tracing.endpoint_name(verb, path)] += 1
+        tracing.record_call(verb, path, 200, 0.0)
+
+    def _list(self, path, items):
+        # one request per page, and at least one
+        for page in range(max(1, math.ceil(len(items) / REST_PAGE_SIZE))):
+            self.count("GET", path + ("?page=%d" % (page + 1) if page else ""))
+        return PaginatedList(items)
+
+    # setting up
+
+    def create_repo(self, full_name):
+        repo = self.repos[full_name] = Repository(self, full_name)
+        return repo
+
+    def create_org(self, login):
+        org = self.orgs[login] = Organization(self, login)
+        return org
+
+    # the PyGithub API
+
+    def get_repo(self, full_name):
+        self.count("GET", "/repos/" + full_name)
+        return self.repos[full_name]
+
+    def get_organization(self, login):
+        self.count("GET", "/orgs/" + login)
+        return self.orgs[login]
+
+    def get_user(self):
+        return NamedUser(self.login)
+
+    def get_rate_limit(self):
+        self.count("GET", "/rate_limit")
+
+    # GraphQL
+
+    def _graphql(self, query, variables):
+        if not self.graphql or "pullRequest(number:" not in query:
+            return {"errors": [{"message": "Not supported by the fake GitHub"}]}
+        repo = self.repos["%s/%s" % (variables["owner"], variables["name"])]
+        pr = repo.pulls.get(variables["number"])
+        if pr is None:
+            return {"data": {"repository": {"pullRequest": None}}}
+
+        with self._lock:
+            node = {
+                "number": pr.number,
+                "state": "MERGED" if pr.merged else pr.state.upper(),
+                "merged": pr.merged,
+                "mergedAt": format_datetime(pr.merged_at),
+                "changedFiles": pr.changed_files,
+                "updatedAt": format_datetime(pr.updated_at),
+                "baseRefName": pr.base.ref,
+                "baseRef": {"target": {"oid": repo.branches[pr.base.ref].sha}},
+                "labels": {
+                    "nodes": [
+                        {"name": name, "color": repo.labels[name]} for name in pr.labels
+                    ]
+                },
+                "commits": {"nodes": [self._commit_node(pr.head)] if pr.head else []},
+            }
+            if variables["withFiles"]:
+                node["files"] = _page(
+                    [{"path": f.filename} for f in pr.files], variables["filesCursor"]
+                )
+            if variables["withComments"]:
+                node["comments"] = _page(
+                    [self._comment_node(c) for c in pr.comments],
+                    variables["commentsCursor"],
+                )
+        return {"data": {"rateLimit": {"cost": 1}, "repository": {"pullRequest": node}}}
+
+    def _commit_node(self, commit):
+        latest = {}
+        for status in commit.statuses:
+            latest[status.context] = status
+        contexts = [
+            {
+                "context": s.context,
+                "state": s.state.upper(),
+                "description": s.description,
+                "targetUrl": s.target_url,
+                "createdAt": format_datetime(s.updated_at),
+            }
+            for s in latest.values()
+        ]
+        return {
+            "commit": {
+                "oid": commit.sha,
+                "message": commit.commit.message,
+                "committedDate": format_datetime(commit.commit.committer.date),
+                "committer": {"name": commit.commit.committer.name},
+                "status": {"contexts": contexts} if contexts else None,
+            }
+        }
+
+    def _comment_node(self, comment):
+        return {
+            "databaseId": comment.id,
+            "createdAt": format_datetime(comment.created_at),
+            "body": comment.body,
+            "author": {"login": comment.user.login},
+            "reactionGroups": [
+                {
+                    "content": REACTION_CONTENT[content],
+                    "viewerHasReacted": (self.login, content) in comment.reactions,
+                }
+                for content in sorted({content for _, content in comment.reactions})
+            ],
+        }
+
+
+def _page(nodes, cursor):
+    # a connection, with the position after the last node as its cursor
+    start = int(cursor or 0)
+    page = nodes[start : start + PAGE_SIZE]
+    return {
+        "pageInfo": {
+            "hasNextPage": start + len(page) < len(nodes),
+            "endCursor": str(start + len(page)) if page else None,
+        },
+        "nodes": page,
+    }
+
+
+def generate_pr(
+    repo,
+    files=10,
+    comments=0,
+    statuses=0,
+    author="alice",
+    commenters=("alice",),
+    folders=20,
+    base="main",
+    age=timedelta(hours=2),
+):
+    # A PR of synthetic but plausible shape: its files spread over 'folders'
+    # top-level folders, a commit pushed 'age' ago, then 'statuses' statuses
+    # on it (those of the real tests, and other contexts) and 'comments'
+    # comments since.
+    now = datetime.utcnow()
+    pr = repo.create_pull(
+        author,
+        [
+            "Pkg%03d/src/File%d.cc" % (i % folders, i) if i % 10 else "README%d.md" % i
+            for i in range(files)
+        ],
+        base=base,
+        when=now - age,
+    )
+    # the tests' own contexts (each set several times, as tests are re-run),
+    # and one in four from other CI systems
+    contexts = [alias for aliases in TEST_ALIASES.values() for alias in aliases]
+    for i in range(statuses):
+        context = contexts[i % len(contexts)] if i % 4 else "ci/other%d" % i
+        pr.head.add_status(
+            context,
+            "success" if i % 2 else "pending",
+            "The test has been triggered in Jenkins" if i % 2 == 0 else "Passed",
+            when=now - age + (i + 1) * age / (statuses + comments + 2),
+        )
+    for i in range(comments):
+        pr.add_comment(
+            commenters[i % len(commenters)],
+            "Looks good, thanks! (%d)" % i,
+            when=now - age + (statuses + i + 1) * age / (statuses + comments + 2),
+        )
+    return pr
@@ -0,0 +1,383 @@
+import re
+import json
+import time
+import threading
+from urllib.parse import urlsplit, parse_qsl, urlencode, unquote
+from http.server import BaseHTTPRequestHandler
+
+from Mu2eCI import tracing
+from Mu2eCI.webhook_server import ThreadingHTTPServer
+from Mu2eCI.pr_snapshot import parse_datetime
+from Mu2eCI.fake_github import format_datetime
+
+# A local HTTP stand-in for the GitHub REST (and GraphQL) API, serving a
+# Mu2eCI.fake_github model, so that the bot can be run against it through
+# PyGithub and Mu2eCI.transport as it is against GitHub, e.g. for load
+# tests. Every request is counted by endpoint in the model's Github.calls.
+#
+# The rate limit headers describe 'rate_limit' requests per hour, from when
+# the server started, so that the bot paces itself as it would on GitHub.
+
+ROUTES = []
+
+
+def route(verb, pattern):
+    def register(handler):
+        ROUTES.append((verb, re.compile("^%s$" % pattern), handler))
+        return handler
+
+    return register
+
+
+class FakeGitHubServer(ThreadingHTTPServer):
+    """
+    Serves the fake GitHub 'gh' (a fake_github.Github) on address.
+    """
+
+    def __init__(self, gh, address=("127.0.0.1", 0), rate_limit=5000):
+        super().__init__(address, Handler)
+        self.gh = gh
+        self.rate_limit = rate_limit
+        self.requests = 0
+        # bot comments posted with the same text as an earlier one on the PR
+        self.duplicate_comments = 0
+        self.reset = int(time.time()) + 3600
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://%s:%d" % self.server_address[:2]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def remaining(self):
+        with self._lock:
+            self.requests += 1
+            return max(self.rate_limit - self.requests, 0)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        return
+
+    def _reply(self, status, data=None, headers=None):
+        body = b"" if data is None else json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-RateLimit-Limit", str(self.server.rate_limit))
+        self.send_header("X-RateLimit-Remaining", str(self.server.remaining()))
+        self.send_header("X-RateLimit-Reset", str(self.server.reset))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, verb):
+        parts = urlsplit(self.path)
+        self.query = dict(parse_qsl(parts.query))
+        length = int(self.headers.get("Content-Length") or 0)
+        self.input = json.loads(self.rfile.read(length) or b"null")
+
+        gh = self.server.gh
+        with gh._lock:
+            gh.calls[tracing.endpoint_name(verb, parts.path)] += 1
+        for route_verb, pattern, handler in ROUTES:
+            match = pattern.match(parts.path)
+            if route_verb == verb and match:
+                try:
+                    with gh._lock:
+                        reply = handler(self, gh, *map(unquote, match.groups()))
+                except KeyError:
+                    reply = 404, {"message": "Not Found"}
+                self._reply(*reply)
+                return
+        self._reply(404, {"message": "Not Found"})
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+    # JSON for the fake objects, as the API would return them
+
+    @property
+    def base(self):
+        return self.server.url
+
+    def user_json(self, login):
+        return {
+            "login": login,
+            "type": "User",
+            "url": "%s/users/%s" % (self.base, login),
+        }
+
+    def repo_json(self, repo):
+        return {
+            "full_name": repo.full_name,
+            "name": repo.name,
+            "owner": self.user_json(repo.full_name.split("/")[0]),
+            "url": self.base + repo.url,
+        }
+
+    def label_json(self, repo, name):
+        return {
+            "name": name,
+            "color": repo.labels[name],
+            "url": "%s%s/labels/%s" % (self.base, repo.url, name),
+        }
+
+    def issue_json(self, pr):
+        repo = pr._repo
+        return {
+            "number": pr.number,
+            "state": pr.state,
+            "user": self.user_json(pr.user.login),
+            "labels": [self.label_json(repo, name) for name in pr.labels],
+            "pull_request": {"url": "%s%s/pulls/%d" % (self.base, repo.url, pr.number)},
+            "url": "%s%s/issues/%d" % (self.base, repo.url, pr.number),
+        }
+
+    def pull_json(self, pr):
+        repo = pr._repo
+        return {
+            "number": pr.number,
+            "state": pr.state,
+            "merged": pr.merged,
+            "merged_at": format_datetime(pr.merged_at),
+            "changed_files": pr.changed_files,
+            "updated_at": format_datetime(pr.updated_at),
+            "user": self.user_json(pr.user.login),
+            "base": {"ref": pr.base.ref, "sha": repo.branches[pr.base.ref].sha},
+            "head": {"sha": pr.head.sha},
+            "url": "%s%s/pulls/%d" % (self.base, repo.url, pr.number),
+            "issue_url": "%s%s/issues/%d" % (self.base, repo.url, pr.number),
+        }
+
+    def commit_json(self, commit):
+        return {
+            "sha": commit.sha,
+            "url": "%s%s/commits/%s" % (self.base, commit._repo.url, commit.sha),
+            "commit": {
+                "sha": commit.sha,
+                "url": "%s%s/git/commits/%s"
+                % (self.base, commit._repo.url, commit.sha),
+                "message": commit.commit.message,
+                "committer": {
+                    "name": commit.commit.committer.name,
+                    "date": format_datetime(commit.commit.committer.date),
+                },
+            },
+        }
+
+    def status_json(self, status):
+        return {
+            "context": status.context,
+            "state": status.state,
+            "description": status.description,
+            "target_url": status.target_url,
+            "created_at": format_datetime(status.updated_at),
+            "updated_at": format_datetime(status.updated_at),
+        }
+
+    def comment_json(self, repo, comment):
+        return {
+            "id": comment.id,
+            "user": self.user_json(comment.user.login),
+            "body": comment.body,
+            "created_at": format_datetime(comment.created_at),
+            "updated_at": format_datetime(comment.created_at),
+            "url": "%s%s/issues/comments/%d" % (self.base, repo.url, comment.id),
+        }
+
+    def page(self, items):
+        # one page of a listing, with GitHub's Link header
+        per_page = int(self.query.get("per_page", 30))
+        page = int(self.query.get("page", 1))
+        last = max(1, -(-len(items) // per_page))
+
+        def link(n):
+            query = dict(self.query, page=n, per_page=per_page)
+            return "<%s%s?%s>" % (self.base, urlsplit(self.path).path, urlencode(query))
+
+        links = []
+        if page < last:
+            links += ['%s; rel="next"' % link(page + 1), '%s; rel="last"' % link(last)]
+        if page > 1:
+            links += ['%s; rel="first"' % link(1), '%s; rel="prev"' % link(page - 1)]
+        headers = {"Link": ", ".join(links)} if links else {}
+        return 200, items[(page - 1) * per_page : page * per_page], headers
+
+
+# The endpoints the bot uses. Handlers are called with the model locked.
+
+
+@route("GET", "/rate_limit")
+def get_rate_limit(request, gh):
+    limit = {
+        "limit": request.server.rate_limit,
+        "remaining": max(request.server.rate_limit - request.server.requests, 0),
+        "reset": request.server.reset,
+    }
+    return 200, {
+        "resources": {"core": limit, "graphql": limit, "search": limit},
+        "rate": limit,
+    }
+
+
+@route("POST", "/graphql")
+def post_graphql(request, gh):
+    return 200, gh._graphql(request.input["query"], request.input["variables"])
+
+
+@route("GET", "/orgs/([^/]+)")
+def get_org(request, gh, login):
+    org = gh.orgs[login]
+    return 200, {"login": org.login, "url": "%s/orgs/%s" % (request.base, login)}
+
+
+@route("GET", "/orgs/([^/]+)/members/([^/]+)")
+def get_org_member(request, gh, login, user):
+    return (204, None) if user in gh.orgs[login].members else (404, None)
+
+
+@route("GET", "/orgs/([^/]+)/teams/([^/]+)")
+def get_team(request, gh, login, slug):
+    team = gh.orgs[login].teams[slug]
+    return 200, {
+        "id": sorted(gh.orgs[login].teams).index(slug) + 1,
+        "slug": team.slug,
+        "url": "%s/orgs/%s/teams/%s" % (request.base, login, slug),
+    }
+
+
+@route("GET", "/orgs/([^/]+)/teams/([^/]+)/members")
+def get_team_members(request, gh, login, slug):
+    members = gh.orgs[login].teams[slug].members
+    return request.page([request.user_json(m) for m in members])
+
+
+@route("GET", "/repos/([^/]+/[^/]+)")
+def get_repo(request, gh, full_name):
+    return 200, request.repo_json(gh.repos[full_name])
+
+
+@route("GET", "/repos/([^/]+/[^/]+)/pulls")
+def get_pulls(request, gh, full_name):
+    state, base = request.query.get("state", "open"), request.query.get("base")
+    pulls = [
+        request.pull_json(pr)
+        for _, pr in sorted(gh.repos[full_name].pulls.items())
+        if (state == "all" or pr.state == state) and base in (None, pr.base.ref)
+    ]
+    return request.page(pulls)
+
+
+@route("GET", "/repos/([^/]+/[^/]+)/pulls/(\\d+)")
+def get_pull(request, gh, full_name, number):
+    return 200, request.pull_json(gh.repos[full_name].pulls[int(number)])
+
+
+@route("GET", "/repos/([^/]+/[^/]+)/pulls/(\\d+)/commits")
+def get_pull_commits(request, gh, full_name, number):
+    pr = gh.repos[full_name].pulls[int(number)]
+    return request.page([request.commit_json(c) for c in pr.commits])
+
+
+@route("GET", "/repos/([^/]+/[^/]+)/pulls/(\\d+)/files")
+def get_pull_files(request, gh, full_name, number):
+    pr = gh.repos[full_name].pulls[int(number)]
+    return request.page([{"filename": f.filename} for f in pr.files])
+
+
+@route("GET", "/repos/([^/]+/[^/]+)/issues/(\\d+)")
+def get_issue(request, gh, full_name, number):
+    return 200, request.issue_json(gh.repos[full_name].pulls[int(number)])
+
+
+@route("PATCH", "/repos/([^/]+/[^/]+)/issues/(\\d+)")
+def edit_issue(request, gh, full_name, number):
+    repo = gh.repos[full_name]
+    pr = repo.pulls[int(number)]
+    if "labels" in request.input:
+        for name in request.input["labels"]:
+            repo.labels.setdefault(name, "ededed")
+        pr.labels = list(request.input["labels"])
+    return 200, request.issue_json(pr)
+
+
+@route("GET", "/repos/([^/]+/[^/]+)/issues/(\\d+)/comments")
+def get_issue_comments(request, gh, full_name, number):
+    repo = gh.repos[full_name]
+    comments = repo.pulls[int(number)].comments
+    since = parse_datetime(request.query.get("since"))
+    if since is not None:
+        comments = [c for c in comments if c.created_at >= since]
+    return request.page([request.comment_json(repo, c) for c in comments])
+
+
+@route("POST", "/repos/([^/]+/[^/]+)/issues/(\\d+)/comments")
+def create_issue_comment(request, gh, full_name, number):
+    repo = gh.repos[full_name]
+    pr = repo.pulls[int(number)]
+    body = request.input["body"]
+    if any(c.user.login == gh.login and c.body == body for c in pr.comments):
+        request.server.duplicate_comments += 1
+    return 201, request.comment_json(repo, pr.add_comment(gh.login, body))
+
+
+@route("POST", "/repos/([^/]+/[^/]+)/issues/comments/(\\d+)/reactions")
+def create_reaction(request, gh, full_name, comment_id):
+    comment = gh.repos[full_name]._comments[int(comment_id)]
+    comment.reactions.add((gh.login, request.input["content"]))
+    return 201, {
+        "id": next(gh._ids),
+        "content": request.input["content"],
+        "user": request.user_json(gh.login),
+    }
+
+
+@route("PATCH", "/repos/([^/]+/[^/]+)/labels/([^/]+)")
+def edit_label(request, gh, full_name, name):
+    repo = gh.repos[full_name]
+    repo.labels[name] = request.input["color"]
+    return 200, request.label_json(repo, name)
+
+
+@route("GET", "/repos/([^/]+/[^/]+)/branches/([^/]+)")
+def get_branch(request, gh, full_name, branch):
+    repo = gh.repos[full_name]
+    return 200, {"name": branch, "commit": request.commit_json(repo.branches[branch])}
+
+
+@route("GET", "/repos/([^/]+/[^/]+)/commits/([0-9a-f]+)")
+def get_commit(request, gh, full_name, sha):
+    return 200, request.commit_json(gh.repos[full_name].commits[sha])
+
+
+# PyGithub lists statuses at the older of the two URLs
+@route("GET", "/repos/([^/]+/[^/]+)/commits/([0-9a-f]+)/statuses")
+@route("GET", "/repos/([^/]+/[^/]+)/statuses/([0-9a-f]+)")
+def get_statuses(request, gh, full_name, sha):
+    statuses = gh.repos[full_name].commits[sha].statuses[::-1]
+    return request.page([request.status_json(s) for s in statuses])
+
+
+@route("POST", "/repos/([^/]+/[^/]+)/statuses/([0-9a-f]+)")
+def create_status(request, gh, full_name, sha):
+    commit = gh.repos[full_name].commits[sha]
+    commit.add_status(
+        request.input["context"],
+        request.input["state"],
+        request.input.get("description", ""),
+        request.input.get("target_url"),
+    )
+    return 201, request.status_json(commit.statuses[-1])
@@ -0,0 +1,120 @@
+import os
+import json
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from Mu2eCI.logger import get_logger
+from Mu2eCI.pr_snapshot import parse_datetime
+
+log = get_logger(__name__)
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+class GistIndex:
+    """
+    The gists of the CI user known from earlier runs, so that each run only
+    lists the gists created or updated since the last one.
+
+    File contents:
+        {"listed_at": time of the last listing,
+         "gists": {id: {"created_at": time, "size": bytes}}}
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path, "r") as f:
+                contents = json.load(f)
+        except (OSError, ValueError):
+            contents = {"listed_at": None, "gists": {}}
+        self.listed_at = parse_datetime(contents["listed_at"])
+        self.gists = contents["gists"]
+
+    def save(self):
+        contents = {
+            "listed_at": (
+                self.listed_at.strftime(TIME_FORMAT) if self.listed_at else None
+            ),
+            "gists": self.gists,
+        }
+        tmp_name = "%s.%d" % (self.path, os.getpid())
+        with open(tmp_name, "w") as f:
+            json.dump(contents, f)
+        os.replace(tmp_name, self.path)
+
+    def update(self, gh_user):
+        # Add the gists created or updated since the last listing.
+        # Returns the number of gists listed.
+        started = datetime.utcnow()
+        if self.listed_at is None:
+            gists = gh_user.get_gists()
+        else:
+            gists = gh_user.get_gists(since=self.listed_at)
+        listed = 0
+        for gist in gists:
+            listed += 1
+            self.gists[gist.id] = {
+                "created_at": gist.created_at.strftime(TIME_FORMAT),
+                "size": sum(f.size for f in gist.files.values()),
+            }
+        # allow for clock differences with GitHub
+        self.listed_at = started - timedelta(minutes=5)
+        return listed
+
+    def expired(self, max_age_days, now=None):
+        # ids of the gists older than max_age_days, oldest first
+        if now is None:
+            now = datetime.utcnow()
+        cutoff = (now - timedelta(days=max_age_days)).strftime(TIME_FORMAT)
+        return sorted(
+            (g for g in self.gists if self.gists[g]["created_at"] < cutoff),
+            key=lambda g: self.gists[g]["created_at"],
+        )
+
+
+def delete_gist(gh_user, gist_id):
+    # True if the gist is gone (including if it was deleted already)
+    from github import UnknownObjectException
+
+    try:
+        gh_user._requester.requestJsonAndCheck("DELETE", "/gists/%s" % gist_id)
+    except UnknownObjectException:
+        pass
+    except Exception:
+        log.exception("Failed to delete gist %s", gist_id)
+        return False
+    return True
+
+
+def collect(gh_user, index, max_age_days, max_deletes, workers, dryRun=False):
+    # Delete the expired gists in the index, at most max_deletes of them.
+    # Requests are paced by the shared rate limiter (see Mu2eCI.transport).
+    # Returns (gists deleted, bytes reclaimed, expired gists left).
+    listed = index.update(gh_user)
+    expired = index.expired(max_age_days)
+    log.info(
+        "%d gists listed, %d known, %d older than %d days",
+        listed,
+        len(index.gists),
+        len(expired),
+        max_age_days,
+    )
+    to_delete = expired[:max_deletes]
+    if dryRun:
+        log.info("Not deleting %d gists (dry-run)", len(to_delete))
+        return 0, 0, len(expired)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(
+            executor.map(lambda gist_id: delete_gist(gh_user, gist_id), to_delete)
+        )
+
+    deleted = 0
+    reclaimed = 0
+    for gist_id, gone in zip(to_delete, results):
+        if gone:
+            deleted += 1
+            reclaimed += index.gists.pop(gist_id)["size"]
+    index.save()
+    return deleted, reclaimed, len(expired) - deleted
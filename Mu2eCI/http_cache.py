@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+from Mu2eCI.logger import get_logger
+
+log = get_logger(__name__)
+
+
+class ETagCache:
+    """
+    On-disk store of GitHub API GET responses, keyed by URL, that lets
+    repeated requests be sent as conditional requests (If-None-Match /
+    If-Modified-Since). GitHub answers these with 304 Not Modified when the
+    resource is unchanged, and 304 responses do not count against the
+    API rate limit.
+
+    Entries not looked up for a while are pruned (see prune), and listings
+    of what changed since a given time are not stored, as each such URL is
+    only requested once.
+    """
+
+    PRUNED_MARKER = ".pruned"
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _key(self, url, headers):
+        # GitHub varies responses on Accept and Authorization
+        key = "\0".join(
+            [url, headers.get("Accept", ""), headers.get("Authorization", "")]
+        )
+        return os.path.join(self.path, hashlib.sha256(key.encode()).hexdigest())
+
+    def lookup(self, url, headers):
+        file_name = self._key(url, headers)
+        try:
+            with open(file_name, "r") as f:
+                entry = json.load(f)
+            # the modification time is when the entry was last used (see prune)
+            os.utime(file_name)
+            return entry
+        except (OSError, ValueError):
+            return None
+
+    def prune(self, max_age_days):
+        # Delete the entries not stored or looked up in max_age_days, at most
+        # once a day. Returns the number of files deleted.
+        now = time.time()
+        marker = os.path.join(self.path, self.PRUNED_MARKER)
+        try:
+            if now - os.path.getmtime(marker) < 86400:
+                return 0
+        except OSError:
+            pass
+        cutoff = now - max_age_days * 86400
+        deleted = 0
+        try:
+            with open(marker, "w"):
+                pass
+            entries = list(os.scandir(self.path))
+        except OSError:
+            log.warning("Could not prune the HTTP cache in %s", self.path)
+            return 0
+        for entry in entries:
+            try:
+                if entry.name != self.PRUNED_MARKER and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    deleted += 1
+            except OSError:
+                # e.g. pruned by another run at the same time
+                pass
+        if deleted:
+            log.info("Pruned %d entries from the HTTP cache", deleted)
+        return deleted
+
+    def conditional_headers(self, entry):
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def store(self, url, headers, status, response_headers, body):
+        etag = response_headers.get("etag")
+        last_modified = response_headers.get("last-modified")
+        if status != 200 or not (etag or last_modified):
+            return
+        query = url.partition("?")[2]
+        if any(p.partition("=")[0] == "since" for p in query.split("&")):
+            return
+        entry = {
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "headers": response_headers,
+            "body": body,
+        }
+        file_name = self._key(url, headers)
+        tmp_name = "%s.%d.%d" % (file_name, os.getpid(), threading.get_ident())
+        try:
+            with open(tmp_name, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp_name, file_name)
+        except OSError:
+            log.warning("Could not write HTTP cache entry for %s", url)
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        log.info(
+            "HTTP cache: %d hits (304 Not Modified), %d misses, %.0f%% hit rate",
+            self.hits,
+            self.misses,
+            100.0 * self.hits / total if total else 0.0,
+        )
@@ -0,0 +1,112 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from Mu2eCI import config
+from Mu2eCI import cassette
+from Mu2eCI.logger import get_logger
+
+log = get_logger(__name__)
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class JenkinsClient:
+    """
+    Triggers parameterised Jenkins jobs with buildWithParameters, over one
+    keep-alive session. The CSRF crumb is fetched once, and again only if
+    Jenkins rejects it (crumbs are tied to the session cookie).
+    """
+
+    def __init__(self, server, user=None, token=None, pool_size=4, timeout=30):
+        import requests
+
+        self.server = server.rstrip("/")
+        self.timeout = timeout
+        self.pool_size = pool_size
+        adapter = requests.adapters.HTTPAdapter(
+            max_retries=3, pool_connections=1, pool_maxsize=pool_size
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        cassette.mount(self.session)
+        if user is not None:
+            self.session.auth = (user, token)
+        self._crumb = None
+        self._crumb_lock = threading.Lock()
+
+    def _crumb_header(self, refresh=False):
+        with self._crumb_lock:
+            if self._crumb is None or refresh:
+                r = self.session.get(
+                    self.server + "/crumbIssuer/api/json", timeout=self.timeout
+                )
+                if r.status_code == 404:
+                    # CSRF protection is switched off
+                    self._crumb = {}
+                else:
+                    r.raise_for_status()
+                    crumb = r.json()
+                    self._crumb = {crumb["crumbRequestField"]: crumb["crumb"]}
+            return self._crumb
+
+    def build_with_parameters(self, job, parameters):
+        # Queue a build of job, and return the id of its queue item.
+        url = "%s/job/%s/buildWithParameters" % (self.server, quote(job))
+        r = self.session.post(
+            url, data=parameters, headers=self._crumb_header(), timeout=self.timeout
+        )
+        if r.status_code == 403:
+            # the crumb may have expired with the session
+            r = self.session.post(
+                url,
+                data=parameters,
+                headers=self._crumb_header(refresh=True),
+                timeout=self.timeout,
+            )
+        r.raise_for_status()
+
+        # Location: <server>/queue/item/<id>/
+        location = r.headers.get("Location", "")
+        try:
+            return int(location.rstrip("/").rsplit("/", 1)[-1])
+        except ValueError:
+            # not queued, e.g. a login page in front of Jenkins answered 200
+            raise RuntimeError(
+                "Jenkins did not return a queue item for %s (%s)" % (job, r.status_code)
+            )
+
+    def trigger_many(self, builds):
+        # Queue several (job, parameters) builds at once. Returns their queue
+        # item ids in the same order, with None for those that failed.
+        def trigger(build):
+            job, parameters = build
+            try:
+                queue_id = self.build_with_parameters(job, parameters)
+                log.info("Queued %s on Jenkins (queue item %s)", job, queue_id)
+                return queue_id
+            except Exception:
+                log.exception("Failed to trigger %s on Jenkins", job)
+                return None
+
+        with ThreadPoolExecutor(max_workers=self.pool_size) as executor:
+            return list(executor.map(trigger, builds))
+
+
+def get_client():
+    # one client (and so one session and crumb) per process
+    global _client
+    with _client_lock:
+        if _client is None:
+            settings = config.main["jenkins"]
+            _client = JenkinsClient(
+                config.main["jenkins_server"],
+                user=os.environ.get("JENKINS_USER"),
+                token=os.environ.get("JENKINS_TOKEN"),
+                pool_size=settings["pool_size"],
+                timeout=settings["timeout"],
+            )
+        return _client
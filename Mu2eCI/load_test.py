@@ -0,0 +1,293 @@
+import os
+import hmac
+import json
+import time
+import random
+import shutil
+import hashlib
+import tempfile
+import threading
+import urllib.request
+from collections import namedtuple
+
+from Mu2eCI import config
+from Mu2eCI import common
+from Mu2eCI import benchmark
+from Mu2eCI import fake_github
+from Mu2eCI import transport
+from Mu2eCI.fake_server import FakeGitHubServer
+from Mu2eCI.webhook_server import Dispatcher, make_server
+
+# Storms of webhook events, sent to the webhook server (and so to
+# process_pr) while it works against a fake GitHub on a local port.
+
+# kind: comment, test (a comment asking for a test), push or merge.
+# sent is when the webhook was sent (time.monotonic()).
+Event = namedtuple("Event", ["kind", "repository", "pr", "sent"])
+
+# How long after each event the PR had been processed, with everything the
+# servers counted. latencies are in seconds, None for events never processed.
+Result = namedtuple(
+    "Result",
+    [
+        "events",
+        "runs",
+        "coalesced",
+        "duration",
+        "latencies",
+        "api_calls",
+        "endpoints",
+        "spam_guard_hits",
+        "duplicate_comments",
+    ],
+)
+
+KIND_WEIGHTS = {"comment": 5, "test": 3, "push": 2}
+
+
+class RecordingDispatcher(Dispatcher):
+    """A Dispatcher that remembers when each run of process_pr started and ended."""
+
+    def __init__(self, gh, workers=1):
+        self.runs = []  # ((repository, PR number), start, end)
+        self._runs_lock = threading.Lock()
+        super().__init__(gh, workers=workers)
+
+    def process(self, repository, pr_number):
+        start = time.monotonic()
+        try:
+            super().process(repository, pr_number)
+        finally:
+            with self._runs_lock:
+                self.runs.append(((repository, pr_number), start, time.monotonic()))
+
+    def finished_runs(self):
+        with self._runs_lock:
+            return list(self.runs)
+
+
+def send_webhook(url, event, payload):
+    body = json.dumps(payload).encode()
+    request = urllib.request.Request(
+        url, data=body, headers={"X-GitHub-Event": event}, method="POST"
+    )
+    secret = os.environ.get("WEBHOOK_SECRET")
+    if secret:
+        request.add_header(
+            "X-Hub-Signature-256",
+            "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest(),
+        )
+    with urllib.request.urlopen(request, timeout=30) as response:
+        response.read()
+
+
+def make_event(gh, repo, kind, rng):
+    # Change the fake GitHub as the event would, and return its webhook.
+    with gh._lock:
+        open_prs = [pr for pr in repo.pulls.values() if pr.state == "open"]
+        if kind == "merge" and len(open_prs) < 2:
+            kind = "comment"
+        pr = rng.choice(open_prs)
+        user = rng.choice(benchmark.USERS)
+        if kind in ("comment", "test"):
+            body = (
+                "@%s run build test" % gh.login
+                if kind == "test"
+                else "Thanks, this looks fine to me."
+            )
+            pr.add_comment(user, body)
+            webhook = "issue_comment", {
+                "action": "created",
+                "repository": {"full_name": repo.full_name},
+                "issue": {"number": pr.number, "pull_request": {}},
+            }
+        else:
+            if kind == "push":
+                pr.push(author=pr.user.login)
+                action = "synchronize"
+            else:
+                pr.merge()
+                action = "closed"
+            webhook = "pull_request", {
+                "action": action,
+                "repository": {"full_name": repo.full_name},
+                "pull_request": {"number": pr.number},
+            }
+    return kind, pr.number, webhook
+
+
+def storm(
+    gh,
+    repo,
+    webhook_url,
+    events,
+    rate,
+    burst=1,
+    merge_every=0,
+    seed=0,
+):
+    # Send 'events' webhooks, 'burst' at a time, at 'rate' events per second
+    # on average. Every merge_every-th event merges a PR (which re-checks all
+    # the other open PRs into its branch).
+    rng = random.Random(seed)
+    kinds, weights = zip(*KIND_WEIGHTS.items())
+    sent = []
+    start = time.monotonic()
+    for i in range(events):
+        if merge_every and (i + 1) % merge_every == 0:
+            kind = "merge"
+        else:
+            kind = rng.choices(kinds, weights)[0]
+        kind, number, (event, payload) = make_event(gh, repo, kind, rng)
+        sent.append(Event(kind, repo.full_name, number, time.monotonic()))
+        send_webhook(webhook_url, event, payload)
+        if (i + 1) % burst == 0:
+            # wait for the next burst's turn
+            delay = start + (i + 1) / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    return sent
+
+
+def latencies(sent, runs):
+    # For each event, the time until the end of the first run of process_pr
+    # on its PR that started after it (None if there was none).
+    by_pr = {}
+    for key, start, end in sorted(runs, key=lambda r: r[1]):
+        by_pr.setdefault(key, []).append((start, end))
+    result = []
+    for event in sent:
+        ends = [
+            end
+            for start, end in by_pr.get((event.repository, event.pr), [])
+            if start >= event.sent
+        ]
+        result.append(ends[0] - event.sent if ends else None)
+    return result
+
+
+def run(
+    prs=50,
+    events=200,
+    rate=20.0,
+    burst=1,
+    merge_every=50,
+    workers=4,
+    quiet_window=0.5,
+    max_delay=5.0,
+    rate_limit=1000000,
+    graphql=True,
+    timeout=300,
+    seed=0,
+):
+    workdir = tempfile.mkdtemp(prefix="mu2eci-load-test-")
+    cwd = os.getcwd()
+    github = webhooks = None
+    try:
+        benchmark.setup_environment(workdir, watchers=100)
+        benchmark.fresh_cache(workdir)
+        config.override(
+            "main",
+            dict(
+                config.main,
+                coalesce={"quiet_window": quiet_window, "max_delay": max_delay},
+            ),
+        )
+
+        gh = fake_github.Github(config.main["bot"]["username"], graphql=graphql)
+        gh.create_org("Mu2e").add_team(benchmark.TEAM, benchmark.USERS)
+        repo = gh.create_repo(benchmark.REPOSITORY)
+        for i in range(prs):
+            fake_github.generate_pr(
+                repo,
+                files=20,
+                comments=5,
+                statuses=3,
+                author=benchmark.USERS[i % len(benchmark.USERS)],
+            )
+        github = FakeGitHubServer(gh, rate_limit=rate_limit).start()
+
+        client = transport.github_client("load-test", base_url=github.url)
+        dispatcher = RecordingDispatcher(client, workers=workers)
+        webhooks = make_server(dispatcher, ("127.0.0.1", 0))
+        threading.Thread(target=webhooks.serve_forever, daemon=True).start()
+        webhook_url = "http://%s:%d/" % webhooks.server_address[:2]
+
+        spam_guard_hits = common.spam_guard_hits
+        start = time.monotonic()
+        sent = storm(gh, repo, webhook_url, events, rate, burst, merge_every, seed)
+
+        # wait until every event has been dealt with
+        while True:
+            runs = dispatcher.finished_runs()
+            waits = latencies(sent, runs)
+            if all(w is not None for w in waits) or time.monotonic() - start > timeout:
+                break
+            time.sleep(0.1)
+        duration = max([end for _, _, end in runs] + [sent[-1].sent]) - start
+
+        return Result(
+            events=sent,
+            runs=len(runs),
+            coalesced=dispatcher.queue.coalesced,
+            duration=duration,
+            latencies=waits,
+            api_calls=sum(gh.calls.values()),
+            endpoints=dict(gh.calls),
+            spam_guard_hits=common.spam_guard_hits - spam_guard_hits,
+            duplicate_comments=github.duplicate_comments,
+        )
+    finally:
+        for server in (webhooks, github):
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+        # setup_environment moved into workdir
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def format_result(result, endpoints=False):
+    done = [w for w in result.latencies if w is not None]
+    kinds = {}
+    for event in result.events:
+        kinds[event.kind] = kinds.get(event.kind, 0) + 1
+    lines = [
+        "Events: %d (%s), in %d runs of process_pr (%d coalesced)"
+        % (
+            len(result.events),
+            ", ".join("%d %s" % (n, kind) for kind, n in sorted(kinds.items())),
+            result.runs,
+            result.coalesced,
+        ),
+        "Throughput: %.1f events/s over %.1f s"
+        % (len(done) / result.duration if result.duration else 0, result.duration),
+    ]
+    if done:
+        lines.append(
+            "Event to processed PR: p50 %.0f ms, p99 %.0f ms, max %.0f ms"
+            % (
+                percentile(done, 0.5) * 1e3,
+                percentile(done, 0.99) * 1e3,
+                max(done) * 1e3,
+            )
+        )
+    if len(done) < len(result.events):
+        lines.append(
+            "Not processed in time: %d events" % (len(result.events) - len(done))
+        )
+    lines += [
+        "Spam guard: %d comments not posted again, %d duplicate bot comments posted"
+        % (result.spam_guard_hits, result.duplicate_comments),
+        "API calls: %d, %.1f per event"
+        % (result.api_calls, result.api_calls / max(len(result.events), 1)),
+    ]
+    if endpoints:
+        for endpoint, calls in sorted(result.endpoints.items()):
+            lines.append("    %-62s %6d" % (endpoint, calls))
+    return "\n".join(lines)
@@ -0,0 +1,118 @@
+import os
+import hashlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from Mu2eCI.logger import get_logger
+
+log = get_logger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+# A log file given on the command line. When it is over the per-file size
+# cap, only the bytes from 'offset' on (the end of the log) are uploaded.
+LogFile = namedtuple("LogFile", ["name", "path", "size", "digest", "offset"])
+# A piece of a log file, uploaded as one file of a gist
+Part = namedtuple("Part", ["name", "log", "start", "end"])
+
+
+def scan(path, name, max_file_size):
+    # Hash a log file a chunk at a time, so that identical logs are only
+    # uploaded once without ever holding a whole log in memory.
+    size = os.path.getsize(path)
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return LogFile(name, path, size, digest.hexdigest(), max(size - max_file_size, 0))
+
+
+def plan_upload(logs, part_size, gist_size, max_total_size):
+    # Split the logs into parts of at most part_size bytes and pack them into
+    # gists of at most gist_size bytes, in order.
+    # Returns (gists as lists of Parts, notes on files not uploaded in full).
+    gists = [[]]
+    used = 0
+    total = 0
+    notes = []
+    seen = {}
+    for lf in logs:
+        if lf.digest in seen:
+            notes.append("%s: identical to %s" % (lf.name, seen[lf.digest]))
+            continue
+        seen[lf.digest] = lf.name
+        if lf.size == 0:
+            notes.append("%s: empty" % lf.name)
+            continue
+        if total + lf.size - lf.offset > max_total_size:
+            notes.append("%s: not uploaded (total upload size limit reached)" % lf.name)
+            continue
+        if lf.offset > 0:
+            notes.append(
+                "%s: only the last %d of %d bytes uploaded"
+                % (lf.name, lf.size - lf.offset, lf.size)
+            )
+        total += lf.size - lf.offset
+
+        starts = list(range(lf.offset, lf.size, part_size))
+        for i, start in enumerate(starts):
+            end = min(start + part_size, lf.size)
+            name = lf.name
+            if len(starts) > 1:
+                name = "%s.part%03d" % (lf.name, i + 1)
+            if used + end - start > gist_size and gists[-1]:
+                gists.append([])
+                used = 0
+            gists[-1].append(Part(name, lf, start, end))
+            used += end - start
+    return [g for g in gists if g], notes
+
+
+def read_part(part):
+    with open(part.log.path, "rb") as f:
+        f.seek(part.start)
+        # parts may split a multi-byte character
+        return f.read(part.end - part.start).decode("utf-8", errors="replace")
+
+
+def upload(gh_user, logs, description, settings):
+    # Upload the logs, and return the URL to print: that of the only gist
+    # if everything fits in one, otherwise that of an index gist linking to
+    # all of them. At most 'workers' gists are held in memory at a time.
+    from github import InputFileContent
+
+    gists, notes = plan_upload(
+        logs,
+        settings["part_size"],
+        settings["gist_size"],
+        settings["max_total_size"],
+    )
+
+    def create(numbered):
+        i, parts = numbered
+        files = {p.name: InputFileContent(read_part(p)) for p in parts}
+        if len(gists) > 1 or notes:
+            desc = "%s (part %d of %d)" % (description, i + 1, len(gists))
+        else:
+            desc = description
+        gist = gh_user.create_gist(public=False, files=files, description=desc)
+        log.info("Uploaded %s to %s", ", ".join(files), gist.html_url)
+        return gist
+
+    with ThreadPoolExecutor(max_workers=settings["workers"]) as executor:
+        created = list(executor.map(create, enumerate(gists)))
+
+    if len(created) == 1 and not notes:
+        return created[0].url
+
+    lines = ["# %s" % description, ""]
+    for parts, gist in zip(gists, created):
+        lines += ["- [%s](%s)" % (p.name, gist.html_url) for p in parts]
+    if notes:
+        lines += [""] + ["- %s" % note for note in notes]
+    index = gh_user.create_gist(
+        public=False,
+        files={"index.md": InputFileContent("\n".join(lines) + "\n")},
+        description=description,
+    )
+    return index.url
@@ -1,20 +1,81 @@
+import json
+import queue
+import atexit
 import logging
+import logging.handlers
+
+from Mu2eCI import config
 
 LOG_LEVEL = logging.DEBUG
 LOG_LEVEL_FILE = logging.DEBUG
 LOG_FORMAT = "[%(asctime)s] %(name)s:%(levelname)s  |  %(message)s"
 LOG_FILE = "Mu2eCI.log"
 
-stream = logging.StreamHandler()
-stream.setLevel(LOG_LEVEL)
-stream.setFormatter(logging.Formatter(LOG_FORMAT))
 
-streamf = logging.FileHandler(LOG_FILE)
-streamf.setLevel(LOG_LEVEL_FILE)
-streamf.setFormatter(logging.Formatter(LOG_FORMAT))
+class JsonFormatter(logging.Formatter):
+    # one JSON object per line, for log shippers
+    def format(self, record):
+        return json.dumps(
+            {
+                "time": self.formatTime(record),
+                "logger": record.name,
+                "level": record.levelname,
+                "message": record.getMessage(),
+            }
+        )
 
-log = logging.getLogger("Mu2eCI")
 
-log.setLevel(LOG_LEVEL)
-log.addHandler(stream)
-log.addHandler(streamf)
+def _file_handler(settings):
+    # the log file is only created once there is something to log
+    file_name = settings.get("file", LOG_FILE)
+    if settings.get("rotate") == "time":
+        return logging.handlers.TimedRotatingFileHandler(
+            file_name,
+            when=settings.get("when", "midnight"),
+            backupCount=settings.get("backup_count", 5),
+            delay=True,
+        )
+    return logging.handlers.RotatingFileHandler(
+        file_name,
+        maxBytes=settings.get("max_bytes", 0),
+        backupCount=settings.get("backup_count", 5),
+        delay=True,
+    )
+
+
+def _setup(logger):
+    # Records are put on a queue, and written out by a background thread,
+    # so logging never waits on the disk.
+    settings = config.main.get("logging", {})
+
+    stream = logging.StreamHandler()
+    stream.setLevel(LOG_LEVEL)
+    stream.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    streamf = _file_handler(settings)
+    streamf.setLevel(settings.get("file_level", LOG_LEVEL_FILE))
+    streamf.setFormatter(
+        JsonFormatter() if settings.get("json") else logging.Formatter(LOG_FORMAT)
+    )
+
+    records = queue.Queue()
+    listener = logging.handlers.QueueListener(
+        records, stream, streamf, respect_handler_level=True
+    )
+    listener.start()
+    # write out whatever is still queued when the script ends
+    atexit.register(listener.stop)
+
+    logger.setLevel(settings.get("level", LOG_LEVEL))
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    for name, level in settings.get("levels", {}).items():
+        logging.getLogger(name).setLevel(level)
+
+
+def get_logger(name):
+    # e.g. get_logger(__name__) for a module of this package
+    return logging.getLogger(name)
+
+
+log = logging.getLogger("Mu2eCI")
+_setup(log)
@@ -0,0 +1,104 @@
+import os
+import json
+import time
+import fcntl
+import threading
+
+from Mu2eCI import config
+from Mu2eCI.logger import get_logger
+
+log = get_logger(__name__)
+
+# Organisation membership and authorised team rosters change rarely, so they
+# are kept in a JSON file shared by every run of the bot:
+#
+# {
+#   "teams": {"<org>/<team slug>": {"time": <unix time>, "members": [...]}},
+#   "members": {"<org>/<login>": {"time": <unix time>, "member": true|false}}
+# }
+#
+# Entries expire after the configured TTL, and can be dropped explicitly
+# with invalidate() (see the invalidate-membership-cache script).
+
+_lock = threading.Lock()
+
+
+def _cache_file():
+    return config.cache_path("membership.json")
+
+
+def _ttl(member=True):
+    settings = config.main["cache"]
+    return settings["membership_ttl"] if member else settings["nonmember_ttl"]
+
+
+def _read():
+    try:
+        with open(_cache_file(), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"teams": {}, "members": {}}
+
+
+def _update(section, key, value):
+    # read-modify-write under a file lock, so concurrent runs don't
+    # drop each other's entries
+    with _lock, open(_cache_file() + ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        contents = _read()
+        if value is None:
+            contents[section].pop(key, None)
+        else:
+            contents[section][key] = dict(value, time=time.time())
+        tmp_name = "%s.%d" % (_cache_file(), os.getpid())
+        with open(tmp_name, "w") as f:
+            json.dump(contents, f)
+        os.replace(tmp_name, _cache_file())
+
+
+def _lookup(section, key):
+    entry = _read()[section].get(key)
+    if entry is None:
+        return None
+    ttl = _ttl(entry.get("member", True))
+    if time.time() - entry["time"] > ttl:
+        return None
+    return entry
+
+
+def get_team_members(org, team_slug):
+    key = "%s/%s" % (org.login, team_slug)
+    entry = _lookup("teams", key)
+    if entry is not None:
+        return entry["members"]
+
+    log.debug("Membership cache miss for team %s", key)
+    members = [mem.login for mem in org.get_team_by_slug(team_slug).get_members()]
+    _update("teams", key, {"members": members})
+    return members
+
+
+def is_org_member(org, user):
+    key = "%s/%s" % (org.login, user.login)
+    entry = _lookup("members", key)
+    if entry is not None:
+        return entry["member"]
+
+    log.debug("Membership cache miss for user %s", key)
+    member = org.has_in_members(user)
+    _update("members", key, {"member": member})
+    return member
+
+
+def invalidate(teams=None, users=None):
+    # Drop cached entries: the given teams/users ("<org>/<name>"), or everything.
+    if teams is None and users is None:
+        with _lock, open(_cache_file() + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if os.path.exists(_cache_file()):
+                os.remove(_cache_file())
+        return
+    for team in teams or []:
+        _update("teams", team, None)
+    for user in users or []:
+        _update("members", user, None)
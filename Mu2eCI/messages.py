@@ -20,6 +20,8 @@ which require these tests: {tests_required}.
 TESTS_TRIGGERED_CONFIRMATION = """:hourglass: The following tests have been triggered for {commit_link}: {test_list} {tests_already_running_msg} (Build queue {build_queue_str})
 """
 
+TESTS_NOT_TRIGGERED = """:x: The following tests could not be triggered in Jenkins for {commit_link}: {test_list}. They can be re-triggered."""
+
 TESTS_ALREADY_TRIGGERED = """:x: Those tests have already run or are running for {commit_link} ({triggered_tests})"""
 
 PR_AUTHOR_NONMEMBER = """:memo: The author of this pull request is not a member of the [Mu2e github organisation](https://github.com/Mu2e)."""
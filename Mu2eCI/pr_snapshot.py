@@ -0,0 +1,327 @@
+import logging
+from collections import namedtuple
+from datetime import datetime
+
+from Mu2eCI import tracing
+from Mu2eCI.logger import get_logger
+
+log = get_logger(__name__)
+
+# Everything process_pr needs to know about a PR, as plain data.
+# Datetimes are naive UTC, like those returned by PyGithub.
+PRSnapshot = namedtuple(
+    "PRSnapshot",
+    [
+        "number",
+        "state",  # open, closed (as in the REST API - a merged PR is closed)
+        "merged",
+        "merged_at",
+        "changed_files",
+        "updated_at",
+        "base_ref",
+        "base_sha",  # HEAD of the base branch
+        "commit",  # latest commit of the PR, or None
+        "files",  # paths of the changed files, or None if not fetched
+        "folders",  # their top-level folders (see add_folders), or None
+        "statuses",  # commit statuses on the latest commit
+        "comments",  # comments made since comments_cursor
+        "comments_cursor",  # GraphQL cursor after the last comment fetched
+        "labels",
+    ],
+)
+Commit = namedtuple("Commit", ["sha", "message", "committer_name", "committed_date"])
+Status = namedtuple(
+    "Status", ["context", "state", "description", "target_url", "updated_at"]
+)
+# bot_reacted is None when it is not known (REST fallback)
+Comment = namedtuple("Comment", ["id", "author", "created_at", "body", "bot_reacted"])
+Label = namedtuple("Label", ["name", "color"])
+
+PAGE_SIZE = 100
+
+SNAPSHOT_QUERY = """
+query ($owner: String!, $name: String!, $number: Int!,
+       $withFiles: Boolean!, $filesCursor: String,
+       $withComments: Boolean!, $commentsCursor: String) {
+  rateLimit { cost }
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      number
+      state
+      merged
+      mergedAt
+      changedFiles
+      updatedAt
+      baseRefName
+      baseRef { target { oid } }
+      labels(first: 100) { nodes { name color } }
+      commits(last: 1) {
+        nodes {
+          commit {
+            oid
+            message
+            committedDate
+            committer { name }
+            status {
+              contexts { context state description targetUrl createdAt }
+            }
+          }
+        }
+      }
+      files(first: %(page_size)d, after: $filesCursor) @include(if: $withFiles) {
+        pageInfo { hasNextPage endCursor }
+        nodes { path }
+      }
+      comments(first: %(page_size)d, after: $commentsCursor) @include(if: $withComments) {
+        pageInfo { hasNextPage endCursor }
+        nodes {
+          databaseId
+          createdAt
+          body
+          author { login }
+          reactionGroups { content viewerHasReacted }
+        }
+      }
+    }
+  }
+}
+""" % {
+    "page_size": PAGE_SIZE
+}
+
+
+def add_folders(folders, paths):
+    # Add the top-level folders of paths ("/" for the top level itself) to
+    # the set 'folders', which can so be built a page of files at a time.
+    debug = log.isEnabledFor(logging.DEBUG)
+    for path in paths:
+        if debug:
+            log.debug("Changed file: %s", path)
+        folder, slash, _ = path.partition("/")
+        folders.add(folder if slash else "/")
+    return folders
+
+
+def parse_datetime(value):
+    if value is None:
+        return None
+    return datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
+
+
+def statuses_from_graphql(status):
+    # the 'status' of a GraphQL Commit, which is null when there are none
+    return [
+        Status(
+            context=ctx["context"],
+            state=ctx["state"].lower(),
+            description=ctx["description"] or "",
+            target_url=ctx["targetUrl"],
+            updated_at=parse_datetime(ctx["createdAt"]),
+        )
+        for ctx in (status or {"contexts": []})["contexts"]
+    ]
+
+
+def graphql(repo, query, variables):
+    # use the same requester (and so the same connection) as the REST API
+    _, data = repo._requester.requestJsonAndCheck(
+        "POST", "/graphql", input={"query": query, "variables": variables}
+    )
+    if data.get("errors"):
+        raise RuntimeError(
+            "GraphQL query failed: %s"
+            % "; ".join(e.get("message", str(e)) for e in data["errors"])
+        )
+    return data["data"]
+
+
+def _snapshot_from_graphql(repo, number, comments_cursor=None, known=None):
+    owner, name = repo.full_name.split("/")
+    variables = {
+        "owner": owner,
+        "name": name,
+        "number": number,
+        "withFiles": known is None,
+        "filesCursor": None,
+        "withComments": True,
+        "commentsCursor": comments_cursor,
+    }
+
+    files = None
+    folders = None
+    comments = []
+    pr = None
+    while variables["withFiles"] or variables["withComments"]:
+        pr = graphql(repo, SNAPSHOT_QUERY, variables)["repository"]["pullRequest"]
+        if pr is None:
+            raise RuntimeError("PR %s not found in %s" % (number, repo.full_name))
+
+        if files is None and not variables["withFiles"] and _head(pr) != known:
+            # the files have changed since they were last fetched
+            variables["withFiles"] = True
+            continue
+
+        if variables["withFiles"]:
+            paths = [node["path"] for node in pr["files"]["nodes"]]
+            if files is None:
+                files, folders = [], set()
+            files += paths
+            add_folders(folders, paths)
+            page = pr["files"]["pageInfo"]
+            variables["withFiles"] = page["hasNextPage"]
+            variables["filesCursor"] = page["endCursor"]
+
+        if variables["withComments"]:
+            for node in pr["comments"]["nodes"]:
+                comments.append(
+                    Comment(
+                        id=node["databaseId"],
+                        # deleted users ('ghost') have no author
+                        author=(node["author"] or {"login": "ghost"})["login"],
+                        created_at=parse_datetime(node["createdAt"]),
+                        body=node["body"],
+                        bot_reacted=any(
+                            r["viewerHasReacted"] for r in node["reactionGroups"] or []
+                        ),
+                    )
+                )
+            page = pr["comments"]["pageInfo"]
+            variables["withComments"] = page["hasNextPage"]
+            # there is no endCursor when there are no new comments
+            if page["endCursor"] is not None:
+                variables["commentsCursor"] = page["endCursor"]
+
+        if pr["state"] != "OPEN":
+            # a closed PR is not processed any further than this
+            break
+
+    commit = None
+    statuses = []
+    if pr["commits"]["nodes"]:
+        git_commit = pr["commits"]["nodes"][0]["commit"]
+        commit = Commit(
+            sha=git_commit["oid"],
+            message=git_commit["message"],
+            committer_name=git_commit["committer"]["name"],
+            committed_date=parse_datetime(git_commit["committedDate"]),
+        )
+        # only the latest status of each context is returned, which is
+        # the only one process_pr looks at
+        statuses = statuses_from_graphql(git_commit["status"])
+
+    return PRSnapshot(
+        number=pr["number"],
+        state="open" if pr["state"] == "OPEN" else "closed",
+        merged=pr["merged"],
+        merged_at=parse_datetime(pr["mergedAt"]),
+        changed_files=pr["changedFiles"],
+        updated_at=parse_datetime(pr["updatedAt"]),
+        base_ref=pr["baseRefName"],
+        base_sha=pr["baseRef"]["target"]["oid"] if pr["baseRef"] else None,
+        commit=commit,
+        files=files,
+        folders=folders,
+        statuses=statuses,
+        comments=comments,
+        comments_cursor=variables["commentsCursor"],
+        labels=[Label(n["name"], n["color"]) for n in pr["labels"]["nodes"]],
+    )
+
+
+def _head(pr):
+    # (head sha, base branch) of a GraphQL PullRequest
+    commits = pr["commits"]["nodes"]
+    return (commits[0]["commit"]["oid"] if commits else None, pr["baseRefName"])
+
+
+def _snapshot_from_rest(repo, issue, since=None, known=None):
+    pr = repo.get_pull(issue.number)
+    snapshot = PRSnapshot(
+        number=pr.number,
+        state=pr.state,
+        merged=pr.merged,
+        merged_at=pr.merged_at,
+        changed_files=pr.changed_files,
+        updated_at=pr.updated_at,
+        base_ref=pr.base.ref,
+        base_sha=None,
+        commit=None,
+        files=None,
+        folders=None,
+        statuses=[],
+        comments=[],
+        comments_cursor=None,
+        labels=[Label(label.name, label.color) for label in issue.labels],
+    )
+    if pr.state != "open":
+        return snapshot
+
+    last_commit = pr.get_commits().reversed[0]
+    git_commit = last_commit.commit
+    files, folders = None, None
+    if (pr.head.sha, pr.base.ref) != known:
+        with tracing.span("files"):
+            # processed as the pages arrive
+            files, folders = [], set()
+            for f in pr.get_files():
+                files.append(f.filename)
+                add_folders(folders, [f.filename])
+    with tracing.span("statuses"):
+        statuses = [
+            Status(s.context, s.state, s.description or "", s.target_url, s.updated_at)
+            for s in last_commit.get_statuses()
+        ]
+    with tracing.span("comments"):
+        comments = [
+            Comment(c.id, c.user.login, c.created_at, c.body, None)
+            for c in (
+                issue.get_comments() if since is None else issue.get_comments(since)
+            )
+        ]
+    return snapshot._replace(
+        base_sha=repo.get_branch(branch=pr.base.ref).commit.sha,
+        commit=(
+            Commit(
+                sha=git_commit.sha,
+                message=git_commit.message,
+                committer_name=git_commit.committer.name,
+                committed_date=git_commit.committer.date,
+            )
+            if git_commit is not None
+            else None
+        ),
+        files=files,
+        folders=folders,
+        statuses=statuses,
+        comments=comments,
+    )
+
+
+def get_pr_snapshot(repo, issue, cursor=None, known=None):
+    # Fetch the PR, its files, latest commit & statuses, comments and labels.
+    # One GraphQL query (plus one per extra 100 files or comments) does the
+    # work of dozens of REST calls; REST is used if GraphQL fails.
+    # Given a comment cursor (see comment_cursor.py), only comments made
+    # after the last one processed are returned. Given the (head sha, base
+    # branch) the files were last fetched at, they are only fetched again if
+    # either has changed - otherwise files and folders are None.
+    snapshot = None
+    try:
+        snapshot = _snapshot_from_graphql(
+            repo, issue.number, cursor["cursor"] if cursor else None, known
+        )
+    except Exception:
+        log.exception("GraphQL PR snapshot failed - falling back to the REST API")
+    if snapshot is None:
+        snapshot = _snapshot_from_rest(
+            repo, issue, cursor["last_comment_time"] if cursor else None, known
+        )
+        if cursor:
+            snapshot = snapshot._replace(comments_cursor=cursor["cursor"])
+
+    if cursor:
+        # 'since' and a stale GraphQL cursor can both return comments again
+        snapshot = snapshot._replace(
+            comments=[c for c in snapshot.comments if c.id > cursor["last_comment_id"]]
+        )
+    return snapshot
@@ -1,19 +1,27 @@
-import re
+import logging
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from socket import setdefaulttimeout
 
 from Mu2eCI import config
+from Mu2eCI import build_queue
 from Mu2eCI import test_suites
-from Mu2eCI.logger import log
+from Mu2eCI import membership_cache
+from Mu2eCI import comment_cursor
+from Mu2eCI import state_store
+from Mu2eCI import tracing
+from Mu2eCI.logger import get_logger
 from Mu2eCI.common import (
     api_rate_limits,
-    post_on_pr,
-    get_modified,
     get_authorised_users,
     check_test_cmd_mu2e,
-    create_properties_file_for_test,
     get_build_queue_size,
 )
+from Mu2eCI.actions import LAST_BUILD_CONTEXT, Plan, React, TriggerTest, apply_plan
+from Mu2eCI.pr_snapshot import get_pr_snapshot
+from Mu2eCI.watchers import get_watcher_index
 from Mu2eCI.messages import (
     PR_SALUTATION,
     PR_AUTHOR_NONMEMBER,
@@ -23,21 +31,85 @@ from Mu2eCI.messages import (
     BASE_BRANCH_HEAD_CHANGED,
 )
 
+log = get_logger(__name__)
+
 setdefaulttimeout(300)
 
 
-def process_pr(gh, repo, issue, dryRun=False, child_call=0):
+# one lock per PR (repository, number), so that a PR is never processed by
+# two threads of this process at once. A lock is dropped once no thread is
+# using or waiting for it, so that the webhook server does not keep one for
+# every PR it has seen.
+_pr_locks = weakref.WeakValueDictionary()
+_pr_locks_lock = threading.Lock()
+
+
+def _pr_lock(repository, number):
+    with _pr_locks_lock:
+        lock = _pr_locks.get((repository, number))
+        if lock is None:
+            lock = _pr_locks[(repository, number)] = threading.RLock()
+        return lock
+
+
+def recheck_open_prs(gh, repo, base_ref, dryRun=False, child_call=0, queue=None):
+    # Run process_pr on every open PR into base_ref, a few at a time.
+    # Every request made by the workers is paced by the shared rate limiter
+    # (see Mu2eCI.transport), and a failure on one PR does not stop the others.
+    # Given queue (e.g. the webhook server's Dispatcher.submit), the PRs are
+    # handed to it as (repository, number) instead.
+    pulls_to_check = repo.get_pulls(state="open", base=base_ref)
+    if queue is not None:
+        for pr_ in pulls_to_check:
+            queue(repo.full_name, pr_.number)
+        return
+
+    workers = config.main["merged_pr_recheck"]["workers"]
+
+    def recheck(pr_):
+        try:
+            process_pr(gh, repo, pr_.as_issue(), dryRun, child_call=child_call)
+        except Exception:
+            log.exception("Failed to re-check PR #%s", pr_.number)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for pr_ in pulls_to_check:
+            executor.submit(tracing.wrap(recheck), pr_)
+
+
+def process_pr(gh, repo, issue, dryRun=False, child_call=0, queue=None):
+    # each run is traced (see Mu2eCI.tracing), nested runs as a phase.
+    # queue: see recheck_open_prs
+    with _pr_lock(repo.full_name, issue.number), tracing.span(
+        "process_pr", "%s#%s" % (repo.full_name, issue.number)
+    ):
+        _process_pr(gh, repo, issue, dryRun, child_call, queue)
+
+
+def _process_pr(gh, repo, issue, dryRun=False, child_call=0, queue=None):
     if child_call > 2:
         log.warning("Stopping recursion")
         return
-    api_rate_limits(gh)
+    if child_call == 0:
+        api_rate_limits(gh)
 
     if not issue.pull_request:
         log.warning("Ignoring: Not a PR")
         return
 
     prId = issue.number
-    pr = repo.get_pull(prId)
+    # where we got to in the PR comments last time
+    cursor = comment_cursor.load(repo.full_name, prId)
+    # what the PR changed as of the last run, if it can still be used
+    config_version = config.version("main", "watchers", "test_rules")
+    changes = state_store.get_changes(repo.full_name, prId, config_version)
+    with tracing.span("snapshot"):
+        pr = get_pr_snapshot(
+            repo,
+            issue,
+            cursor,
+            known=(changes.head_sha, changes.base_ref) if changes else None,
+        )
 
     if pr.changed_files == 0:
         log.warning("Ignoring: PR with no files changed")
@@ -59,26 +131,33 @@ def process_pr(gh, repo, issue, dryRun=False, child_call=0):
                 "Triggering check on all other open PRs as "
                 "this PR was merged within the last 2 minutes."
             )
-            pulls_to_check = repo.get_pulls(state="open", base=pr.base.ref)
-            for pr_ in pulls_to_check:
-                process_pr(
+            with tracing.span("recheck"):
+                recheck_open_prs(
                     gh,
                     repo,
-                    pr_.as_issue(),
+                    pr.base_ref,
                     dryRun,
                     child_call=child_call + 1,
+                    queue=queue,
                 )
 
     if pr.state == "closed":
         log.info("Ignoring: PR in closed state")
+        if not dryRun:
+            state_store.forget(repo.full_name, prId)
         return
 
-    mu2eorg = gh.get_organization("Mu2e")
-    trusted_user = mu2eorg.has_in_members(issue.user)
+    # sample the build queue in the background, for the message sent if
+    # tests are triggered
+    build_queue.get_sampler().prefetch()
 
-    authorised_users, authed_teams = get_authorised_users(
-        mu2eorg, repo, branch=pr.base.ref
-    )
+    with tracing.span("membership"):
+        mu2eorg = gh.get_organization("Mu2e")
+        trusted_user = membership_cache.is_org_member(mu2eorg, issue.user)
+
+        authorised_users, authed_teams = get_authorised_users(
+            mu2eorg, repo, branch=pr.base_ref
+        )
 
     # allow the PR author to execute CI actions:
     if trusted_user:
@@ -88,6 +167,9 @@ def process_pr(gh, repo, issue, dryRun=False, child_call=0):
 
     not_seen_yet = True
     last_time_seen = None
+    if cursor is not None:
+        last_time_seen = cursor["last_bot_comment_time"]
+        not_seen_yet = last_time_seen is None
     labels = set()
 
     # commit test states:
@@ -102,53 +184,52 @@ def process_pr(gh, repo, issue, dryRun=False, child_call=0):
     # tests we've already triggered
     tests_already_triggered = []
 
-    # get PR changed libraries / packages
-    pr_files = pr.get_files()
-
-    # top-level folders of the Offline 'monorepo'
-    # that have been edited by this PR
-    modified_top_level_folders = get_modified(pr_files)
-    log.debug("Build Targets changed:")
-    log.debug("\n".join(["- %s" % s for s in modified_top_level_folders]))
-
-    watchers = config.watchers
-
-    # Figure out who is watching the modified packages and notify them
-    log.debug(f"watchers: {', '.join(watchers) if watchers else ''}")
-    watcher_text = ""
-    watcher_list = []
-    try:
-        modified_targs = [x.lower() for x in modified_top_level_folders]
-        for user, packages in watchers.items():
-            for pkgpatt in packages:
-                try:
-                    regex_comp = re.compile(pkgpatt, re.I)
-                    for target in modified_targs:
-                        if (target == "/" and pkgpatt == "/") or regex_comp.match(
-                            target.strip()
-                        ):
-                            watcher_list.append(user)
-                            break
-                except Exception:
-                    log.warning(
-                        "ERROR: Possibly bad regex for watching user %s: %s"
-                        % (user, pkgpatt)
-                    )
-
-        watcher_list = set(watcher_list)
-        if len(watcher_list) > 0:
-            watcher_text = (
-                "The following users requested to be notified about "
-                "changes to these packages:\n"
+    if pr.folders is None:
+        # the head commit and base branch are the same as last time
+        log.info("Files unchanged since %s", changes.head_sha)
+        modified_top_level_folders = set(changes.folders)
+        test_requirements = changes.tests
+        watcher_list = set(changes.watchers)
+    else:
+        # top-level folders of the Offline 'monorepo'
+        # that have been edited by this PR
+        modified_top_level_folders = pr.folders
+        # get required tests (see config/test_rules.yaml)
+        test_requirements = test_suites.get_tests_for(pr.files)
+        # Figure out who is watching the modified packages and notify them
+        watcher_list = None
+        try:
+            watcher_list = get_watcher_index().match(modified_top_level_folders)
+        except Exception:
+            log.exception(
+                "There was a problem while trying to build the watcher list..."
             )
-            watcher_text += ", ".join(["@%s" % x for x in watcher_list])
-    except Exception:
-        log.exception("There was a problem while trying to build the watcher list...")
-
-    # get required tests
-    test_requirements = test_suites.get_tests_for(modified_top_level_folders)
+        if watcher_list is not None and pr.commit is not None:
+            state_store.save_changes(
+                repo.full_name,
+                prId,
+                config_version,
+                state_store.Changes(
+                    pr.commit.sha,
+                    pr.base_ref,
+                    modified_top_level_folders,
+                    test_requirements,
+                    watcher_list,
+                ),
+            )
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("Build Targets changed:")
+        log.debug("\n".join(["- %s" % s for s in modified_top_level_folders]))
     log.info("Tests required: %s", ", ".join(test_requirements))
 
+    watcher_text = ""
+    if watcher_list:
+        watcher_text = (
+            "The following users requested to be notified about "
+            "changes to these packages:\n"
+        )
+        watcher_text += ", ".join(["@%s" % x for x in sorted(watcher_list)])
+
     # set their status to 'pending' (will be updated shortly after)
     for test in test_requirements:
         test_statuses[test] = "pending"
@@ -157,26 +238,26 @@ def process_pr(gh, repo, issue, dryRun=False, child_call=0):
 
     # this will be the commit of master that the PR is merged
     # into for the CI tests (for a build test this is just the current HEAD.)
-    master_commit_sha = repo.get_branch(
-        branch=pr.base.ref
-    ).commit.sha  # repo.get_branch("master").commit.sha
+    master_commit_sha = pr.base_sha
+    if master_commit_sha is None:
+        log.warning("Ignoring: base branch %s not found", pr.base_ref)
+        return
 
     # get latest commit
-    last_commit = pr.get_commits().reversed[0]
-    git_commit = last_commit.commit
+    git_commit = pr.commit
     if git_commit is None:
         return
 
-    last_commit_date = git_commit.committer.date
+    last_commit_date = git_commit.committed_date
     log.debug(
         "Latest commit by %s at %r",
-        git_commit.committer.name,
+        git_commit.committer_name,
         last_commit_date,
     )
 
     log.info("Latest commit message: %s", git_commit.message.encode("ascii", "ignore"))
     log.info("Latest commit sha: %s", git_commit.sha)
-    log.info("Merging into: %s %s", pr.base.ref, master_commit_sha)
+    log.info("Merging into: %s %s", pr.base_ref, master_commit_sha)
     log.info("PR update time %s", pr.updated_at)
     log.info("Time UTC: %s", datetime.utcnow())
 
@@ -192,7 +273,7 @@ def process_pr(gh, repo, issue, dryRun=False, child_call=0):
     # now get commit statuses
     # this is how we figure out the current state of tests
     # on the latest commit of the PR.
-    commit_status = last_commit.get_statuses()
+    commit_status = pr.statuses
 
     # we can translate git commit status API 'state' strings if needed.
     state_labels = config.main["labels"]["states"]
@@ -208,7 +289,7 @@ def process_pr(gh, repo, issue, dryRun=False, child_call=0):
 
     for stat in commit_status:
         name = test_suites.get_test_name(stat.context)
-        log.debug(f"Processing commit status: {stat.context}")
+        log.debug("Processing commit status: %s", stat.context)
         if "buildtest/last" in stat.context:
             log.debug("Check if this is when we last triggered the test.")
             name = "buildtest/last"
@@ -222,21 +303,6 @@ def process_pr(gh, repo, issue, dryRun=False, child_call=0):
             master_commit_sha_last_test = stat.description.replace(
                 "Last test triggered against ", ""
             )
-
-            log.info(
-                "Last build test was run at base sha: %r, current HEAD is %r"
-                % (master_commit_sha_last_test, master_commit_sha)
-            )
-
-            if not master_commit_sha.strip().startswith(
-                master_commit_sha_last_test.strip()
-            ):
-                log.info(
-                    "HEAD of base branch is now different to last tested base branch commit"
-                )
-                base_branch_HEAD_changed = True
-            else:
-                log.info("HEAD of base branch is a match.")
             continue
         if name == "unrecognised":
             continue
@@ -271,6 +337,44 @@ def process_pr(gh, repo, issue, dryRun=False, child_call=0):
         if "stalled" in stat.description:
             test_statuses[name] = "stalled"
 
+    # Tests the bot triggered on this commit, from the state store. GitHub
+    # may not show their statuses yet (or at all, if setting one failed);
+    # any status set since they were triggered is newer, and wins.
+    for name, trigger in state_store.get_triggers(
+        repo.full_name, prId, git_commit.sha
+    ).items():
+        if name == "build" and (
+            "buildtest/last" not in commit_status_time
+            or trigger.triggered_at >= commit_status_time["buildtest/last"]
+        ):
+            master_commit_sha_last_test = trigger.base_sha
+        if (
+            name in commit_status_time
+            and trigger.triggered_at < commit_status_time[name]
+        ):
+            continue
+        log.debug("Test %s was triggered at %s", name, trigger.triggered_at)
+        commit_status_time[name] = trigger.triggered_at
+        test_statuses[name] = "pending"
+        test_triggered[name] = True
+        test_status_exists.setdefault(name, False)
+        legit_tests.add(name)
+
+    if master_commit_sha_last_test is not None:
+        log.info(
+            "Last build test was run at base sha: %r, current HEAD is %r"
+            % (master_commit_sha_last_test, master_commit_sha)
+        )
+        if not master_commit_sha.strip().startswith(
+            master_commit_sha_last_test.strip()
+        ):
+            log.info(
+                "HEAD of base branch is now different to last tested base branch commit"
+            )
+            base_branch_HEAD_changed = True
+        else:
+            log.info("HEAD of base branch is a match.")
+
     if (
         (master_commit_sha_last_test is None or base_branch_HEAD_changed)
         and "build" in test_statuses
@@ -307,7 +411,7 @@ def process_pr(gh, repo, issue, dryRun=False, child_call=0):
                 datetime.utcnow() - commit_status_time[name]
             ).total_seconds()
             log.info("  Has been running for %d seconds", test_runtime)
-            if test_runtime > test_suites.get_stall_time(name):
+            if test_suites.has_stalled(name, commit_status_time[name]):
                 log.info("  The test has stalled.")
                 test_triggered[name] = False  # the test may be triggered again.
                 test_statuses[name] = "stalled"
@@ -336,30 +440,36 @@ def process_pr(gh, repo, issue, dryRun=False, child_call=0):
             )
 
     # now process PR comments that come after when
-    # the bot last did something, first figuring out when the bot last commented
+    # the bot last did something, first figuring out when the bot last commented.
+    # These are only the comments made since the last run.
     pr_author = issue.user.login
-    comments = issue.get_comments()
+    comments = pr.comments
     for comment in comments:
         # loop through once to ascertain when the bot last commented
-        if comment.user.login == config.main["bot"]["username"]:
+        if comment.author == config.main["bot"]["username"]:
             if last_time_seen is None or last_time_seen < comment.created_at:
                 not_seen_yet = False
                 last_time_seen = comment.created_at
                 log.debug(
-                    "Bot user comment found: %s, %s",
-                    comment.user.login,
-                    str(last_time_seen),
+                    "Bot user comment found: %s, %s", comment.author, last_time_seen
                 )
     log.info("Last time seen %s", str(last_time_seen))
 
-    bot_comments = (
-        []
-    )  # keep a track of our comments to avoid duplicate messages and spam.
+    # keep a track of our comments to avoid duplicate messages and spam.
+    bot_comments = set(cursor["bot_comments"]) if cursor is not None else set()
+    # ... and of the comments we have already reacted to
+    acknowledged = state_store.get_reactions(repo.full_name, prId)
+    # ... and of the reactions that could not be made by earlier runs (the
+    # comments they are for are not fetched again)
+    pending_reactions = state_store.get_pending_reactions(repo.full_name, prId)
+
+    # everything we decide to do to the PR is collected here, and done at the end
+    plan = Plan(repo, issue, pr, bot_comments)
 
     # now we process comments
     for comment in comments:
-        if comment.user.login == config.main["bot"]["username"]:
-            bot_comments += [comment.body.strip()]
+        if comment.author == config.main["bot"]["username"]:
+            bot_comments.add(comment_cursor.body_hash(comment.body.strip()))
 
         # Ignore all messages which are before last commit.
         if comment.created_at < last_commit_date:
@@ -370,28 +480,25 @@ def process_pr(gh, repo, issue, dryRun=False, child_call=0):
         if last_time_seen is not None and (comment.created_at < last_time_seen):
             log.debug(
                 "IGNORE COMMENT (seen) %s %s < %s",
-                comment.user.login,
-                str(comment.created_at),
-                str(last_time_seen),
+                comment.author,
+                comment.created_at,
+                last_time_seen,
             )
             continue
 
         # neglect comments by un-authorised users
         if (
-            comment.user.login not in authorised_users
-            or comment.user.login == config.main["bot"]["username"]
+            comment.author not in authorised_users
+            or comment.author == config.main["bot"]["username"]
         ):
-            log.debug(
-                "IGNORE COMMENT (unauthorised, or bot user) - %s", comment.user.login
-            )
+            log.debug("IGNORE COMMENT (unauthorised, or bot user) - %s", comment.author)
             continue
 
-        for react in comment.get_reactions():
-            if react.user.login == config.main["bot"]["username"]:
-                log.debug(
-                    "IGNORE COMMENT (we've seen it and reacted to say we've seen it) - %s",
-                    comment.user.login,
-                )
+        if comment.bot_reacted:
+            log.debug(
+                "IGNORE COMMENT (we've seen it and reacted to say we've seen it) - %s",
+                comment.author,
+            )
 
         reaction_t = None
         trigger_search, mentioned = None, None
@@ -414,7 +521,7 @@ def process_pr(gh, repo, issue, dryRun=False, child_call=0):
             tests, _, extra_env = trigger_search
             log.info("Test trigger found!")
             log.debug("Comment: %r", comment.body)
-            log.debug("Environment: %s", str(extra_env))
+            log.debug("Environment: %s", extra_env)
             log.info("Current test(s): %r" % tests_to_trigger)
             log.info("Adding these test(s): %r" % tests)
 
@@ -455,14 +562,20 @@ def process_pr(gh, repo, issue, dryRun=False, child_call=0):
             # we didn't recognise any commands!
             reaction_t = "confused"
 
-        if reaction_t is not None:
+        if reaction_t is not None and comment.id not in acknowledged:
             # "React" to the comment to let the user know we have acknowledged their comment!
-            comment.create_reaction(reaction_t)
+            plan.react(comment.id, reaction_t)
+            pending_reactions.pop(comment.id, None)
+
+    # try again to make the reactions that failed last time
+    for comment_id, reaction_t in sorted(pending_reactions.items()):
+        if comment_id not in acknowledged:
+            plan.react(comment_id, reaction_t)
 
     # trigger the 'default' tests if this is the first time we've seen this PR:
     # (but, only if they are in the Mu2e org)
     if trusted_user:
-        if not_seen_yet and not dryRun and test_suites.AUTO_TRIGGER_ON_OPEN:
+        if not_seen_yet and test_suites.AUTO_TRIGGER_ON_OPEN:
             for test in test_requirements:
                 test_statuses[test] = "pending"
                 test_triggered[test] = True
@@ -484,33 +597,27 @@ def process_pr(gh, repo, issue, dryRun=False, child_call=0):
         if test in triggered_tests:
             log.info("Test will now be triggered! %s", test)
             # trigger the test in jenkins
-            create_properties_file_for_test(
-                test,
-                repo.full_name,
-                prId,
-                git_commit.sha,
-                master_commit_sha,
-                extra_envs[triggered_tests.index(test)],
+            plan.trigger(
+                test, master_commit_sha, extra_envs[triggered_tests.index(test)]
             )
-            if not dryRun:
-                if test == "build":
-                    # we need to store somewhere the master commit SHA
-                    # that we merge into for the build test (for validation)
-                    # this is overlapped with the next, more human readable message
-                    last_commit.create_status(
-                        state="success",
-                        target_url="https://github.com/mu2e/%s" % repo.name,
-                        description="Last test triggered against %s"
-                        % master_commit_sha[:8],
-                        context="mu2e/buildtest/last",
-                    )
-
-                last_commit.create_status(
-                    state="pending",
+            if test == "build":
+                # we need to store somewhere the master commit SHA
+                # that we merge into for the build test (for validation)
+                # this is overlapped with the next, more human readable message
+                plan.set_status(
+                    state="success",
                     target_url="https://github.com/mu2e/%s" % repo.name,
-                    description="The test has been triggered in Jenkins",
-                    context=test_suites.get_test_alias(test),
+                    description="Last test triggered against %s"
+                    % master_commit_sha[:8],
+                    context=LAST_BUILD_CONTEXT,
                 )
+
+            plan.set_status(
+                state="pending",
+                target_url="https://github.com/mu2e/%s" % repo.name,
+                description="The test has been triggered in Jenkins",
+                context=test_suites.get_test_alias(test),
+            )
             log.info(
                 "Git status created for SHA %s test %s - since the test has been triggered.",
                 git_commit.sha,
@@ -524,7 +631,7 @@ def process_pr(gh, repo, issue, dryRun=False, child_call=0):
             )
         elif state == "stalled" and not test_status_exists[test]:
             log.info("Git status was pending, but the job has stalled.")
-            last_commit.create_status(
+            plan.set_status(
                 state="error",
                 target_url="https://github.com/mu2e/%s" % repo.name,
                 description="The job has stalled on Jenkins. It can be re-triggered.",
@@ -545,34 +652,26 @@ def process_pr(gh, repo, issue, dryRun=False, child_call=0):
             labels.add(f"{test} {state}")
             # indicate that the test is pending but
             # we're still waiting for someone to trigger the test
-            if not dryRun:
-                last_commit.create_status(
-                    state="pending",
-                    target_url="https://github.com/mu2e/%s" % repo.name,
-                    description="This test has not been triggered yet.",
-                    context=test_suites.get_test_alias(test),
-                )
+            plan.set_status(
+                state="pending",
+                target_url="https://github.com/mu2e/%s" % repo.name,
+                description="This test has not been triggered yet.",
+                context=test_suites.get_test_alias(test),
+            )
         # don't do anything else with commit statuses
         # the script handler that handles Jenkins job results will update the commits accordingly
 
-    # check if labels have changed
-    labelnames = {x.name for x in issue.labels if "unrecognised" not in x.name}
-    if labelnames != labels:
-        if not dryRun:
-            issue.edit(labels=list(labels))
-        log.debug("Labels have changed to: %s", ", ".join(labels))
+    # labels are only changed if they differ from the current ones
+    plan.set_labels(labels)
 
     # check label colours
-    try:
-        for label in issue.labels:
-            if label.color == "ededed":
-                # the label color isn't set
-                for labelcontent, col in state_labels_colors.items():
-                    if labelcontent in label.name:
-                        label.edit(label.name, col)
-                        break
-    except Exception:
-        log.exception("Failed to set label colours!")
+    for label in pr.labels:
+        if label.color == "ededed":
+            # the label color isn't set
+            for labelcontent, col in state_labels_colors.items():
+                if labelcontent in label.name:
+                    plan.set_label_color(label.name, col)
+                    break
 
     # construct a reply if tests have been triggered.
     tests_triggered_msg = ""
@@ -595,62 +694,96 @@ def process_pr(gh, repo, issue, dryRun=False, child_call=0):
     # decide if we should issue a comment, and what comment to issue
     if not_seen_yet:
         log.info("First time seeing this PR - send the user a salutation!")
-        if not dryRun:
-            post_on_pr(
-                issue,
-                PR_SALUTATION.format(
-                    pr_author=pr_author,
-                    changed_folders="\n".join(
-                        ["- %s" % s for s in modified_top_level_folders]
-                    ),
-                    tests_required=", ".join(test_requirements),
-                    watchers=watcher_text,
-                    auth_teams=", ".join(["@Mu2e/%s" % team for team in authed_teams]),
-                    tests_triggered_msg=tests_triggered_msg,
-                    non_member_msg="" if trusted_user else PR_AUTHOR_NONMEMBER,
-                    base_branch=pr.base.ref,
+        plan.comment(
+            PR_SALUTATION.format(
+                pr_author=pr_author,
+                changed_folders="\n".join(
+                    ["- %s" % s for s in modified_top_level_folders]
                 ),
-                bot_comments,
+                tests_required=", ".join(test_requirements) or "none",
+                watchers=watcher_text,
+                auth_teams=", ".join(["@Mu2e/%s" % team for team in authed_teams]),
+                tests_triggered_msg=tests_triggered_msg,
+                non_member_msg="" if trusted_user else PR_AUTHOR_NONMEMBER,
+                base_branch=pr.base_ref,
             )
+        )
 
     elif len(tests_to_trigger) > 0:
         # tests were triggered, let people know about it
-        if not dryRun:
-            post_on_pr(issue, tests_triggered_msg, bot_comments)
+        plan.comment(tests_triggered_msg, announces=triggered_tests)
 
     elif len(tests_to_trigger) == 0 and len(tests_already_triggered) > 0:
-        if not dryRun:
-            post_on_pr(
-                issue,
-                TESTS_ALREADY_TRIGGERED.format(
-                    commit_link=commitlink,
-                    triggered_tests=", ".join(tests_already_triggered),
-                ),
-                bot_comments,
+        plan.comment(
+            TESTS_ALREADY_TRIGGERED.format(
+                commit_link=commitlink,
+                triggered_tests=", ".join(tests_already_triggered),
             )
+        )
 
-    if jobs_have_stalled and not dryRun:
-        post_on_pr(
-            issue,
+    if jobs_have_stalled:
+        plan.comment(
             JOB_STALL_MESSAGE.format(
                 joblist=", ".join(stalled_jobs), info=stalled_job_info
-            ),
-            bot_comments,
+            )
         )
-    if base_branch_HEAD_changed and not dryRun and not len(tests_to_trigger) > 0:
-        post_on_pr(
-            issue,
+    if base_branch_HEAD_changed and not len(tests_to_trigger) > 0:
+        plan.comment(
             BASE_BRANCH_HEAD_CHANGED.format(
-                base_ref=pr.base.ref, base_sha=master_commit_sha
-            ),
-            bot_comments,
+                base_ref=pr.base_ref, base_sha=master_commit_sha
+            )
         )
     if "build" in test_status_exists:
-        if future_commit and not test_status_exists["build"] and not dryRun:
-            post_on_pr(
-                issue,
-                f":memo: The latest commit by @{git_commit.committer.name} is "
+        if future_commit and not test_status_exists["build"]:
+            plan.comment(
+                f":memo: The latest commit by @{git_commit.committer_name} is "
                 f"timestamped {future_commit_timedelta_string} in the future. "
-                "Please check that the date and time is set correctly when creating new commits.",
-                bot_comments,
+                "Please check that the date and time is set correctly when creating new commits."
             )
+
+    # a dry run only logs the plan
+    planned_at = datetime.utcnow()
+    actions = apply_plan(plan, dryRun)
+
+    if not dryRun:
+        # remember what was done (and not what failed), for the next run on
+        # this PR
+        state_store.record_triggers(
+            repo.full_name,
+            prId,
+            git_commit.sha,
+            [(a.test, a.base_sha) for a in actions if isinstance(a, TriggerTest)],
+            planned_at,
+        )
+        reacted = {a.comment_id for a in actions if isinstance(a, React)}
+        state_store.record_reactions(repo.full_name, prId, sorted(reacted))
+        state_store.record_pending_reactions(
+            repo.full_name,
+            prId,
+            {
+                a.comment_id: a.content
+                for a in plan.actions
+                if isinstance(a, React) and a.comment_id not in reacted
+            },
+        )
+
+        # remember where we got to, so the next run only fetches new comments
+        last_comment_id, last_comment_time = 0, None
+        if cursor is not None:
+            last_comment_id = cursor["last_comment_id"]
+            last_comment_time = cursor["last_comment_time"]
+        if comments:
+            last_comment = max(comments, key=lambda c: c.id)
+            last_comment_id = last_comment.id
+            last_comment_time = last_comment.created_at
+        comment_cursor.save(
+            repo.full_name,
+            prId,
+            {
+                "cursor": pr.comments_cursor,
+                "last_comment_id": last_comment_id,
+                "last_comment_time": last_comment_time,
+                "last_bot_comment_time": last_time_seen,
+                "bot_comments": sorted(bot_comments),
+            },
+        )
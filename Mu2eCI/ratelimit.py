@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import fcntl
+import threading
+
+from Mu2eCI.logger import get_logger
+
+log = get_logger(__name__)
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every process using the same state file, filled
+    from the X-RateLimit-* headers of ordinary API responses.
+
+    The bucket refills at the rate that would spend the remaining budget
+    (less a reserve) evenly until the limit resets, and holds at most
+    'burst' tokens. Each request takes a token; when the bucket is empty,
+    the request waits just long enough for its token to arrive, so requests
+    are spread out instead of stalling for the whole reset window.
+
+    State file contents, per rate limit resource ("core", "graphql"):
+        {"limit": int, "remaining": int, "reset": unix time,
+         "tokens": float, "updated": unix time}
+    """
+
+    def __init__(self, path, burst, reserve):
+        self.path = path
+        self.burst = burst
+        self.reserve = reserve
+        self._lock = threading.Lock()
+
+    def _transaction(self, update):
+        # apply update(state) to the shared state under an exclusive lock
+        with self._lock, open(self.path + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with open(self.path, "r") as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                state = {}
+            result = update(state)
+            tmp_name = "%s.%d" % (self.path, os.getpid())
+            with open(tmp_name, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_name, self.path)
+        return result
+
+    def _refill_rate(self, budget, now):
+        return max(budget["remaining"] - self.reserve, 0) / max(
+            budget["reset"] - now, 1
+        )
+
+    def acquire(self, resource="core"):
+        # Take a token for one request, waiting for it if needed.
+        def take(state):
+            budget = state.get(resource)
+            now = time.time()
+            if budget is None or now >= budget["reset"]:
+                # nothing known about the current window yet
+                return 0
+            rate = self._refill_rate(budget, now)
+            budget["tokens"] = min(
+                budget["tokens"] + rate * (now - budget["updated"]), self.burst
+            )
+            budget["updated"] = now
+            budget["tokens"] -= 1
+            budget["remaining"] -= 1
+            if budget["tokens"] >= 0:
+                return 0
+            if rate == 0:
+                return budget["reset"] - now
+            return -budget["tokens"] / rate
+
+        wait = self._transaction(take)
+        if wait > 0:
+            (log.warning if wait > 1 else log.debug)(
+                "Slowing down for %.1f sec to spread out the remaining %s API rate limit",
+                wait,
+                resource,
+            )
+            time.sleep(wait)
+
+    def update(self, headers):
+        # Record the rate limit reported in a response's headers.
+        if "x-ratelimit-remaining" not in headers or "x-ratelimit-reset" not in headers:
+            return
+        resource = headers.get("x-ratelimit-resource", "core")
+        remaining = int(headers["x-ratelimit-remaining"])
+        limit = int(headers.get("x-ratelimit-limit", remaining))
+        reset = int(headers["x-ratelimit-reset"])
+
+        def record(state):
+            budget = state.get(resource)
+            now = time.time()
+            if budget is None or reset > budget["reset"]:
+                # a new window
+                state[resource] = {
+                    "limit": limit,
+                    "remaining": remaining,
+                    "reset": reset,
+                    "tokens": self.burst,
+                    "updated": now,
+                }
+            elif reset == budget["reset"]:
+                # trust the server over our own count of requests made, as
+                # conditional requests answered with 304 are free
+                budget["remaining"] = remaining
+
+        self._transaction(record)
+
+    def get_budget(self, resource="core"):
+        # (remaining, limit, reset time) for the current window, or None
+        try:
+            with open(self.path, "r") as f:
+                budget = json.load(f).get(resource)
+        except (OSError, ValueError):
+            return None
+        if budget is None or time.time() >= budget["reset"]:
+            return None
+        return budget["remaining"], budget["limit"], budget["reset"]
@@ -0,0 +1,157 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from Mu2eCI import config
+from Mu2eCI import test_suites
+from Mu2eCI import tracing
+from Mu2eCI.logger import get_logger
+from Mu2eCI.pr_snapshot import (
+    PAGE_SIZE,
+    Status,
+    graphql,
+    statuses_from_graphql,
+)
+from Mu2eCI.process_pr import process_pr
+
+log = get_logger(__name__)
+
+OPEN_PRS_QUERY = """
+query ($owner: String!, $name: String!, $cursor: String) {
+  rateLimit { cost }
+  repository(owner: $owner, name: $name) {
+    pullRequests(states: OPEN, first: %(page_size)d, after: $cursor) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        number
+        commits(last: 1) {
+          nodes {
+            commit {
+              status {
+                contexts { context state description targetUrl createdAt }
+              }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+""" % {
+    "page_size": PAGE_SIZE
+}
+
+
+def stalled_tests(statuses, now=None):
+    # The tests whose latest status says they were triggered (or are
+    # running) but which have not reported back within their stall time.
+    # This only decides which PRs are worth a closer look - process_pr
+    # makes the final decision when it is run on them.
+    latest = {}
+    for stat in statuses:
+        name = test_suites.get_test_name(stat.context)
+        if name == "unrecognised":
+            continue
+        if name in latest and latest[name].updated_at > stat.updated_at:
+            continue
+        latest[name] = stat
+
+    stalled = []
+    for name, stat in latest.items():
+        if stat.state != "pending":
+            continue
+        if not (
+            "has been triggered" in stat.description or "running" in stat.description
+        ):
+            continue
+        if test_suites.has_stalled(name, stat.updated_at, now):
+            stalled.append(name)
+    return sorted(stalled)
+
+
+def _open_pr_statuses_graphql(repo):
+    # (PR number, statuses of its latest commit) for every open PR, 100 PRs
+    # per request
+    owner, name = repo.full_name.split("/")
+    variables = {"owner": owner, "name": name, "cursor": None}
+    while True:
+        pulls = graphql(repo, OPEN_PRS_QUERY, variables)["repository"]["pullRequests"]
+        for node in pulls["nodes"]:
+            commits = node["commits"]["nodes"]
+            statuses = statuses_from_graphql(
+                commits[0]["commit"]["status"] if commits else None
+            )
+            yield node["number"], statuses
+        if not pulls["pageInfo"]["hasNextPage"]:
+            break
+        variables["cursor"] = pulls["pageInfo"]["endCursor"]
+
+
+def _open_pr_statuses_rest(repo):
+    for pr in repo.get_pulls(state="open"):
+        combined = repo.get_commit(pr.head.sha).get_combined_status()
+        yield pr.number, [
+            Status(
+                context=stat.context,
+                state=stat.state,
+                description=stat.description or "",
+                target_url=stat.target_url,
+                updated_at=stat.updated_at,
+            )
+            for stat in combined.statuses
+        ]
+
+
+def find_stalled_prs(repo, now=None):
+    # {PR number: [stalled tests]} for the open PRs of repo
+    if now is None:
+        now = datetime.utcnow()
+    try:
+        open_prs = list(_open_pr_statuses_graphql(repo))
+    except Exception:
+        log.exception(
+            "Could not list open PRs of %s via GraphQL, using the REST API instead",
+            repo.full_name,
+        )
+        open_prs = list(_open_pr_statuses_rest(repo))
+
+    stalled = {}
+    for number, statuses in open_prs:
+        tests = stalled_tests(statuses, now)
+        if tests:
+            stalled[number] = tests
+    log.info(
+        "%s: %d open PRs, %d with stalled tests",
+        repo.full_name,
+        len(open_prs),
+        len(stalled),
+    )
+    return stalled
+
+
+def sweep(gh, repositories, dryRun=False):
+    # Find the open PRs with stalled tests in each repository, and run
+    # process_pr on only those, which marks the tests as stalled and lets
+    # people know. Returns {repository: {PR number: [stalled tests]}}.
+    workers = config.main["stall_sweep"]["workers"]
+    found = {}
+    for repository in repositories:
+        with tracing.span("stall_sweep", repository):
+            repo = gh.get_repo(repository)
+            stalled = find_stalled_prs(repo)
+        found[repository] = stalled
+
+        def process(number):
+            log.info(
+                "%s#%s has stalled tests: %s",
+                repository,
+                number,
+                ", ".join(stalled[number]),
+            )
+            try:
+                process_pr(gh, repo, repo.get_issue(number), dryRun)
+            except Exception:
+                log.exception("Failed to process %s#%s", repository, number)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(process, sorted(stalled)))
+    return found
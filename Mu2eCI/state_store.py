@@ -0,0 +1,342 @@
+import json
+import sqlite3
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+from Mu2eCI import config
+from Mu2eCI.logger import get_logger
+from Mu2eCI.pr_snapshot import parse_datetime
+
+log = get_logger(__name__)
+
+# What the bot has done on each PR, kept between runs in an SQLite database
+# in the cache directory, so that a run can start from where the last one
+# stopped. GitHub stays the source of truth: whatever is missing here (on a
+# new machine, after the cache is cleared) is worked out from the PR's
+# comments and commit statuses as before.
+#
+#   pulls:      how far process_pr has got through the comments of each PR
+#               (see comment_cursor.py)
+#   triggers:   the tests triggered on each PR's head commit, with the base
+#               branch commit they were run against, and when
+#   reactions:  the comments the bot has acknowledged with a reaction
+#   pending_reactions:
+#               reactions that could not be made, to try again next run (the
+#               comments they are for are not fetched again)
+#   changes:    what each PR changes (see get_changes)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pulls (
+    repo TEXT NOT NULL,
+    pr INTEGER NOT NULL,
+    cursor TEXT,
+    last_comment_id INTEGER NOT NULL,
+    last_comment_time TEXT,
+    last_bot_comment_time TEXT,
+    bot_comments TEXT NOT NULL,
+    PRIMARY KEY (repo, pr)
+);
+CREATE TABLE IF NOT EXISTS triggers (
+    repo TEXT NOT NULL,
+    pr INTEGER NOT NULL,
+    sha TEXT NOT NULL,
+    test TEXT NOT NULL,
+    base_sha TEXT NOT NULL,
+    triggered_at TEXT NOT NULL,
+    PRIMARY KEY (repo, pr, sha, test)
+);
+CREATE TABLE IF NOT EXISTS reactions (
+    repo TEXT NOT NULL,
+    pr INTEGER NOT NULL,
+    comment_id INTEGER NOT NULL,
+    PRIMARY KEY (repo, pr, comment_id)
+);
+CREATE TABLE IF NOT EXISTS pending_reactions (
+    repo TEXT NOT NULL,
+    pr INTEGER NOT NULL,
+    comment_id INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    PRIMARY KEY (repo, pr, comment_id)
+);
+CREATE TABLE IF NOT EXISTS changes (
+    repo TEXT NOT NULL,
+    pr INTEGER NOT NULL,
+    head_sha TEXT NOT NULL,
+    base_ref TEXT NOT NULL,
+    config_version TEXT NOT NULL,
+    folders TEXT NOT NULL,
+    tests TEXT NOT NULL,
+    watchers TEXT NOT NULL,
+    PRIMARY KEY (repo, pr)
+);
+"""
+
+DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# triggered_at is naive UTC, by this machine's clock
+Trigger = namedtuple("Trigger", ["test", "base_sha", "triggered_at"])
+
+# The top-level folders a PR changes, the tests they require and the users
+# watching them, as of its head commit (and base branch) at the time
+Changes = namedtuple(
+    "Changes", ["head_sha", "base_ref", "folders", "tests", "watchers"]
+)
+
+# one connection per thread (and database, as MU2ECI_CACHE_DIR may change)
+_local = threading.local()
+_write_lock = threading.Lock()
+
+
+def _db_file():
+    return config.cache_path("state.sqlite3")
+
+
+def _connection():
+    path = _db_file()
+    connections = _local.__dict__.setdefault("connections", {})
+    if path not in connections:
+        # transactions are begun explicitly (see transaction())
+        connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        # a power cut may lose the last few writes, but not corrupt the
+        # database - and GitHub has the rest
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SCHEMA)
+        connections[path] = connection
+    return connections[path]
+
+
+@contextmanager
+def transaction():
+    # Runs on this machine write one at a time. The threads of one run take
+    # turns here rather than in SQLite's busy handler, which sleeps.
+    with _write_lock:
+        connection = _connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+
+def _format(value):
+    return value.strftime(DATETIME_FORMAT) if value is not None else None
+
+
+def load_cursor(repo_name, pr_number):
+    try:
+        row = (
+            _connection()
+            .execute(
+                "SELECT cursor, last_comment_id, last_comment_time, "
+                "last_bot_comment_time, bot_comments FROM pulls "
+                "WHERE repo = ? AND pr = ?",
+                (repo_name, pr_number),
+            )
+            .fetchone()
+        )
+    except sqlite3.Error:
+        log.exception("Could not read the comment cursor for PR #%s", pr_number)
+        return None
+    if row is None:
+        return None
+    return {
+        "cursor": row[0],
+        "last_comment_id": row[1],
+        "last_comment_time": parse_datetime(row[2]),
+        "last_bot_comment_time": parse_datetime(row[3]),
+        "bot_comments": json.loads(row[4]),
+    }
+
+
+def save_cursor(repo_name, pr_number, cursor):
+    try:
+        with transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO pulls VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    repo_name,
+                    pr_number,
+                    cursor["cursor"],
+                    cursor["last_comment_id"],
+                    _format(cursor["last_comment_time"]),
+                    _format(cursor["last_bot_comment_time"]),
+                    json.dumps(cursor["bot_comments"]),
+                ),
+            )
+    except sqlite3.Error:
+        log.exception("Could not save the comment cursor for PR #%s", pr_number)
+
+
+def get_triggers(repo_name, pr_number, sha):
+    # {test: Trigger} for the tests triggered on commit sha of the PR
+    try:
+        rows = (
+            _connection()
+            .execute(
+                "SELECT test, base_sha, triggered_at FROM triggers "
+                "WHERE repo = ? AND pr = ? AND sha = ?",
+                (repo_name, pr_number, sha),
+            )
+            .fetchall()
+        )
+    except sqlite3.Error:
+        log.exception("Could not read the tests triggered on PR #%s", pr_number)
+        return {}
+    return {
+        test: Trigger(test, base_sha, parse_datetime(triggered_at))
+        for test, base_sha, triggered_at in rows
+    }
+
+
+def record_triggers(repo_name, pr_number, sha, triggers, triggered_at):
+    # triggers: (test, base_sha) pairs. What was triggered on earlier
+    # commits of the PR no longer matters, and is dropped.
+    if not triggers:
+        return
+    try:
+        with transaction() as db:
+            db.execute(
+                "DELETE FROM triggers WHERE repo = ? AND pr = ? AND sha != ?",
+                (repo_name, pr_number, sha),
+            )
+            db.executemany(
+                "INSERT OR REPLACE INTO triggers VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (repo_name, pr_number, sha, test, base_sha, _format(triggered_at))
+                    for test, base_sha in triggers
+                ],
+            )
+    except sqlite3.Error:
+        log.exception("Could not save the tests triggered on PR #%s", pr_number)
+
+
+def get_reactions(repo_name, pr_number):
+    # ids of the comments on the PR the bot has reacted to
+    try:
+        rows = (
+            _connection()
+            .execute(
+                "SELECT comment_id FROM reactions WHERE repo = ? AND pr = ?",
+                (repo_name, pr_number),
+            )
+            .fetchall()
+        )
+    except sqlite3.Error:
+        log.exception("Could not read the reactions on PR #%s", pr_number)
+        return set()
+    return {comment_id for comment_id, in rows}
+
+
+def record_reactions(repo_name, pr_number, comment_ids):
+    if not comment_ids:
+        return
+    rows = [(repo_name, pr_number, comment_id) for comment_id in comment_ids]
+    try:
+        with transaction() as db:
+            db.executemany("INSERT OR IGNORE INTO reactions VALUES (?, ?, ?)", rows)
+            db.executemany(
+                "DELETE FROM pending_reactions "
+                "WHERE repo = ? AND pr = ? AND comment_id = ?",
+                rows,
+            )
+    except sqlite3.Error:
+        log.exception("Could not save the reactions on PR #%s", pr_number)
+
+
+def get_pending_reactions(repo_name, pr_number):
+    # {comment id: reaction} for the reactions on the PR that could not be made
+    try:
+        rows = (
+            _connection()
+            .execute(
+                "SELECT comment_id, content FROM pending_reactions "
+                "WHERE repo = ? AND pr = ?",
+                (repo_name, pr_number),
+            )
+            .fetchall()
+        )
+    except sqlite3.Error:
+        log.exception("Could not read the pending reactions on PR #%s", pr_number)
+        return {}
+    return dict(rows)
+
+
+def record_pending_reactions(repo_name, pr_number, reactions):
+    # reactions: {comment id: reaction}
+    if not reactions:
+        return
+    try:
+        with transaction() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO pending_reactions VALUES (?, ?, ?, ?)",
+                [
+                    (repo_name, pr_number, comment_id, content)
+                    for comment_id, content in reactions.items()
+                ],
+            )
+    except sqlite3.Error:
+        log.exception("Could not save the pending reactions on PR #%s", pr_number)
+
+
+def get_changes(repo_name, pr_number, config_version):
+    # The Changes last saved for the PR, or None. The file list of a PR only
+    # changes with its head commit (or base branch), so while they are the
+    # same the files need not be fetched again. Changes derived from other
+    # config than config_version (see config.version) are not returned.
+    try:
+        row = (
+            _connection()
+            .execute(
+                "SELECT head_sha, base_ref, folders, tests, watchers FROM changes "
+                "WHERE repo = ? AND pr = ? AND config_version = ?",
+                (repo_name, pr_number, config_version),
+            )
+            .fetchone()
+        )
+    except sqlite3.Error:
+        log.exception("Could not read the changes of PR #%s", pr_number)
+        return None
+    if row is None:
+        return None
+    head_sha, base_ref, folders, tests, watchers = row
+    return Changes(
+        head_sha, base_ref, json.loads(folders), json.loads(tests), json.loads(watchers)
+    )
+
+
+def save_changes(repo_name, pr_number, config_version, changes):
+    try:
+        with transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO changes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    repo_name,
+                    pr_number,
+                    changes.head_sha,
+                    changes.base_ref,
+                    config_version,
+                    json.dumps(sorted(changes.folders)),
+                    json.dumps(list(changes.tests)),
+                    json.dumps(sorted(changes.watchers)),
+                ),
+            )
+    except sqlite3.Error:
+        log.exception("Could not save the changes of PR #%s", pr_number)
+
+
+def forget(repo_name, pr_number):
+    # Drop the triggers, reactions and changes of a closed PR. The comment
+    # cursor is kept, in case it is reopened.
+    try:
+        with transaction() as db:
+            for table in ("triggers", "reactions", "pending_reactions", "changes"):
+                db.execute(
+                    "DELETE FROM %s WHERE repo = ? AND pr = ?" % table,
+                    (repo_name, pr_number),
+                )
+    except sqlite3.Error:
+        log.exception("Could not drop the state of PR #%s", pr_number)
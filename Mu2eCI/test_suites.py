@@ -1,6 +1,9 @@
 import re
+from datetime import datetime
 from Mu2eCI import config
-from Mu2eCI.logger import log
+from Mu2eCI.logger import get_logger
+
+log = get_logger(__name__)
 
 MU2E_BOT_USER = config.main["bot"]["username"]  # "FNALbuild"
 
@@ -61,12 +64,14 @@ regex_mentioned = re.compile(TEST_MENTIONED, re.I | re.M)
 VALID_PR_SPEC = re.compile(r"^(Mu2e\/|)(?P<repo>[A-Za-z0-9_\-]+|)#(?P<pr_id>[0-9]+)$")
 
 
-SUPPORTED_TESTS = ["build", "code checks", "validation"]
-DEFAULT_TESTS = ["build"]
+SUPPORTED_TESTS = config.SUPPORTED_TESTS
 
-# Whether to trigger the tests in DEFAULT_TESTS when a PR is opened
+# Whether to trigger the tests a PR requires (see get_tests_for) when it is opened
 AUTO_TRIGGER_ON_OPEN = True
 
+# characters that make a path in config/test_rules.yaml a glob pattern
+GLOB_CHARS = set("*?[")
+
 TEST_ALIASES = {
     "build": ["mu2e/buildtest"],
     "code checks": ["mu2e/codechecks"],
@@ -98,18 +103,150 @@ def process_custom_test_request(matched_re):
     return [testlist, "current"]
 
 
-def get_tests_for(monorepo_packages):
-    # takes a list of top-level folders in Offline and returns
-    # the tests required for them
-    # returns DEFAULT_TESTS for now
+def _class_to_regex(part):
+    # [abc], [a-z] or [!abc] (also [^abc]), which never match '/'
+    negate = part[1] in "!^"
+    body = part[2 if negate else 1 : -1]
+    if not body:
+        return re.escape(part)
+    for char in "\\[]&~|":
+        body = body.replace(char, "\\" + char)
+    return "[^/%s]" % body if negate else "(?!/)[%s]" % body
+
+
+def glob_to_regex(pattern):
+    # the regular expression for a path pattern of config/test_rules.yaml
+    if "/" not in pattern:
+        pattern = "**/" + pattern
+    # a ']' straight after '[' or '[!' is part of the class, as in fnmatch
+    parts = re.split(r"(\*\*/|\*\*|\*|\?|\[[!^]?\]?[^\]]*\])", pattern)
+    wildcards = {"**/": "(?:.*/)?", "**": ".*", "*": "[^/]*", "?": "[^/]"}
+    return (
+        "".join(
+            (
+                _class_to_regex(part)
+                if part.startswith("[") and len(part) > 2 and part.endswith("]")
+                else wildcards.get(part, re.escape(part))
+            )
+            for part in parts
+        )
+        + "$"
+    )
+
 
-    return DEFAULT_TESTS
+class TestRules:
+    """
+    The test rules config, compiled once (see config/test_rules.yaml).
+
+    Each rule's patterns are indexed by kind: file names and extensions
+    (*.md) in dicts keyed by name or extension, whole packages (Pkg/** or
+    'packages') in a dict keyed by top-level folder, and any other globs
+    combined into one regular expression per rule. A path needs the tests of
+    the first rule it matches, so the regular expressions are only tried
+    for rules before the first one found in the dicts.
+    An unknown test or bad pattern raises ValueError when the index is built.
+    """
+
+    def __init__(self, rules):
+        rules = rules or {}
+        self.default = self._tests(rules.get("default", ["build"]))
+        self.tests = []
+        self.names = {}
+        self.extensions = {}
+        self.packages = {}
+        self.regexes = []
+
+        for i, rule in enumerate(rules.get("rules") or []):
+            self.tests.append(self._tests(rule.get("tests")))
+            for package in rule.get("packages") or []:
+                self.packages.setdefault(str(package), i)
+            globs = []
+            for pattern in rule.get("paths") or []:
+                pattern = str(pattern).strip("/")
+                head, slash, tail = pattern.partition("/")
+                if not GLOB_CHARS.intersection(pattern) and not slash:
+                    self.names.setdefault(pattern, i)
+                elif (
+                    pattern.startswith("*.")
+                    and not GLOB_CHARS.intersection(pattern[1:])
+                    and "." not in pattern[2:]
+                    and not slash
+                ):
+                    self.extensions.setdefault(pattern[1:], i)
+                elif tail == "**" and not GLOB_CHARS.intersection(head):
+                    self.packages.setdefault(head, i)
+                else:
+                    globs.append(glob_to_regex(pattern))
+            if globs:
+                combined = "|".join("(?:%s)" % g for g in globs)
+                try:
+                    self.regexes.append((i, re.compile(combined)))
+                except re.error as e:
+                    raise ValueError("Bad path pattern in test rule %d: %s" % (i, e))
+
+    @staticmethod
+    def _tests(tests):
+        tests = list(tests or [])
+        unknown = set(tests) - set(SUPPORTED_TESTS)
+        if unknown:
+            raise ValueError("Unknown tests in test rules: %s" % ", ".join(unknown))
+        return tests
+
+    def rule_for(self, path):
+        # the index of the first rule matching path, or None
+        folder, slash, _ = path.partition("/")
+        name = path.rpartition("/")[2]
+        found = [
+            self.names.get(name),
+            self.packages.get(folder if slash else "/"),
+            self.extensions.get("." + name.rpartition(".")[2] if "." in name else None),
+        ]
+        first = min((i for i in found if i is not None), default=None)
+        for i, regex in self.regexes:
+            if first is not None and i > first:
+                break
+            if regex.match(path):
+                return i
+        return first
+
+    def tests_for(self, paths):
+        # the tests required by changes to paths, in SUPPORTED_TESTS order
+        required = set()
+        rules = set()
+        for path in paths:
+            rule = self.rule_for(path)
+            if rule is None:
+                required.update(self.default)
+            elif rule not in rules:
+                rules.add(rule)
+                required.update(self.tests[rule])
+            if len(required) == len(SUPPORTED_TESTS):
+                break
+        return [test for test in SUPPORTED_TESTS if test in required]
+
+
+def get_test_rules():
+    # built once per change to config/test_rules.yaml (see config.compiled)
+    return config.compiled("test_rules", TestRules)
+
+
+def get_tests_for(paths):
+    # the tests required by a PR changing the given files
+    return get_test_rules().tests_for(paths)
 
 
 def get_stall_time(name):
     return 3600  # tests usually return results within an hour
 
 
+def has_stalled(name, status_time, now=None):
+    # whether a triggered test, whose status was last updated at
+    # status_time (naive UTC), should have reported back by now
+    if now is None:
+        now = datetime.utcnow()
+    return (now - status_time).total_seconds() > get_stall_time(name)
+
+
 def build_test_configuration(matched_re):
     # @FNALbuild build [with #257, #322, ...] [without merge]
     # @FNALbuild run build test[s] [with #257, #322, ...] [without merge]
@@ -0,0 +1,316 @@
+import os
+import re
+import time
+import threading
+import functools
+from contextlib import contextmanager
+
+from Mu2eCI import config
+from Mu2eCI.logger import get_logger
+
+log = get_logger(__name__)
+
+# Path segments that identify one object rather than a kind of request, and
+# what they are replaced with in endpoint names (so metrics keep few labels).
+# The segment after each of these is an identifier.
+ID_AFTER = {
+    "repos": "{owner}",
+    "orgs": "{org}",
+    "teams": "{team}",
+    "members": "{user}",
+    "memberships": "{user}",
+    "labels": "{name}",
+    "gists": "{id}",
+    "branches": "{branch}",
+    "job": "{job}",
+}
+SHA_RE = re.compile(r"^[0-9a-f]{40}$")
+GRAPHQL_COST_RE = re.compile(r'"rateLimit"\s*:\s*\{\s*"cost"\s*:\s*(\d+)')
+
+_local = threading.local()
+
+
+class CallStats:
+    __slots__ = ["calls", "pages", "errors", "latency", "cost"]
+
+    def __init__(self):
+        self.calls = 0
+        self.pages = 0
+        self.errors = 0
+        self.latency = 0.0
+        self.cost = 0
+
+    def add(self, other):
+        self.calls += other.calls
+        self.pages += other.pages
+        self.errors += other.errors
+        self.latency += other.latency
+        self.cost += other.cost
+
+
+class Span:
+    """
+    One phase of a run (e.g. the snapshot of a PR, or the writes at the end
+    of process_pr), with the API calls made during it and its sub-phases.
+    """
+
+    def __init__(self, name, detail=None, parent=None):
+        self.name = name
+        self.detail = detail
+        self.parent = parent
+        self.children = []
+        self.calls = {}  # endpoint -> CallStats
+        self.start = time.monotonic()
+        self.duration = None
+        self._lock = threading.Lock()
+        if parent is not None:
+            with parent._lock:
+                parent.children.append(self)
+
+    @property
+    def path(self):
+        if self.parent is None:
+            return self.name
+        return self.parent.path + "/" + self.name
+
+    def record(self, endpoint, latency, cost, page, error):
+        with self._lock:
+            stats = self.calls.get(endpoint)
+            if stats is None:
+                stats = self.calls[endpoint] = CallStats()
+            stats.calls += 1
+            stats.pages += page
+            stats.errors += error
+            stats.latency += latency
+            stats.cost += cost
+
+    def walk(self, depth=0):
+        yield depth, self
+        for child in list(self.children):
+            yield from child.walk(depth + 1)
+
+    def totals(self):
+        # (calls, rate limit cost) of this span and everything under it
+        calls = cost = 0
+        for _, span in self.walk():
+            calls += sum(s.calls for s in span.calls.values())
+            cost += sum(s.cost for s in span.calls.values())
+        return calls, cost
+
+
+def current_span():
+    stack = getattr(_local, "stack", None)
+    return stack[-1] if stack else None
+
+
+@contextmanager
+def span(name, detail=None):
+    # Time a phase, and attribute the API calls made in it (by this thread,
+    # or by functions passed through wrap()) to it. When the outermost span
+    # of a thread ends, the run is reported.
+    if getattr(_local, "stack", None) is None:
+        _local.stack = []
+    parent = current_span()
+    s = Span(name, detail, parent)
+    _local.stack.append(s)
+    try:
+        yield s
+    finally:
+        s.duration = time.monotonic() - s.start
+        _local.stack.pop()
+        if parent is None:
+            report(s)
+
+
+def wrap(fn):
+    # For work handed to other threads: run fn under the span current now.
+    parent = current_span()
+    if parent is None:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapped(*args, **kwargs):
+        previous = getattr(_local, "stack", None)
+        _local.stack = [parent]
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.stack = previous
+
+    return wrapped
+
+
+def endpoint_name(verb, url):
+    # e.g. GET /repos/{owner}/{repo}/issues/{n}/comments
+    path = url.split("://", 1)[-1]
+    path = path[path.find("/") :] if "/" in path else "/"
+    path, _, query = path.partition("?")
+    parts = path.strip("/").split("/")
+    for i, part in enumerate(parts):
+        if part.isdigit():
+            parts[i] = "{n}"
+        elif SHA_RE.match(part):
+            parts[i] = "{sha}"
+        elif i > 0 and parts[i - 1] in ID_AFTER:
+            parts[i] = ID_AFTER[parts[i - 1]]
+            if parts[i - 1] == "repos" and i + 1 < len(parts):
+                parts[i + 1] = "{repo}"
+    return "%s /%s" % (verb, "/".join(parts))
+
+
+def is_next_page(url):
+    # a request for the second or later page of a paginated listing
+    query = url.partition("?")[2]
+    for param in query.split("&"):
+        key, _, value = param.partition("=")
+        if key == "page" and value.isdigit() and int(value) > 1:
+            return True
+    return False
+
+
+def record_call(verb, url, status, latency, body=None, service="github"):
+    # Called for every HTTP request made to GitHub (see Mu2eCI.transport)
+    # or Jenkins. status is None if there was no response.
+    s = current_span()
+    if s is None:
+        return
+    cost = 0
+    if service == "github":
+        if url.endswith("/graphql"):
+            match = GRAPHQL_COST_RE.search(body or "")
+            cost = int(match.group(1)) if match else 1
+        elif status != 304:
+            # conditional requests answered with 304 are free
+            cost = 1
+    endpoint = endpoint_name(verb, url)
+    if service != "github":
+        endpoint = "%s %s" % (service, endpoint)
+    s.record(
+        endpoint,
+        latency,
+        cost,
+        is_next_page(url),
+        status is None or status >= 400,
+    )
+
+
+def summary(root):
+    lines = []
+    for depth, s in root.walk():
+        calls, cost = s.totals()
+        lines.append(
+            "%s%s%s  %.3fs  %d calls  cost %d"
+            % (
+                "  " * depth,
+                s.name,
+                " (%s)" % s.detail if s.detail else "",
+                s.duration or 0.0,
+                calls,
+                cost,
+            )
+        )
+        for endpoint, stats in sorted(s.calls.items()):
+            lines.append(
+                "%s  - %s: %d calls%s, %.3fs, cost %d%s"
+                % (
+                    "  " * depth,
+                    endpoint,
+                    stats.calls,
+                    " (%d next pages)" % stats.pages if stats.pages else "",
+                    stats.latency,
+                    stats.cost,
+                    ", %d errors" % stats.errors if stats.errors else "",
+                )
+            )
+    return "\n".join(lines)
+
+
+class Totals:
+    """
+    The phases and API calls of all the runs of one kind (the name of their
+    outermost span) made by this process, summed by phase and endpoint.
+    """
+
+    def __init__(self):
+        self.runs = 0
+        self.durations = {}  # phase -> seconds
+        self.calls = {}  # (phase, endpoint) -> CallStats
+
+    def add(self, root):
+        self.runs += 1
+        for _, s in root.walk():
+            duration = self.durations.get(s.path, 0.0)
+            self.durations[s.path] = duration + (s.duration or 0.0)
+            for endpoint, stats in s.calls.items():
+                key = (s.path, endpoint)
+                if key not in self.calls:
+                    self.calls[key] = CallStats()
+                self.calls[key].add(stats)
+
+
+# root span name -> Totals, written out by report()
+_totals = {}
+_totals_lock = threading.Lock()
+
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def prometheus_text(totals):
+    # metrics of the runs in totals, for node_exporter's textfile collector,
+    # which rejects files with more than one sample for a label set
+    metrics = {
+        "mu2eci_runs": ("Runs made by this process", [" %d" % totals.runs]),
+        "mu2eci_phase_duration_seconds": ("Wall time of each phase", []),
+        "mu2eci_api_calls": ("API requests made", []),
+        "mu2eci_api_pages": ("Requests for later pages of listings", []),
+        "mu2eci_api_errors": ("API requests that failed", []),
+        "mu2eci_api_latency_seconds": ("Total latency of API requests", []),
+        "mu2eci_api_rate_limit_cost": ("GitHub rate limit points used", []),
+    }
+    for phase, duration in sorted(totals.durations.items()):
+        metrics["mu2eci_phase_duration_seconds"][1].append(
+            '{phase="%s"} %f' % (_label(phase), duration)
+        )
+    for (phase, endpoint), stats in sorted(totals.calls.items()):
+        labels = '{phase="%s",endpoint="%s"}' % (_label(phase), _label(endpoint))
+        for metric, value in (
+            ("mu2eci_api_calls", stats.calls),
+            ("mu2eci_api_pages", stats.pages),
+            ("mu2eci_api_errors", stats.errors),
+            ("mu2eci_api_latency_seconds", stats.latency),
+            ("mu2eci_api_rate_limit_cost", stats.cost),
+        ):
+            metrics[metric][1].append("%s %s" % (labels, value))
+
+    lines = []
+    for metric, (help_text, samples) in metrics.items():
+        lines += ["# HELP %s %s" % (metric, help_text), "# TYPE %s gauge" % metric]
+        lines += [metric + sample for sample in samples]
+    return "\n".join(lines) + "\n"
+
+
+def report(root):
+    settings = config.main.get("tracing", {})
+    if settings.get("summary", True):
+        log.info("Trace:\n%s", summary(root))
+
+    textfile_dir = settings.get("textfile_dir")
+    if textfile_dir:
+        file_name = os.path.join(
+            os.path.expanduser(textfile_dir), "mu2eci_%s.prom" % root.name
+        )
+        tmp_name = "%s.%d.%d" % (file_name, os.getpid(), threading.get_ident())
+        # Runs in other threads (e.g. of the webhook server) add to the same
+        # totals, and write them out in turn, so that none is lost.
+        with _totals_lock:
+            totals = _totals.setdefault(root.name, Totals())
+            totals.add(root)
+            try:
+                with open(tmp_name, "w") as f:
+                    f.write(prometheus_text(totals))
+                # node_exporter must never see a half-written file
+                os.replace(tmp_name, file_name)
+            except OSError:
+                log.exception("Could not write %s", file_name)
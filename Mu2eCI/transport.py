@@ -0,0 +1,169 @@
+import time
+import threading
+
+from Mu2eCI import config
+from Mu2eCI import cassette
+from Mu2eCI import tracing
+from Mu2eCI.http_cache import ETagCache
+from Mu2eCI.ratelimit import RateLimiter
+
+# one pooled keep-alive session per (protocol, host, port), shared by every
+# connection object PyGithub creates
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+http_cache = None
+rate_limiter = None
+
+
+class Response:
+    # mimic the httplib response object, as PyGithub expects
+    def __init__(self, status, headers, text):
+        self.status = status
+        self.headers = headers
+        self.text = text
+
+    def getheaders(self):
+        return self.headers.items()
+
+    def read(self):
+        return self.text
+
+
+class Connection:
+    # mimic the httplib connection object, as PyGithub expects.
+    # A new one is created for each request (see install()), so
+    # request state is never shared between threads.
+    protocol = "https"
+    default_port = 443
+
+    def __init__(
+        self,
+        host,
+        port=None,
+        strict=False,
+        timeout=None,
+        retry=None,
+        pool_size=None,
+        **kwargs,
+    ):
+        self.host = host
+        self.port = port if port else self.default_port
+        self.timeout = timeout
+        self.verify = kwargs.get("verify", True)
+        self.session = get_session(self.protocol, host, self.port, retry, pool_size)
+
+    def request(self, verb, url, input, headers):
+        self.verb = verb
+        self.url = url
+        self.input = input
+        self.headers = headers
+
+    def getresponse(self):
+        url = f"{self.protocol}://{self.host}:{self.port}{self.url}"
+        headers = dict(self.headers)
+
+        cached = None
+        if http_cache is not None and self.verb == "GET":
+            cached = http_cache.lookup(url, self.headers)
+            if cached is not None:
+                headers.update(http_cache.conditional_headers(cached))
+
+        if rate_limiter is not None:
+            rate_limiter.acquire("graphql" if self.url.endswith("/graphql") else "core")
+
+        started = time.monotonic()
+        status = text = None
+        try:
+            r = self.session.request(
+                self.verb,
+                url,
+                headers=headers,
+                data=self.input,
+                timeout=self.timeout,
+                verify=self.verify,
+                allow_redirects=False,
+            )
+            status = r.status_code
+            response_headers = {k.lower(): v for k, v in r.headers.items()}
+            text = r.text
+        finally:
+            tracing.record_call(
+                self.verb, url, status, time.monotonic() - started, text
+            )
+
+        if rate_limiter is not None:
+            rate_limiter.update(response_headers)
+
+        if http_cache is not None and self.verb == "GET":
+            if status == 304 and cached is not None:
+                # unchanged: serve the stored body, with fresh rate limit headers
+                http_cache.record(hit=True)
+                status = 200
+                response_headers = dict(cached["headers"], **response_headers)
+                text = cached["body"]
+            else:
+                http_cache.record(hit=False)
+                http_cache.store(url, self.headers, status, response_headers, text)
+
+        return Response(status, response_headers, text)
+
+    def close(self):
+        return
+
+
+class HTTPConnection(Connection):
+    protocol = "http"
+    default_port = 80
+
+
+def get_session(protocol, host, port, retry=None, pool_size=None):
+    import requests
+
+    with _sessions_lock:
+        key = (protocol, host, port)
+        if key not in _sessions:
+            if pool_size is None:
+                pool_size = requests.adapters.DEFAULT_POOLSIZE
+            adapter = requests.adapters.HTTPAdapter(
+                max_retries=(
+                    requests.adapters.DEFAULT_RETRIES if retry is None else retry
+                ),
+                pool_connections=pool_size,
+                pool_maxsize=pool_size,
+            )
+            session = requests.Session()
+            session.mount(f"{protocol}://", adapter)
+            _sessions[key] = cassette.mount(session)
+        return _sessions[key]
+
+
+def install():
+    # Route all PyGithub traffic through Connection.
+    # PyGithub is only imported here, as it takes a while (see tests/test_import_time.py).
+    from github.Requester import Requester
+
+    global http_cache, rate_limiter
+    # A cassette has to hold every response, so none may come from the
+    # HTTP cache, and replayed requests are not paced.
+    if (
+        http_cache is None
+        and config.main["cache"]["http"]
+        and cassette.get_cassette() is None
+    ):
+        http_cache = ETagCache(config.cache_path("http"))
+        http_cache.prune(config.main["cache"]["http_max_age_days"])
+    if rate_limiter is None and not cassette.replaying():
+        rate_limiter = RateLimiter(
+            config.cache_path("ratelimit.json"),
+            config.main["rate_limit"]["burst"],
+            config.main["rate_limit"]["reserve"],
+        )
+    Requester.injectConnectionClasses(HTTPConnection, Connection)
+
+
+def github_client(token, **kwargs):
+    from github import Github
+
+    install()
+    return Github(login_or_token=token, retry=3, **kwargs)
@@ -0,0 +1,64 @@
+import re
+
+from Mu2eCI import config
+from Mu2eCI.logger import get_logger
+
+log = get_logger(__name__)
+
+# characters that make a watched 'package' a regular expression rather than
+# a plain top-level folder name
+REGEX_CHARS = set(".^$*+?{}[]\\|()")
+
+
+class WatcherIndex:
+    """
+    The watchers config (GitHub user -> list of packages), compiled once.
+
+    Plain package names go into a dict keyed by lower-case name, and the
+    regular expressions of each user are compiled case-insensitively. Like
+    re.match, both match at the start of a folder name. A bad regular
+    expression is logged and left out, and the user's other packages are
+    still watched.
+    """
+
+    def __init__(self, watchers):
+        self.names = {}
+        self.regexes = []
+
+        for user, packages in (watchers or {}).items():
+            patterns = []
+            for pkgpatt in packages or []:
+                pkgpatt = str(pkgpatt)
+                if not REGEX_CHARS.intersection(pkgpatt):
+                    self.names.setdefault(pkgpatt.lower(), set()).add(user)
+                    continue
+                try:
+                    patterns.append(re.compile(pkgpatt, re.I))
+                except re.error as e:
+                    log.error(
+                        "Ignoring bad regex for watching user %s: %s (%s)",
+                        user,
+                        pkgpatt,
+                        e,
+                    )
+            if patterns:
+                self.regexes.append((user, patterns))
+
+        self.longest_name = max((len(name) for name in self.names), default=0)
+
+    def match(self, folders):
+        # returns the users watching any of the given top-level folders
+        watching = set()
+        for target in folders:
+            target = target.lower().strip()
+            for i in range(min(len(target), self.longest_name) + 1):
+                watching.update(self.names.get(target[:i], ()))
+            for user, patterns in self.regexes:
+                if user not in watching and any(p.match(target) for p in patterns):
+                    watching.add(user)
+        return watching
+
+
+def get_watcher_index():
+    # built once per change to config/watchers.yaml (see config.compiled)
+    return config.compiled("watchers", WatcherIndex)
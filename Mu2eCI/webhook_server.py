@@ -0,0 +1,173 @@
+import os
+import hmac
+import json
+import hashlib
+import threading
+import socketserver
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from Mu2eCI import config
+from Mu2eCI.logger import get_logger
+from Mu2eCI.coalesce import Coalescer
+from Mu2eCI.process_pr import process_pr
+
+log = get_logger(__name__)
+
+
+def pr_from_payload(event, payload):
+    # Returns (repository, PR number) for a webhook payload that concerns
+    # a pull request, or None.
+    # Besides GitHub webhooks, {"repository": "Mu2e/Offline", "pr": 123}
+    # is accepted, for callers that know the PR already.
+    if "pr" in payload and isinstance(payload.get("repository"), str):
+        return payload["repository"], int(payload["pr"])
+
+    repository = payload.get("repository", {}).get("full_name")
+    if event in ("pull_request", "pull_request_review", "pull_request_review_comment"):
+        return repository, payload["pull_request"]["number"]
+    if event == "issue_comment" and "pull_request" in payload.get("issue", {}):
+        return repository, payload["issue"]["number"]
+    return None
+
+
+class Dispatcher:
+    """
+    Queue of PRs to process, and the worker threads that run process_pr on
+    them using one long-lived GitHub client. Events for the same PR that
+    arrive close together are coalesced into one run (see Coalescer).
+    """
+
+    def __init__(self, gh, workers=1, dryRun=False):
+        self.gh = gh
+        self.dryRun = dryRun
+        self.queue = Coalescer(
+            config.main["coalesce"]["quiet_window"],
+            config.main["coalesce"]["max_delay"],
+        )
+        self._repos = {}
+        self._repos_lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._work, daemon=True) for _ in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, repository, pr_number):
+        self.queue.submit((repository, pr_number))
+
+    def get_repo(self, repository):
+        with self._repos_lock:
+            if repository not in self._repos:
+                self._repos[repository] = self.gh.get_repo(repository)
+            return self._repos[repository]
+
+    def process(self, repository, pr_number):
+        log.info("Processing %s#%s", repository, pr_number)
+        repo = self.get_repo(repository)
+        # the open PRs re-checked after a merge join the queue, rather than
+        # being processed by this worker alongside the others
+        process_pr(
+            self.gh, repo, repo.get_issue(pr_number), self.dryRun, queue=self.submit
+        )
+
+    def _work(self):
+        while True:
+            repository, pr_number = self.queue.get()
+            try:
+                self.process(repository, pr_number)
+            except Exception:
+                log.exception("Failed to process %s#%s", repository, pr_number)
+            finally:
+                self.queue.done((repository, pr_number))
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    # set by make_server()
+    dispatcher = None
+    secret = None
+
+    def _reply(self, code, message):
+        body = (message + "\n").encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        if self.secret is not None:
+            signature = (
+                "sha256=" + hmac.new(self.secret, body, hashlib.sha256).hexdigest()
+            )
+            if not hmac.compare_digest(
+                signature, self.headers.get("X-Hub-Signature-256", "")
+            ):
+                self._reply(403, "Bad signature")
+                return
+
+        try:
+            payload = json.loads(body.decode("utf-8"))
+            target = pr_from_payload(self.headers.get("X-GitHub-Event"), payload)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self._reply(400, "Could not understand payload")
+            return
+
+        if target is None:
+            self._reply(202, "Ignored: not a pull request event")
+            return
+        if target[0] not in config.main["supported_repos"]:
+            self._reply(202, "Ignored: unsupported repository")
+            return
+
+        self.dispatcher.submit(*target)
+        self._reply(202, "Queued %s#%s" % target)
+
+    def log_message(self, format, *args):
+        log.debug("webhook server: " + format, *args)
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(
+    socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+):
+    daemon_threads = True
+
+    def get_request(self):
+        # Unix domain socket clients have no address
+        request, _ = super().get_request()
+        return request, ("local", 0)
+
+
+def make_server(dispatcher, address=None, unix_socket=None):
+    secret = os.environ.get("WEBHOOK_SECRET")
+    handler = type(
+        "Handler",
+        (WebhookHandler,),
+        {
+            "dispatcher": dispatcher,
+            "secret": secret.encode() if secret else None,
+        },
+    )
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = ThreadingUnixHTTPServer(unix_socket, handler)
+        log.info("Listening for webhooks on %s", unix_socket)
+    else:
+        server = ThreadingHTTPServer(address, handler)
+        log.info("Listening for webhooks on %s:%s", *server.server_address[:2])
+    return server
+
+
+def serve(gh, address=None, unix_socket=None, workers=1, dryRun=False):
+    dispatcher = Dispatcher(gh, workers=workers, dryRun=dryRun)
+    server = make_server(dispatcher, address, unix_socket)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,75 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs process_pr on a new PR, against a fake GitHub on a local port when
+# recording (argv: workdir), or from the cassette alone (argv: workdir, the
+# URL the fake GitHub had). The cassette is chosen by MU2ECI_RECORD or
+# MU2ECI_REPLAY, and is fixed for the life of a process, so each run is a
+# process of its own.
+RUN = """
+import sys
+from Mu2eCI import benchmark, cassette, config, transport
+from Mu2eCI.fake_server import FakeGitHubServer
+from Mu2eCI.process_pr import process_pr
+
+workdir = sys.argv[1]
+benchmark.setup_environment(workdir, watchers=10)
+benchmark.fresh_cache(workdir)
+if len(sys.argv) > 2:
+    url = sys.argv[2]
+else:
+    world, _, _ = benchmark.make_world(
+        benchmark.Scale(comments=5, statuses=3, files=10, watchers=10, open_prs=0)
+    )
+    url = FakeGitHubServer(world).start().url
+# Jenkins is asked for the build queue: the fake GitHub answers for it (404),
+# so that those requests are recorded too
+config.override("main", dict(config.main, jenkins_server=url))
+gh = transport.github_client("token", base_url=url)
+repo = gh.get_repo(benchmark.REPOSITORY)
+process_pr(gh, repo, repo.get_issue(1))
+tape = cassette.get_cassette()
+print(url, tape.replayed if tape.mode == "replay" else 0, tape.missing)
+"""
+
+
+class TestRecordAndReplay(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="mu2eci-test-")
+        self.cassette = os.path.join(self.tmp, "run.jsonl.gz")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def run_process_pr(self, mode, *args):
+        workdir = tempfile.mkdtemp(dir=self.tmp)
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        env.pop("MU2ECI_RECORD", None)
+        env.pop("MU2ECI_REPLAY", None)
+        env["MU2ECI_" + mode] = self.cassette
+        result = subprocess.run(
+            [sys.executable, "-c", RUN, workdir] + list(args),
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            timeout=120,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr[-3000:])
+        return result.stdout.split()
+
+    def test_replay_makes_the_recorded_requests(self):
+        url, _, _ = self.run_process_pr("RECORD")
+        _, replayed, missing = self.run_process_pr("REPLAY", url)
+        self.assertGreater(int(replayed), 0)
+        self.assertEqual(int(missing), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the scripts Jenkins runs for every event
+SCRIPTS = [
+    "process-pull-request",
+    "comment-github-pullrequest",
+    "get-pr-base-sha",
+    "report-test-status",
+]
+
+# milliseconds each script may spend importing, on top of the interpreter's
+# own start-up imports
+BUDGET = float(os.environ.get("MU2ECI_IMPORT_BUDGET", 150))
+
+# only imported once a GitHub client is made, or a config file has changed
+DEFERRED_MODULES = {"github", "requests", "urllib3", "yaml"}
+
+
+def import_times(args, cwd, env):
+    # {module: self import time in microseconds}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime"] + args,
+        cwd=cwd,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, _, module = line[len("import time:") :].split("|")
+        times[module.strip()] = int(self_us)
+    return times
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "python -X importtime needs Python 3.7")
+class TestScriptStartUp(unittest.TestCase):
+    """
+    Runs each script with --help under 'python -X importtime': it should not
+    go over the import budget, import one of the slow libraries that are only
+    loaded when needed, or write any files just by starting up.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.mkdtemp(prefix="mu2eci-test-")
+        cls.env = dict(os.environ, MU2ECI_CACHE_DIR=os.path.join(cls.workdir, "cache"))
+        cls.env["PYTHONPATH"] = os.pathsep.join(
+            [ROOT] + [p for p in [cls.env.get("PYTHONPATH")] if p]
+        )
+        cls.baseline = sum(import_times(["-c", "pass"], cls.workdir, cls.env).values())
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+
+    def test_scripts_start_quickly(self):
+        for script in SCRIPTS:
+            with self.subTest(script=script):
+                args = [os.path.join(ROOT, script), "--help"]
+                # once to fill the compiled config cache, then measure
+                import_times(args, self.workdir, self.env)
+                cwd = os.path.join(self.workdir, script)
+                os.mkdir(cwd)
+                times = import_times(args, cwd, self.env)
+
+                spent = (sum(times.values()) - self.baseline) / 1000.0
+                self.assertLessEqual(spent, BUDGET, "imports took %.0f ms" % spent)
+                self.assertEqual(sorted(DEFERRED_MODULES.intersection(times)), [])
+                self.assertEqual(sorted(os.listdir(cwd)), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import itertools
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, unquote
+
+from Mu2eCI.jenkins import JenkinsClient
+
+
+class FakeJenkins(ThreadingMixIn, HTTPServer):
+    """
+    Stands in for Jenkins on a local port: hands out CSRF crumbs and queues
+    builds of the jobs in 'jobs', recording what it was sent.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, jobs):
+        super().__init__(("127.0.0.1", 0), FakeJenkinsHandler)
+        self.jobs = jobs
+        self.crumb = "crumb-1"
+        self.crumb_requests = 0
+        self.builds = []
+        self.queue_ids = itertools.count(100)
+        # set to a threading.Barrier to hold builds until that many arrive
+        self.barrier = None
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d/" % self.server_port
+
+
+class FakeJenkinsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, code, body=b"", headers=None):
+        self.send_response(code)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/crumbIssuer/api/json":
+            return self.send(404)
+        with self.server.lock:
+            self.server.crumb_requests += 1
+        crumb = {"crumbRequestField": "Jenkins-Crumb", "crumb": self.server.crumb}
+        self.send(200, json.dumps(crumb).encode())
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.headers.get("Jenkins-Crumb") != self.server.crumb:
+            return self.send(403)
+        job = unquote(self.path.split("/")[2])
+        if job not in self.server.jobs:
+            return self.send(404)
+        if self.server.barrier is not None:
+            self.server.barrier.wait()
+        if self.server.jobs[job] == "no queue item":
+            # e.g. a login page in front of Jenkins
+            return self.send(200, b"<html></html>")
+        with self.server.lock:
+            queue_id = next(self.server.queue_ids)
+            self.server.builds.append((job, parse_qs(body.decode())))
+        location = "%squeue/item/%d/" % (self.server.url, queue_id)
+        self.send(201, headers={"Location": location})
+
+
+class TestJenkinsClient(unittest.TestCase):
+    def setUp(self):
+        self.jenkins = FakeJenkins(
+            {
+                "mu2e-build": "ok",
+                "mu2e-code-checks": "ok",
+                "mu2e login": "no queue item",
+            }
+        )
+        threading.Thread(target=self.jenkins.serve_forever, daemon=True).start()
+        self.client = JenkinsClient(self.jenkins.url, "user", "token", pool_size=4)
+
+    def tearDown(self):
+        self.client.session.close()
+        self.jenkins.shutdown()
+        self.jenkins.server_close()
+
+    def test_crumb_is_fetched_once(self):
+        self.client.build_with_parameters("mu2e-build", {"A": "1"})
+        self.client.build_with_parameters("mu2e-build", {"A": "2"})
+        self.assertEqual(self.jenkins.crumb_requests, 1)
+        self.assertEqual(
+            self.jenkins.builds,
+            [("mu2e-build", {"A": ["1"]}), ("mu2e-build", {"A": ["2"]})],
+        )
+
+    def test_crumb_is_fetched_again_after_403(self):
+        self.client.build_with_parameters("mu2e-build", {})
+        self.jenkins.crumb = "crumb-2"
+        self.assertEqual(self.client.build_with_parameters("mu2e-build", {}), 101)
+        self.assertEqual(self.jenkins.crumb_requests, 2)
+        self.assertEqual(len(self.jenkins.builds), 2)
+
+    def test_queue_id_is_read_from_location(self):
+        self.assertEqual(self.client.build_with_parameters("mu2e-build", {}), 100)
+        self.assertEqual(self.client.build_with_parameters("mu2e-code-checks", {}), 101)
+
+    def test_builds_are_queued_in_parallel(self):
+        # each build is held until all three have arrived
+        self.jenkins.barrier = threading.Barrier(3, timeout=10)
+        queue_ids = self.client.trigger_many(
+            [
+                ("mu2e-build", {"N": "1"}),
+                ("mu2e-build", {"N": "2"}),
+                ("mu2e-code-checks", {"N": "3"}),
+            ]
+        )
+        self.assertEqual(sorted(queue_ids), [100, 101, 102])
+        self.assertEqual(len(self.jenkins.builds), 3)
+
+    def test_failing_jobs_do_not_stop_the_others(self):
+        queue_ids = self.client.trigger_many(
+            [
+                ("mu2e-build", {}),
+                ("no such job", {}),
+                ("mu2e login", {}),
+                ("mu2e-code-checks", {}),
+            ]
+        )
+        self.assertEqual(queue_ids[1:3], [None, None])
+        self.assertEqual(sorted(queue_ids[::3]), [100, 101])
+        self.assertEqual(
+            sorted(job for job, _ in self.jenkins.builds),
+            ["mu2e-build", "mu2e-code-checks"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()